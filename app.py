@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import altair as alt
+import pyarrow as pa  # streamlit 의존성 — dict 행 목록을 열 단위로 적재할 때 사용
 from supabase import create_client
 from datetime import datetime, timedelta
+import functools
 import hashlib   # ✅ 반드시 추가
 
 # =========================
@@ -10,6 +13,10 @@ import hashlib   # ✅ 반드시 추가
 # =========================
 st.set_page_config(page_title="Capsule Price Intelligence", layout="wide")
 
+# 🔥 Altair json/url 트랜스포머는 Streamlit이 데이터 파일을 서빙하지 못해 사용 불가 —
+#    대신 행수 제한만 해제하고, 차트에는 인코딩에 쓰는 컬럼만 넘겨 페이로드를 줄인다
+alt.data_transformers.disable_max_rows()
+
 st.markdown("""
 <style>
 button[data-baseweb="tab"] {
@@ -38,14 +45,22 @@ def mk_widget_key(prefix: str, product_url: str, scope: str) -> str:
 # =========================
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
 SUPABASE_KEY = st.secrets["SUPABASE_ANON_KEY"]
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+@st.cache_resource
+def get_supabase():
+    """rerun마다 클라이언트/HTTP 세션을 재생성하지 않도록 공유 리소스로 캐시"""
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+supabase = get_supabase()
 
 # =========================
 # 2️⃣ 데이터 로딩
 # =========================
 
 
+@st.cache_data(ttl=300)
 def load_product_summary():
+    """요약 테이블 로딩 + 문자열 정규화 — rerun마다가 아니라 데이터 갱신 주기마다 1회 수행"""
     cols = [
         "product_url",
         "brand",
@@ -64,140 +79,472 @@ def load_product_summary():
         "capsule_count",        # ✅ 추가
     ]
     res = supabase.table("product_price_summary_enriched").select(", ".join(cols)).execute()
-    df = pd.DataFrame(res.data)
+    df = pa.Table.from_pylist(res.data or []).to_pandas()
+    if df.empty:
+        return df
     # 🔥 로딩 시점에 URL 정제
     df["product_url"] = df["product_url"].astype(str).str.strip("_").str.strip()
-    return df
+    # 🔥 의도 분기마다 전체 컬럼을 strip/lower로 재정규화하지 않도록 매칭 키를 캐시 안에서 1회 선계산
+    df["_url_key"] = df["product_url"].str.lower()
+
+    # -------------------------
+    # 브랜드 정규화
+    # -------------------------
+    df["brand"] = (
+        df["brand"]
+        .astype(str)
+        .str.strip()
+        .str.replace("�", "", regex=False)
+    )
 
-@st.cache_data(ttl=300)
-def load_events(product_url: str):
-    res = (
-        supabase.table("product_all_events")
-        .select("date, unit_price, event_type")
-        .eq("product_url", product_url)
-        .order("date", desc=True)
-        .execute()
+    df["brand"] = df["brand"].replace({
+        "네레": "네슬레",
+        "네스프레": "네스프레소",
+        "일리": "일리카페",
+        "카누": "카누 바리스타",
+        "카누 바스타": "카누 바리스타"
+    })
+
+    # -------------------------
+    # category1 정규화
+    # -------------------------
+    df["category1"] = (
+        df["category1"]
+        .astype(str)
+        .str.strip()
+        .str.replace("�", "", regex=False)
     )
-    return pd.DataFrame(res.data)
 
-@st.cache_data(ttl=300)
-def load_lifecycle_events(product_url: str):
-    res = (
-        supabase.table("product_lifecycle_events")
-        .select("date, lifecycle_event")
-        .eq("product_url", product_url)
-        .order("date", desc=True)
-        .execute()
+    # 카누 전용
+    df["category1"] = df["category1"].str.replace(
+        r"카.*바리스타.*캡슐",
+        "카누 바리스타 전용캡슐",
+        regex=True
+    ).str.replace("전용슐", "전용캡슐")
+
+    # 카누 네스프레소 호환
+    df["category1"] = df["category1"].str.replace(
+        r"카.*네스프레소.*캡슐",
+        "카누 네스프레소 호환캡슐",
+        regex=True
+    )
+
+    # 카누 돌체구스토 호환
+    df["category1"] = df["category1"].str.replace(
+        r"카.*돌체.*캡슐",
+        "카누 돌체구스토 호환캡슐",
+        regex=True
+    )
+
+    # 돌체구스토 통합
+    df["category1"] = df["category1"].str.replace(
+        r"돌체.*캡.*",
+        "돌체구스토 캡슐",
+        regex=True
+    )
+
+    # 스타벅스 오타 수정
+    df["category1"] = df["category1"].replace({
+        "스타벅스by네스프소": "스타벅스by네스프레소"
+    })
+
+    df["category2"] = (
+        df["category2"]
+        .astype(str)
+        .str.strip()
+        .str.replace("�", "", regex=False)
+    )
+
+    df["category2"] = df["category2"].replace({
+        "버츄": "버츄오",
+        "버추오": "버츄오",
+        "오리": "오리지널"
+    })
+
+    df["category2"] = df["category2"].replace({
+        "None": None
+    })
+
+    # 제품명 정제
+    df["product_name_raw"] = df["product_name"]
+    df["product_name"] = clean_product_names(df["product_name"])
+    df["category1"] = df["category1"].str.replace("전용슐", "전용캡슐", regex=False)
+    df["category2"] = df["category2"].str.replace("전용슐", "전용캡슐", regex=False)
+
+    # -------------------------
+    # 🔎 검색용 컬럼 생성 (공백 무시 검색)
+    # -------------------------
+    df["product_name_search"] = (
+        df["product_name"]
+        .astype(str)
+        .str.lower()
+        .str.replace(" ", "", regex=False)
+    )
+
+    df["brew_type_search"] = (
+        df["brew_type_kr"]
+        .astype(str)
+        .str.lower()
+        .str.replace(" ", "", regex=False)
+    )
+
+    df["category1_search"] = (
+        df["category1"]
+        .astype(str)
+        .str.lower()
+        .str.replace(" ", "", regex=False)
     )
-    return pd.DataFrame(res.data)
+
+    df["category2_search"] = (
+        df["category2"]
+        .astype(str)
+        .str.lower()
+        .str.replace(" ", "", regex=False)
+    )
+
+    # 🔎 통합 검색 blob — 5개 컬럼을 각각 정규화/스캔하는 대신 1개 컬럼 1회 스캔
+    df["search_blob"] = (
+        _norm_series(df["product_name"]) + "|"
+        + _norm_series(df["brand"]) + "|"
+        + _norm_series(df["category1"]) + "|"
+        + _norm_series(df["category2"]) + "|"
+        + _norm_series(df["brew_type_kr"])
+    )
+
+    # 🔥 고카디널리티 문자열은 Arrow-backed string으로 — contains/isin/groupby가
+    #    object-dtype 파이썬 루프 대신 C 커널로 동작 (pyarrow는 streamlit 의존성으로 항상 존재)
+    df = df.astype({
+        "product_url": "string[pyarrow]",
+        "_url_key": "string[pyarrow]",
+        "product_name_raw": "string[pyarrow]",
+        "product_name_search": "string[pyarrow]",
+        "brew_type_search": "string[pyarrow]",
+        "category1_search": "string[pyarrow]",
+        "category2_search": "string[pyarrow]",
+        "search_blob": "string[pyarrow]",
+    })
+
+    # 🔎 저카디널리티 문자열 컬럼 category 변환 (메모리 절감 + 정수 비교)
+    # 정규화가 모두 끝난 뒤 변환. ""를 카테고리에 포함시켜 이후 fillna("")가 동작하도록 함
+    for _c in ["brand", "category1", "category2", "brew_type_kr", "product_name"]:
+        df[_c] = df[_c].astype("category")
+        if "" not in df[_c].cat.categories:
+            df[_c] = df[_c].cat.add_categories([""])
+
+    # 정수 코드 — 체크박스 렌더 루프에서 문자열 해시 대신 int 멤버십 검사용
+    df["pid"] = pd.factorize(df["product_url"])[0]
+    return df
 
 # =========================
 # 🚀 BULK 로딩 (API 최소화용)
 # =========================
 
-@st.cache_data(ttl=300)
+def _urls_key(urls):
+    """벌크 로더 캐시 키 정규화 — 같은 선택이면 순서와 무관하게 캐시 적중"""
+    return tuple(sorted(set(urls)))
+
+
+@st.cache_data(ttl=300, show_spinner=False)
 def load_events_bulk(product_urls, date_from, date_to):
-    empty = pd.DataFrame(columns=["product_url", "date", "unit_price", "event_type"])
+    empty = pd.DataFrame(columns=["product_url", "date", "unit_price", "event_type", "event_date"])
     if not product_urls:
         return empty
-    res = (
+    q = (
         supabase.table("product_all_events")
         .select("product_url, date, unit_price, event_type")
         .in_("product_url", product_urls)
         .gte("date", date_from.strftime("%Y-%m-%d"))
         .lte("date", date_to.strftime("%Y-%m-%d"))
-        .execute()
+        .order("product_url", desc=False)
+        .order("date", desc=False)
     )
-    if not res.data:
+    rows = fetch_all(q)
+    if not rows:
         return empty
-    return pd.DataFrame(res.data)
+    # 🔥 dict 행 목록을 Arrow가 열 단위로 한 번에 적재 — pandas의 행 단위 dict 스캔 생략
+    df = pa.Table.from_pylist(rows).to_pandas()
+    # 🔥 캐시 안에서 1회만 캐스팅 — rerun마다 재변환하지 않고, float32로 차트 직렬화 바이트 절감
+    df["event_date"] = pd.to_datetime(df["date"], format="ISO8601", cache=True)
+    df["unit_price"] = pd.to_numeric(df["unit_price"], errors="coerce").astype("float32")
+    # 🔥 isin/groupby/비교가 C 커널로 동작하도록 캐스팅 — 저카디널리티 event_type은 category
+    df = df.astype({"product_url": "string[pyarrow]", "event_type": "category"})
+    return df
 
 
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=300, show_spinner=False)
 def load_lifecycle_bulk(product_urls, date_from, date_to):
     empty = pd.DataFrame(columns=["product_url", "date", "lifecycle_event"])
     if not product_urls:
         return empty
-    res = (
+    q = (
         supabase.table("product_lifecycle_events")
         .select("product_url, date, lifecycle_event")
         .in_("product_url", product_urls)
         .gte("date", date_from.strftime("%Y-%m-%d"))
         .lte("date", date_to.strftime("%Y-%m-%d"))
-        .execute()
+        .order("product_url", desc=False)
+        .order("date", desc=False)
     )
-    if not res.data:
+    rows = fetch_all(q)
+    if not rows:
         return empty
-    return pd.DataFrame(res.data)
+    df = pa.Table.from_pylist(rows).to_pandas()
+    df["date"] = pd.to_datetime(df["date"], format="ISO8601", errors="coerce", cache=True)
+    df = df.astype({"product_url": "string[pyarrow]", "lifecycle_event": "category"})
+    return df
+
 
+@st.cache_resource
+def _event_store():
+    """🔥 rerun 간 파싱 완료된 프레임 보관소 — cache_data는 적중 시에도 반환값을 deep-copy하므로
+    (url, 기간) 단위 프레임을 딕셔너리에 넣고 소비자에게 복사 없이 뷰를 공유한다"""
+    return {"events": {}, "life": {}}
+
+
+def _delta_load(kind, loader, urls_key, date_from, date_to):
+    """저장소에 없는 URL만 벌크로 추가 조회(delta-merge)하고 전체/제품별 프레임을 반환"""
+    if not urls_key:
+        return loader((), date_from, date_to), {}
+    store = _event_store()[kind]
+    if len(store) > 2000:  # 세션이 오래 살아도 무한히 커지지 않도록 보호
+        store.clear()
+    win_from = date_from.strftime("%Y-%m-%d")
+    win_to = date_to.strftime("%Y-%m-%d")
+    missing = [u for u in urls_key if (u, win_from, win_to) not in store]
+    if missing:
+        df_new = loader(_urls_key(missing), date_from, date_to)
+        parts = dict(tuple(df_new.groupby("product_url", sort=False))) if not df_new.empty else {}
+        empty = df_new.iloc[0:0]
+        for u in missing:
+            store[(u, win_from, win_to)] = parts.get(u, empty)
+    by_url = {u: store[(u, win_from, win_to)] for u in urls_key}
+    non_empty = [f for f in by_url.values() if not f.empty]
+    df_full = pd.concat(non_empty, ignore_index=True) if non_empty else next(iter(by_url.values()))
+    return df_full, {u: f for u, f in by_url.items() if not f.empty}
 
 
 @st.cache_data(ttl=300)
+def lifecycle_date_arrays(df_life_all: pd.DataFrame):
+    """제품별 품절/재입고 날짜를 정렬된 배열로 선계산 — UI 루프 안의 pandas 필터링 제거"""
+    out_map, restore_map = {}, {}
+    if df_life_all.empty:
+        return out_map, restore_map
+    # observed=True: lifecycle_event가 category여도 실제 존재하는 (url, 이벤트) 조합만 순회
+    for (url, ev_type), grp in df_life_all.groupby(["product_url", "lifecycle_event"], observed=True):
+        dates = grp["date"].dt.normalize().sort_values().to_numpy()
+        if ev_type == "OUT_OF_STOCK":
+            out_map[url] = dates
+        elif ev_type == "RESTOCK":
+            restore_map[url] = dates
+    return out_map, restore_map
+
+
+@st.cache_data(ttl=300, show_spinner=False)
 def load_raw_unit_bulk(product_urls, date_from, date_to):
-    empty = pd.DataFrame(columns=["product_url", "date", "unit_normal_price"])
+    empty = pd.DataFrame(columns=["product_url", "date", "unit_normal_price", "unit_sale_price"])
     if not product_urls:
         return empty
-    res = (
+    q = (
         supabase.table("raw_daily_prices_unit")
-        .select("product_url, date, unit_normal_price")
+        .select("product_url, date, unit_normal_price, unit_sale_price")
         .in_("product_url", product_urls)
         .gte("date", date_from.strftime("%Y-%m-%d"))
         .lte("date", date_to.strftime("%Y-%m-%d"))
-        .execute()
+        .order("product_url", desc=False)
+        .order("date", desc=False)
     )
-    if not res.data:
+    rows = fetch_all(q)
+    if not rows:
+        return empty
+    df = pa.Table.from_pylist(rows).to_pandas()
+    df["date"] = pd.to_datetime(df["date"], format="ISO8601", cache=True)
+    df["unit_normal_price"] = pd.to_numeric(df["unit_normal_price"], errors="coerce").astype("float32")
+    df["unit_sale_price"] = pd.to_numeric(df["unit_sale_price"], errors="coerce").astype("float32")
+    return df
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_raw_daily_bulk(product_urls, date_from: str, date_to: str):
+    """raw_daily_prices 벌크 1회 조회 — 카드/히스토리 영역의 제품별 SELECT 제거"""
+    empty = pd.DataFrame(columns=["product_url", "date", "normal_price", "sale_price"])
+    if not product_urls:
+        return empty
+    q = (
+        supabase.table("raw_daily_prices")
+        .select("product_url, date, normal_price, sale_price")
+        .in_("product_url", product_urls)
+        .gte("date", date_from)
+        .lte("date", date_to)
+        .order("product_url", desc=False)
+        .order("date", desc=False)
+    )
+    rows = fetch_all(q)
+    if not rows:
         return empty
-    return pd.DataFrame(res.data)
+    df = pa.Table.from_pylist(rows).to_pandas()
+    df["normal_price"] = pd.to_numeric(df["normal_price"], errors="coerce")
+    df["sale_price"] = pd.to_numeric(df["sale_price"], errors="coerce")
+    return df
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_normal_events_bulk(product_urls, date_from: str, date_to: str):
+    """product_normal_price_events 벌크 1회 조회 (url별 날짜 내림차순 행 목록)"""
+    if not product_urls:
+        return {}
+    q = (
+        supabase.table("product_normal_price_events")
+        # 🔥 소비처(카드/히스토리/엑셀)가 쓰는 컬럼만 직렬화 — select("*") 금지
+        .select("product_url, date, prev_price, normal_price")
+        .in_("product_url", product_urls)
+        .gte("date", date_from)
+        .lte("date", date_to)
+        .order("product_url", desc=False)
+        .order("date", desc=True)
+    )
+    out = {}
+    for r in fetch_all(q):
+        out.setdefault(r["product_url"], []).append(r)
+    return out
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_price_change_bulk(product_urls, date_from: str, date_to: str):
+    """할인가 변동 이벤트 벌크 1회 조회 (url별 행 목록)"""
+    if not product_urls:
+        return {}
+    q = (
+        supabase.table("product_price_change_events")
+        .select("product_url, date, price_change_type, unit_price, prev_price")
+        .in_("product_url", product_urls)
+        .in_("price_change_type", ["DISCOUNT_DOWN", "DISCOUNT_UP"])
+        .gte("date", date_from)
+        .lte("date", date_to)
+        .order("product_url", desc=False)
+        .order("date", desc=False)
+    )
+    out = {}
+    for r in fetch_all(q):
+        out.setdefault(r["product_url"], []).append(r)
+    return out
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def load_discount_periods_bulk(product_urls, date_from: str, date_to: str):
+    """raw_daily_prices 벌크 1회 조회로 제품별 할인 기간 계산 — 제품당 왕복 N회 제거"""
+    if not product_urls:
+        return {}
+    q = (
+        supabase.table("raw_daily_prices")
+        .select("product_url, date, normal_price, sale_price")
+        .in_("product_url", product_urls)
+        .gte("date", date_from)
+        .lte("date", date_to)
+        .order("product_url", desc=False)
+        .order("date", desc=False)
+    )
+    rows = fetch_all(q)
+    if not rows:
+        return {}
+
+    # 🔥 제품별 파이썬 상태기계 대신 전체 행에 대한 C 레벨 groupby 1회
+    #    비할인 행마다 그룹 id를 올리면 연속 할인 구간이 같은 (url, grp)로 묶인다
+    df = pa.Table.from_pylist(rows).to_pandas().sort_values(["product_url", "date"])
+    df["normal_price"] = pd.to_numeric(df["normal_price"], errors="coerce").fillna(0)
+    df["sale_price"] = pd.to_numeric(df["sale_price"], errors="coerce").fillna(0)
+    is_disc = (
+        (df["normal_price"] > 0)
+        & (df["sale_price"] > 0)
+        & (df["sale_price"] < df["normal_price"])
+    )
+    df["grp"] = (~is_disc).groupby(df["product_url"]).cumsum()
+
+    d = df[is_disc]
+    if d.empty:
+        return {}
+    periods = (
+        d.groupby(["product_url", "grp"])
+        .agg(
+            discount_start_date=("date", "first"),
+            discount_end_date=("date", "last"),
+            _last_price=("sale_price", "last"),
+        )
+        .reset_index()
+    )
+    return {
+        url: g[["discount_start_date", "discount_end_date", "_last_price"]].to_dict("records")
+        for url, g in periods.groupby("product_url")
+    }
 # =========================
 # 2-1️⃣ 질문 로그 저장
 # =========================
+@st.cache_resource
+def _log_executor():
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=2)
+
+
+def log_async(table: str, records):
+    """로그 insert를 백그라운드 스레드로 — 상호작용 rerun이 네트워크 RTT에 막히지 않게"""
+    def _do():
+        try:
+            supabase.table(table).insert(records).execute()
+        except Exception as e:
+            print(f"[LOG_ASYNC_ERROR] {table}: {e}")
+    _log_executor().submit(_do)
+
+
 def save_question_log(question: str, q_type: str, used_llm: bool, answer: str = None, filters: dict = None):
-    try:
-        log_data = {
-            "question_text": question,
-            "question_type": q_type,
-            "used_llm": used_llm,
-            "created_at": datetime.now().isoformat()
-        }
-        supabase.table("question_logs").insert(log_data).execute()
-    except Exception as e:
-        print("로그 저장 실패:", e)
+    log_data = {
+        "question_text": question,
+        "question_type": q_type,
+        "used_llm": used_llm,
+        "created_at": datetime.now().isoformat()
+    }
+    log_async("question_logs", log_data)
 
 
 # =========================
 # 2-2️⃣ 질문 처리 함수들
 # =========================
 
+brand_mapping = {
+    "카누": "카누 바리스타",
+    "카누바리스타": "카누 바리스타",
+    "카누 바리스타": "카누 바리스타",
+    "카누돌체구스토": "카누 돌체구스토",
+    "카누 돌체구스토": "카누 돌체구스토",
+
+    "네스프레소": "네스프레소",
+    "네슬레": "네슬레",
+
+    # 🔥 추가
+    "일리": "일리카페",
+    "일리카페": "일리카페",
+
+    "돌체구스토": "돌체구스토",
+    "돌체": "돌체구스토",
+
+    "스타벅스": "스타벅스",
+}
+
+# 공백 제거 키로 미리 구성 — 호출마다 dict 재생성/선형 스캔 방지
+BRAND_NS_LOOKUP = {k.replace(" ", ""): v for k, v in brand_mapping.items()}
+
 def normalize_brand_name(brand_query: str) -> str:
     brand_query = brand_query.lower().strip()
-    brand_mapping = {
-        "카누": "카누 바리스타",
-        "카누바리스타": "카누 바리스타",
-        "카누 바리스타": "카누 바리스타",
-        "카누돌체구스토": "카누 돌체구스토",
-        "카누 돌체구스토": "카누 돌체구스토",
-    
-        "네스프레소": "네스프레소",
-        "네슬레": "네슬레",
-    
-        # 🔥 추가
-        "일리": "일리카페",
-        "일리카페": "일리카페",
-    
-        "돌체구스토": "돌체구스토",
-        "돌체": "돌체구스토",
-    
-        "스타벅스": "스타벅스",
-    }
-    for key, value in brand_mapping.items():
-        if key.replace(" ", "") == brand_query.replace(" ", ""):
-            return value
-    return brand_query
+    return BRAND_NS_LOOKUP.get(brand_query.replace(" ", ""), brand_query)
 
 def extract_brand_from_question(q: str, df_all: pd.DataFrame) -> list:
     q_lower = q.lower()
-    brands = df_all["brand"].dropna().unique().tolist()
+    # 질문마다 unique()/lower() 재계산하지 않도록 로딩 시점 캐시 사용
+    if BRAND_LIST is not None:
+        brands = BRAND_LIST
+        brands_lower = BRAND_LIST_LOWER
+    else:
+        brands = df_all["brand"].dropna().unique().tolist()
+        brands_lower = [str(b).lower() for b in brands]
     matched_brands = []
 
     normalized = None
@@ -206,53 +553,23 @@ def extract_brand_from_question(q: str, df_all: pd.DataFrame) -> list:
             normalized = normalize_brand_name(key)
             break
 
-    for brand in brands:
-        brand_lower = brand.lower()
-
+    normalized_lower = normalized.lower() if normalized else None
+    for brand, brand_lower in zip(brands, brands_lower):
         if brand_lower in q_lower:
             matched_brands.append(brand)
 
-        elif normalized and brand_lower == normalized.lower():
+        elif normalized_lower and brand_lower == normalized_lower:
             matched_brands.append(brand)
 
     return matched_brands if matched_brands else None
-    
-    for brand in brands:
-        normalized = normalize_brand_name(q_lower)
-        if brand.lower() == normalized.lower():
-            matched_brands.append(brand)
-    if matched_brands:
-        return matched_brands
-    for brand in brands:
-        brand_lower = brand.lower()
-        brand_parts = brand_lower.split()
-        for part in brand_parts:
-            if len(part) >= 2 and part in q_lower:
-                if brand not in matched_brands:
-                    matched_brands.append(brand)
-                break
-    return matched_brands if matched_brands else None
 
 def extract_product_name_from_question(q: str) -> list:
-    exclude_words = [
-        "할인", "기간", "언제", "얼마", "가격", "제품",
-        "최저가", "최고가", "신제품", "품절", "복원", "중", "는", "은", "의",
-        "신상", "출시", "새로", "신규", "새로운", "처음",
-        "할인가", "정상가", "변동", "상승", "증가", "하락",
-        "비싼", "싼", "저렴", "최근", "알려줘", "보여줘",
-        "있어", "없어", "언제부터", "언제까지", "기간은", "얼마야",
-        "날짜", "할인률", "할인율", "높은", "낮은", "순위", "순서",
-        "상위", "하위", "개", "위", "등", "번째", "최대", "최소",
-        "많은", "적은", "전체", "모든", "모두", "모아", "알려",
-    ]
-    import re as _re
-    words = q.split()
     product_keywords = []
-    for word in words:
+    for word in q.split():
         # 숫자만 있거나 숫자+단위(개/위/등)면 제외
-        if _re.fullmatch(r"[0-9]+[개위등번]*", word):
+        if _NUM_UNIT_RE.fullmatch(word):
             continue
-        if len(word) >= 2 and not any(ex in word for ex in exclude_words):
+        if len(word) >= 2 and not _PRODUCT_EXCLUDE_RE.search(word):
             product_keywords.append(word)
     return product_keywords
 
@@ -277,88 +594,165 @@ def extract_top_n(q: str):
         return n, direction, "count"
     return None, None, None
 
+import re as _intent_re
+
+# classify_intent가 참조하는 전체 키워드 — 질문을 한 번만 스캔해서 전부 탐지
+_INTENT_KEYWORDS = sorted(set([
+    "날짜", "품절", "복원", "신제품", "출시",
+    "새로", "신규", "신상", "새롭게", "새로운", "처음",
+    "재입고", "입고", "돌아온", "후", "다시", "그후",
+    "할인", "할인가", "판매가", "정상가", "행사",
+    "기간", "언제", "변동", "증가", "않",
+    "률", "율", "퍼센트", "%",
+    "높은", "낮은", "최대", "최소", "최고", "최저",
+    "가장 많이", "가장 큰", "제일 큰", "가장 작은", "적은", "많이 바뀐",
+    "인상", "상승", "올랐", "올라", "인하", "하락", "내렸", "내려",
+    "최저가", "최고가",
+    "싼", "저렴", "비싼",
+    "가장 싼", "제일 싼", "가장 저렴", "제일 저렴", "가장 저렴한", "제일 저렴한",
+    "가장 비싼", "제일 비싼",
+]), key=len, reverse=True)
+
+# lookahead + 긴 키워드 우선 → 모든 시작 위치에서 최장 키워드 매칭
+_INTENT_KW_RE = _intent_re.compile(
+    "(?=(" + "|".join(map(_intent_re.escape, _INTENT_KEYWORDS)) + "))"
+)
+
+# 매칭된 키워드에 포함된 더 짧은 키워드도 함께 히트 처리 (예: "가장 저렴한" → "저렴")
+_INTENT_KW_CONTAINED = {
+    kw: [k2 for k2 in _INTENT_KEYWORDS if k2 != kw and k2 in kw]
+    for kw in _INTENT_KEYWORDS
+}
+
+# extract_product_name_from_question 제외어 — 단어마다 E회 substring 스캔 대신 1회 검색
+_PRODUCT_EXCLUDE_WORDS = [
+    "할인", "기간", "언제", "얼마", "가격", "제품",
+    "최저가", "최고가", "신제품", "품절", "복원", "중", "는", "은", "의",
+    "신상", "출시", "새로", "신규", "새로운", "처음",
+    "할인가", "정상가", "변동", "상승", "증가", "하락",
+    "비싼", "싼", "저렴", "최근", "알려줘", "보여줘",
+    "있어", "없어", "언제부터", "언제까지", "기간은", "얼마야",
+    "날짜", "할인률", "할인율", "높은", "낮은", "순위", "순서",
+    "상위", "하위", "개", "위", "등", "번째", "최대", "최소",
+    "많은", "적은", "전체", "모든", "모두", "모아", "알려",
+]
+_PRODUCT_EXCLUDE_RE = _intent_re.compile(
+    "|".join(map(_intent_re.escape, sorted(_PRODUCT_EXCLUDE_WORDS, key=len, reverse=True)))
+)
+_NUM_UNIT_RE = _intent_re.compile(r"[0-9]+[개위등번]*")
+
+def _scan_intent_keywords(q: str) -> set:
+    hits = set()
+    for m in _INTENT_KW_RE.finditer(q):
+        kw = m.group(1)
+        if kw not in hits:
+            hits.add(kw)
+            hits.update(_INTENT_KW_CONTAINED[kw])
+    return hits
+
+# rerun마다 같은 질문을 다시 스캔하지 않도록 순수 함수 결과를 메모이즈
+@functools.lru_cache(maxsize=256)
 def classify_intent(q: str):
     q = q.lower()
+    hits = _scan_intent_keywords(q)
+    h = hits.__contains__
 
-    if "날짜" in q:
-        if "품절" in q and "복원" in q:
+    if h("날짜"):
+        if h("품절") and h("복원"):
             return "OUT_AND_RESTORE_DATES"
-        if "품절" in q:
+        if h("품절"):
             return "OUT_DATES"
-        if "복원" in q:
+        if h("복원"):
             return "RESTORE_DATES"
-        if "신제품" in q or "출시" in q:
+        if h("신제품") or h("출시"):
             return "NEW_DATES"
 
-    if any(word in q for word in ["신제품", "새로", "신규", "출시", "신상"]) and "품절" in q:
+    if any(h(word) for word in ["신제품", "새로", "신규", "출시", "신상"]) and h("품절"):
         return "NEW_AND_OUT"
 
-    if "품절" in q and ("복원" in q or "재입고" in q):
-        if any(word in q for word in ["후", "다시", "그후"]):
+    if h("품절") and (h("복원") or h("재입고")):
+        if any(h(word) for word in ["후", "다시", "그후"]):
             return "RESTORE"
         return "OUT_AND_RESTORE"
 
-    if "할인" in q and ("기간" in q or "언제" in q):
+    if h("할인") and (h("기간") or h("언제")):
         return "DISCOUNT_PERIOD"
-    if "할인" in q and any(w in q for w in ["률", "율", "퍼센트", "%", "높은", "최대", "최고", "가장 많이", "가장 큰", "제일 큰", "낮은", "최저", "최소", "가장 작은", "적은"]):
+    if h("할인") and any(h(w) for w in ["률", "율", "퍼센트", "%", "높은", "최대", "최고", "가장 많이", "가장 큰", "제일 큰", "낮은", "최저", "최소", "가장 작은", "적은"]):
         return "DISCOUNT_RATE"
-    if any(kw in q for kw in ["할인가", "판매가"]) and any(w in q for w in ["인상", "상승", "올랐", "올라"]):
+    if any(h(kw) for kw in ["할인가", "판매가"]) and any(h(w) for w in ["인상", "상승", "올랐", "올라"]):
         return "DISCOUNT_PRICE_UP"
-    if any(kw in q for kw in ["할인가", "판매가"]) and any(w in q for w in ["인하", "하락", "내렸", "내려"]):
+    if any(h(kw) for kw in ["할인가", "판매가"]) and any(h(w) for w in ["인하", "하락", "내렸", "내려"]):
         return "DISCOUNT_PRICE_DOWN"
-    if "할인" in q and any(w in q for w in ["최저가", "가장 싼", "제일 싼", "가장 저렴", "제일 저렴"]):
+    if h("할인") and any(h(w) for w in ["최저가", "가장 싼", "제일 싼", "가장 저렴", "제일 저렴"]):
         return "PRICE_MIN"
-    if "할인" in q and any(w in q for w in ["최고가", "가장 비싼", "제일 비싼"]):
+    if h("할인") and any(h(w) for w in ["최고가", "가장 비싼", "제일 비싼"]):
         return "PRICE_MAX"
-    if "할인" in q or "행사" in q:
+    if h("할인") or h("행사"):
         return "DISCOUNT"
-    if any(word in q for word in ["신제품", "새롭게", "새로", "신규", "출시", "새로운", "처음", "신상"]):
+    if any(h(word) for word in ["신제품", "새롭게", "새로", "신규", "출시", "새로운", "처음", "신상"]):
         return "NEW"
-    if any(word in q for word in ["가장 싼", "제일 싼", "제일 저렴한", "가장 저렴한", "최저가"]):
+    if any(h(word) for word in ["가장 싼", "제일 싼", "제일 저렴한", "가장 저렴한", "최저가"]):
         return "PRICE_MIN"
-    if any(word in q for word in ["가장 비싼", "제일 비싼", "최고가"]):
+    if any(h(word) for word in ["가장 비싼", "제일 비싼", "최고가"]):
         return "PRICE_MAX"
-    if "판매가" in q:
-        if any(w in q for w in ["기간", "언제"]):
+    if h("판매가"):
+        if any(h(w) for w in ["기간", "언제"]):
             return "DISCOUNT_PERIOD"
-        if any(w in q for w in ["률", "율", "퍼센트", "%", "높은", "최대", "가장 많이"]):
+        if any(h(w) for w in ["률", "율", "퍼센트", "%", "높은", "최대", "가장 많이"]):
             return "DISCOUNT_RATE"
-        if any(w in q for w in ["변동", "상승", "인상", "올랐", "인하", "내렸"]):
+        if any(h(w) for w in ["변동", "상승", "인상", "올랐", "인하", "내렸"]):
             return "NORMAL_CHANGE"
-        if any(w in q for w in ["싼", "저렴", "최저"]):
+        if any(h(w) for w in ["싼", "저렴", "최저"]):
             return "PRICE_MIN"
-        if any(w in q for w in ["비싼", "최고"]):
+        if any(h(w) for w in ["비싼", "최고"]):
             return "PRICE_MAX"
         return "DISCOUNT"  # 판매가 조회 = 현재 할인 중인 제품 우선
-    if "정상가" in q and ("변동" in q or "상승" in q or "인상" in q or "올랐" in q or "인하" in q or "내렸" in q):
+    if h("정상가") and (h("변동") or h("상승") or h("인상") or h("올랐") or h("인하") or h("내렸")):
         return "NORMAL_CHANGE"
-    if any(word in q for word in ["상승", "증가"]) and "않" not in q:
+    if any(h(word) for word in ["상승", "증가"]) and not h("않"):
         return "PRICE_UP"
-    if "변동" in q or "많이 바뀐" in q:
+    if h("변동") or h("많이 바뀐"):
         return "VOLATILITY"
-    if any(word in q for word in ["복원", "재입고", "입고", "돌아온"]):
+    if any(h(word) for word in ["복원", "재입고", "입고", "돌아온"]):
         return "RESTORE"
-    if "품절" in q:
+    if h("품절"):
         return "OUT"
 
 
     return "UNKNOWN"
 
+# extract_period_from_question의 고정 문구 — 질문을 한 번만 스캔해서 전부 탐지
+_PERIOD_KEYWORDS = sorted([
+    "이번 주", "이번주", "이번 달", "이번달",
+    "최근 7일", "최근 일주일", "최근 1주일",
+    "최근 한 달", "최근 30일", "최근 1년",
+], key=len, reverse=True)
+_PERIOD_KW_RE = _intent_re.compile(
+    "(?=(" + "|".join(map(_intent_re.escape, _PERIOD_KEYWORDS)) + "))"
+)
+
 def extract_period_from_question(q: str, base_date=None):
-    import re
+    # 기준일을 일 단위 문자열로 키에 포함 — 자정이 지나면 캐시가 자연 무효화됨
     today = base_date if base_date else datetime.today()
+    return _extract_period_cached(q, today.strftime("%Y-%m-%d"))
+
+@functools.lru_cache(maxsize=256)
+def _extract_period_cached(q: str, today_str: str):
+    import re
+    today = datetime.strptime(today_str, "%Y-%m-%d")
     q_lower = q.lower()
+    hits = {m.group(1) for m in _PERIOD_KW_RE.finditer(q_lower)}
 
-    if any(w in q_lower for w in ["이번 주", "이번주"]):
+    if hits & {"이번 주", "이번주"}:
         return today - timedelta(days=7), today, "이번 주"
-    if any(w in q_lower for w in ["이번 달", "이번달"]):
+    if hits & {"이번 달", "이번달"}:
         from_dt = today.replace(day=1)
         return from_dt, today, f"{today.year}년 {today.month}월"
-    if any(w in q_lower for w in ["최근 7일", "최근 일주일", "최근 1주일"]):
+    if hits & {"최근 7일", "최근 일주일", "최근 1주일"}:
         return today - timedelta(days=7), today, "최근 7일 내"
-    if any(w in q_lower for w in ["최근 한 달", "최근 30일"]):
+    if hits & {"최근 한 달", "최근 30일"}:
         return today - timedelta(days=30), today, "최근 1개월 내"
-    if any(w in q_lower for w in ["최근 1년"]):
+    if "최근 1년" in hits:
         return today - timedelta(days=365), today, "최근 1년 내"
 
     # ✅ "최근 N개월" 통합 처리
@@ -388,7 +782,6 @@ def extract_period_from_question(q: str, base_date=None):
     if month_only_match:
         month = int(month_only_match.group(1))
         if 1 <= month <= 12:
-            today = base_date if base_date else datetime.today()
             year = today.year
             # 현재 월보다 미래면 작년으로
             if month > today.month:
@@ -399,13 +792,38 @@ def extract_period_from_question(q: str, base_date=None):
 
     return None
 
+# 로딩 완료 후 채워지는 brew_type 목록/매처 캐시 (extract_brew_type용)
+BREW_TYPE_LIST = None
+_BREW_KW_RE = None
+_BREW_KW_CONTAINED = {}
+
+# 로딩 완료 후 채워지는 브랜드 목록 캐시 (질문 파서용, 소문자 버전 포함)
+BRAND_LIST = None
+BRAND_LIST_LOWER = None
+
 def extract_brew_type(q: str, df_all: pd.DataFrame):
     q_lower = q.lower().replace(" ", "")  # 🔥 공백 제거
-    brew_list = df_all["brew_type_kr"].dropna().unique().tolist()
-    brand_list = [str(b).lower() for b in df_all["brand"].dropna().unique().tolist()]
+    # 질문마다 unique() 재계산하지 않도록 로딩 시점 캐시 사용
+    brew_list = BREW_TYPE_LIST if BREW_TYPE_LIST is not None else df_all["brew_type_kr"].dropna().unique().tolist()
+    brand_list = BRAND_LIST_LOWER if BRAND_LIST_LOWER is not None else [str(b).lower() for b in df_all["brand"].dropna().unique().tolist()]
+
+    # 🔥 brew별 in 검사 N회 대신 정규식 1패스로 히트 수집
+    if _BREW_KW_RE is not None and brew_list is BREW_TYPE_LIST:
+        hits = set()
+        for m in _BREW_KW_RE.finditer(q_lower):
+            nb = m.group(1)
+            if nb not in hits:
+                hits.add(nb)
+                hits.update(_BREW_KW_CONTAINED[nb])
+    else:
+        hits = {
+            brew.lower().replace(" ", "")
+            for brew in brew_list
+            if brew and brew.lower().replace(" ", "") in q_lower
+        }
 
     for brew in brew_list:
-        if brew and brew.lower().replace(" ", "") in q_lower:  # 🔥 공백 제거 후 비교
+        if brew and brew.lower().replace(" ", "") in hits:  # 🔥 공백 제거 후 비교
             if brew.lower() in brand_list:
                 continue
             return brew
@@ -441,7 +859,7 @@ def execute_rule(intent, question, df_summary, date_from=None, date_to=None, top
         # df_summary 기준 메타 정보 (동점 시 가나다순)
         url_meta = {}
         for _, row in df_summary.iterrows():
-            url_key = str(row["product_url"]).strip().lower()
+            url_key = row["_url_key"]
             url_meta[url_key] = (
                 str(row.get("brand") or ""),
                 str(row.get("category1") or ""),
@@ -490,9 +908,70 @@ def execute_rule(intent, question, df_summary, date_from=None, date_to=None, top
         result["text"] = _re.sub(r'[(][0-9]+개', f'({len(sliced)}개', result["text"])
     return result
 
+def fetch_all(query, page_size=1000):
+    """PostgREST 기본 행 한도를 넘는 결과를 .range() 페이지로 나눠 전부 수집
+
+    ⚠️ ORDER BY 없는 쿼리는 페이지 간 행 순서가 보장되지 않아 중복/누락이 생긴다 —
+    호출 전 반드시 .order()로 안정 정렬을 걸 것 (예: product_url, date)"""
+    rows = []
+    offset = 0
+    while True:
+        res = query.range(offset, offset + page_size - 1).execute()
+        data = res.data or []
+        rows.extend(data)
+        if len(data) < page_size:
+            break
+        offset += page_size
+    return rows
+
+
+def _query_events_scoped(table, select_cols, product_urls, date_from, date_to,
+                         lifecycle_event=None, event_type=None, chunk_size=200):
+    """이벤트 테이블을 df_work 범위 URL로 서버측 필터링해 조회 (IN 한도 대비 chunk 분할)"""
+    rows = []
+    for i in range(0, len(product_urls), chunk_size):
+        q = (
+            supabase.table(table)
+            .select(select_cols)
+            .in_("product_url", product_urls[i:i + chunk_size])
+        )
+        if lifecycle_event:
+            q = q.eq("lifecycle_event", lifecycle_event)
+        if event_type:
+            q = q.eq("event_type", event_type)
+        if date_from:
+            q = q.gte("date", date_from.strftime("%Y-%m-%d"))
+        if date_to:
+            q = q.lte("date", date_to.strftime("%Y-%m-%d"))
+        # 🔥 fetch_all 페이지 간 중복/누락 방지용 안정 정렬
+        q = q.order("product_url", desc=False).order("date", desc=False)
+        rows.extend(fetch_all(q))
+    return rows
+
+
+def _timeline_results(df, out_map, restore_map):
+    """품절/복원 이벤트를 시간순으로 엮어 (urls, product_details) 생성"""
+    urls = []
+    product_details = {}
+    for url in df["_url_key"]:
+        out_dates = sorted(out_map.get(url, []))
+        restore_dates = sorted(restore_map.get(url, []))
+        # 시간순 인터리브
+        all_events = (
+            [(d, "❌ 품절") for d in out_dates] +
+            [(d, "🔄 복원") for d in restore_dates]
+        )
+        all_events.sort(key=lambda x: x[0])
+        timeline_str = " → ".join([f"{label} {d}" for d, label in all_events])
+        urls.append(url)
+        product_details[url] = timeline_str
+    return urls, product_details
+
+
 def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=None):
 
-    df_work = df_summary.copy()
+    # 🔥 어떤 분기도 df_work를 제자리 수정하지 않음(전부 재바인딩) — 질문마다 전체 복사 불필요
+    df_work = df_summary
     brands = extract_brand_from_question(question, df_summary)
 
     if brands:
@@ -609,131 +1088,62 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         ]
         
         if product_keywords:
-            for kw in product_keywords:
-                mask = _norm_series(df_work["product_name"]).str.contains(kw, case=False)
-                df_work = df_work[mask]
-                if df_work.empty:
-                    break
+            # 🔥 키워드마다 재필터링하는 대신 lookahead AND 패턴으로 1회 스캔
+            and_pattern = "".join(
+                f"(?=.*{_intent_re.escape(kw)})" for kw in product_keywords
+            )
+            df_work = df_work[
+                _norm_series(df_work["product_name"]).str.contains(and_pattern, case=False, regex=True)
+            ]
     
         results = []
-        def calc_discount_periods_from_raw(product_url, date_from_str, date_to_str):
-            """raw_daily_prices에서 직접 할인 기간 계산"""
-            res = (
-                supabase.table("raw_daily_prices")
-                .select("date, normal_price, sale_price")
-                .eq("product_url", product_url)
+
+        date_from_str = (date_from if date_from else datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
+        date_to_str = (date_to if date_to else datetime.now()).strftime("%Y-%m-%d")
+
+        # 🔥 제품별 2회 왕복 대신 bulk .in_ 조회 2회로 일괄 수집 후 로컬 조인
+        bulk_urls = df_work["product_url"].drop_duplicates().tolist()
+
+        unit_rows_by_url = {}
+        if bulk_urls:
+            # 🔥 단발 .execute()는 PostgREST 행 한도에서 잘림 — 정렬 고정 후 페이지 수집
+            unit_q = (
+                supabase.table("raw_daily_prices_unit")
+                .select("product_url, date, unit_sale_price, unit_normal_price")
+                .in_("product_url", bulk_urls)
                 .gte("date", date_from_str)
                 .lte("date", date_to_str)
+                .order("product_url", desc=False)
                 .order("date", desc=False)
-                .execute()
             )
-            if not res.data:
-                return []
-            periods = []
-            start = None
-            prev_date = None
-            prev_normal = None
-            prev_sale = None
-            for r in res.data:
-                n = float(r["normal_price"]) if r["normal_price"] else 0
-                s = float(r["sale_price"]) if r["sale_price"] else 0
-                d = r["date"]
-                is_disc = n > 0 and s > 0 and s < n
-                if is_disc:
-                    if start is None:
-                        start = d
-                    prev_date = d
-                    prev_normal = n
-                    prev_sale = s
-                else:
-                    if start is not None:
-                        periods.append({
-                            "discount_start_date": start,
-                            "discount_end_date": prev_date,
-                            "normal_price": prev_normal,
-                            "sale_price": prev_sale,
-                        })
-                        start = None
-            if start is not None:
-                periods.append({
-                    "discount_start_date": start,
-                    "discount_end_date": prev_date,
-                    "normal_price": prev_normal,
-                    "sale_price": prev_sale,
-                })
-            return periods
+            for r in fetch_all(unit_q):
+                unit_rows_by_url.setdefault(r["product_url"], []).append(r)
 
-        date_from_str = (date_from if date_from else datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
-        date_to_str = (date_to if date_to else datetime.now()).strftime("%Y-%m-%d")
+        # 🔥 행 단위 파이썬 상태기계 대신 캐시·벡터화된 할인 기간 로더 재사용
+        #    (같은 시작/종료 페어링을 cumsum 그룹핑 1회로 계산)
+        discount_periods_map = load_discount_periods_bulk(
+            _urls_key(bulk_urls), date_from_str, date_to_str
+        )
 
-        for _, row in df_work.iterrows():
-            discount_periods = calc_discount_periods_from_raw(row["product_url"], date_from_str, date_to_str)
+        for raw_url in df_work["product_url"].drop_duplicates():
+            discount_periods = discount_periods_map.get(raw_url, [])
             if discount_periods:
+                _unit_rows = unit_rows_by_url.get(raw_url, [])
+                url = str(raw_url).strip().lower()
                 for period in discount_periods:
-                    # 할인가 조회
-                    discount_price_res = (
-                        supabase.table("product_all_events")
-                        .select("unit_price")
-                        .eq("product_url", row["product_url"])
-                        .eq("event_type", "DISCOUNT")
-                        .gte("date", period["discount_start_date"])
-                        .lte("date", period["discount_end_date"])
-                        .limit(1)
-                        .execute()
-                    )
-                    discount_price = float(discount_price_res.data[0]["unit_price"]) if discount_price_res.data else None
-    
-                    # ✅ 수정2: 정상가 조회 - 할인 직전 NORMAL 우선, 없으면 summary fallback
-                    normal_price = None
-                    normal_price_res = (
-                        supabase.table("product_all_events")
-                        .select("unit_price")
-                        .eq("product_url", row["product_url"])
-                        .eq("event_type", "NORMAL")
-                        .lt("date", period["discount_start_date"])
-                        .order("date", desc=True)
-                        .limit(1)
-                        .execute()
-                    )
-                    if normal_price_res.data:
-                        normal_price = float(normal_price_res.data[0]["unit_price"])
-                    
-                    # fallback: summary의 normal_unit_price
-                    if not normal_price or normal_price <= 0:
-                        v = float(row.get("normal_unit_price") or 0)
-                        if v > 0:
-                            normal_price = v
-    
-                    # ✅ 수정3: 가격 표시 형식 통일
-                    if normal_price and discount_price and normal_price > discount_price:
-                        discount_rate = (normal_price - discount_price) / normal_price * 100
-                        price_info = f"💰 정상가: {normal_price:,.1f}원 → 할인가: {discount_price:,.1f}원 ({discount_rate:.0f}% 할인)"
-                    elif discount_price:
-                        price_info = f"💰 할인가: {discount_price:,.1f}원 (정상가 정보 없음)"
-                    else:
-                        price_info = ""
-    
-                    url = str(row["product_url"]).strip().lower()
                     disp_start = max(period['discount_start_date'], date_from.strftime("%Y-%m-%d") if date_from else period['discount_start_date'])
                     disp_end = min(period['discount_end_date'], date_to.strftime("%Y-%m-%d") if date_to else period['discount_end_date'])
-                    
+
                     # ✅ 수정4: detail_str 형식도 통일
-                    # 기간 내 할인가 통계 조회
-                    stat_res = (
-                        supabase.table("raw_daily_prices_unit")
-                        .select("unit_sale_price, unit_normal_price")
-                        .eq("product_url", row["product_url"])
-                        .gte("date", disp_start)
-                        .lte("date", disp_end)
-                        .execute()
-                    )
-                    if stat_res.data:
+                    # 기간 내 할인가 통계 (일괄 조회분에서 슬라이스)
+                    stat_rows = [r for r in _unit_rows if disp_start <= r["date"] <= disp_end]
+                    if stat_rows:
                         sale_prices = [
-                            float(r["unit_sale_price"]) for r in stat_res.data
+                            float(r["unit_sale_price"]) for r in stat_rows
                             if r.get("unit_sale_price") and float(r["unit_sale_price"]) > 0
                         ]
                         norm_prices = [
-                            float(r["unit_normal_price"]) for r in stat_res.data
+                            float(r["unit_normal_price"]) for r in stat_rows
                             if r.get("unit_normal_price") and float(r["unit_normal_price"]) > 0
                         ]
                         if sale_prices and norm_prices:
@@ -750,35 +1160,27 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                             detail_str = f"📅 {disp_start} ~ {disp_end}"
                     else:
                         detail_str = f"📅 {disp_start} ~ {disp_end}"
-    
-                    results.append({
-                        "text": f"• {row['brand']} - {row['product_name']}\n"
-                                f"  📅 할인 기간: {disp_start} ~ {disp_end}\n"
-                                f"{price_info}",
-                        "product_url": url,
-                        "detail": detail_str,
-                    })
-    
+
+                    results.append((url, detail_str))
+
         if not results:
             return "해당 제품의 할인 기간 정보가 없습니다."
-        
+
         product_details = {}
-        for r in results:
-            url = r["product_url"]
-            new_detail = r["detail"]
+        for url, new_detail in results:
             if url in product_details:
                 # 중복 체크 후 추가
                 if new_detail not in product_details[url]:
                     product_details[url] += " / " + new_detail
             else:
                 product_details[url] = new_detail
-        
+
         seen = set()
         unique_products = []
-        for r in results:
-            if r["product_url"] not in seen:
-                seen.add(r["product_url"])
-                unique_products.append(r["product_url"])
+        for url, _ in results:
+            if url not in seen:
+                seen.add(url)
+                unique_products.append(url)
         
         return {
             "type": "product_list",
@@ -789,22 +1191,22 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
     
     if intent == "DISCOUNT_RATE":
         # 조회 기간 내 할인율 최대 제품 조회
-        res_d = supabase.table("product_all_events").select("product_url, unit_price, date").eq("event_type", "DISCOUNT")
-        res_n = supabase.table("product_all_events").select("product_url, unit_price, date").eq("event_type", "NORMAL")
-        if date_from:
-            res_d = res_d.gte("date", date_from.strftime("%Y-%m-%d"))
-            res_n = res_n.gte("date", date_from.strftime("%Y-%m-%d"))
-        if date_to:
-            res_d = res_d.lte("date", date_to.strftime("%Y-%m-%d"))
-            res_n = res_n.lte("date", date_to.strftime("%Y-%m-%d"))
-        res_d = res_d.execute()
-        res_n = res_n.execute()
+        # 🔥 전체 테이블 다운로드 후 파이썬 필터 대신 df_work URL 범위로 서버측 필터
+        scope_urls = df_work["product_url"].drop_duplicates().tolist()
+        rows_d = _query_events_scoped(
+            "product_all_events", "product_url, unit_price, date",
+            scope_urls, date_from, date_to, event_type="DISCOUNT",
+        )
+        rows_n = _query_events_scoped(
+            "product_all_events", "product_url, unit_price, date",
+            scope_urls, date_from, date_to, event_type="NORMAL",
+        )
 
-        df_discount = pd.DataFrame(res_d.data) if res_d.data else pd.DataFrame()
-        df_normal = pd.DataFrame(res_n.data) if res_n.data else pd.DataFrame()
+        df_discount = pd.DataFrame(rows_d) if rows_d else pd.DataFrame()
+        df_normal = pd.DataFrame(rows_n) if rows_n else pd.DataFrame()
         
         if not df_discount.empty:
-            df_discount["date"] = pd.to_datetime(df_discount["date"])
+            df_discount["date"] = pd.to_datetime(df_discount["date"], format="ISO8601")
         
             # 조회기간 필터
             df_discount = df_discount[
@@ -813,7 +1215,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             ]
         
         if not df_normal.empty:
-            df_normal["date"] = pd.to_datetime(df_normal["date"])
+            df_normal["date"] = pd.to_datetime(df_normal["date"], format="ISO8601")
         
             # 조회기간 필터
             df_normal = df_normal[
@@ -848,12 +1250,12 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                     normal_map[key] = p
 
         # df_work 기준 URL만 사용 (브랜드/키워드 필터 반영)
-        df_work_urls = set(df_work["product_url"].str.strip().str.lower().tolist())
+        df_work_urls = set(df_work["_url_key"])
 
         # summary의 normal_unit_price를 fallback 정상가로 미리 수집
         summary_normal = {}
         for _, row in df_work.iterrows():
-            url_key = str(row["product_url"]).strip().lower()
+            url_key = row["_url_key"]
             v = float(row.get("normal_unit_price") or 0)
             if v > 0:
                 summary_normal[url_key] = v
@@ -865,7 +1267,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         ]
         if missing_normal_urls:
             # 원본 URL로 변환
-            url_orig_map = {str(r["product_url"]).strip().lower(): r["product_url"] for r in (res_d.data or [])}
+            url_orig_map = {str(r["product_url"]).strip().lower(): r["product_url"] for r in (rows_d or [])}
             for url in missing_normal_urls:
                 orig_url = url_orig_map.get(url, url)
                 nr = supabase.table("product_all_events").select("unit_price").eq("product_url", orig_url).eq("event_type", "NORMAL").order("date", desc=True).limit(1).execute()
@@ -893,12 +1295,11 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         rate_list.sort(key=lambda x: -x[3])  # 높은 순 정렬 (top_n bottom이면 execute_rule에서 역방향 슬라이싱)
 
         urls = [r[0] for r in rate_list]
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(urls)].drop_duplicates(subset=["product_url"])
+        df = df_work[df_work["_url_key"].isin(urls)].drop_duplicates(subset=["product_url"])
 
-        results = []
         product_details = {}
         # 원본 URL 맵 (기간 조회용)
-        url_orig_map_for_period = {str(r["product_url"]).strip().lower(): r["product_url"] for r in (res_d.data or [])}
+        url_orig_map_for_period = {str(r["product_url"]).strip().lower(): r["product_url"] for r in (rows_d or [])}
         date_from_str2 = date_from.strftime("%Y-%m-%d") if date_from else (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d")
         date_to_str2 = date_to.strftime("%Y-%m-%d") if date_to else datetime.now().strftime("%Y-%m-%d")
 
@@ -934,7 +1335,6 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             return periods
 
         for url, disc_price, norm_price, rate in rate_list:
-            results.append({"product_url": url})
             orig_url = url_orig_map_for_period.get(url, url)
             periods2 = calc_disc_periods_simple(orig_url, date_from_str2, date_to_str2)
             if periods2:
@@ -953,7 +1353,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
 
         return {
             "type": "product_list",
-            "text": f"{period_label} 할인율 높은 제품 ({len(results)}개, 높은 순)",
+            "text": f"{period_label} 할인율 높은 제품 ({len(urls)}개, 높은 순)",
             "products": urls,
             "product_details": product_details,
         }
@@ -981,7 +1381,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                 if prices:
                     discount_map[str(orig_url).strip().lower()] = prices
 
-        df = df_work_dedup[df_work_dedup["product_url"].str.strip().str.lower().isin(discount_map.keys())]
+        df = df_work_dedup[df_work_dedup["_url_key"].isin(discount_map.keys())]
         if df.empty:
             return None
 
@@ -1134,7 +1534,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                     rate_str = f" ({(norm_price - disc_price) / norm_price * 100:.1f}%)" if norm_price > disc_price else ""
                     norm_str = f"{norm_price:,.1f}원 → " if norm_price > 0 else ""
                     detail = f"💰 {norm_str}{disc_price:,.1f}원{rate_str}"
-            results.append({"product_url": url})
+            results.append(url)
             product_details[url] = detail
 
         if not results:
@@ -1142,7 +1542,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         return {
             "type": "product_list",
             "text": f"{period_label} 할인 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
@@ -1164,11 +1564,11 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         # 🔥 브랜드 필터 유지
         df_hist = df_hist[
             df_hist["product_url"].astype(str).str.strip().str.lower()
-            .isin(df_work["product_url"].astype(str).str.strip().str.lower())
+            .isin(df_work["_url_key"])
         ]
         
 
-        df_hist["date"] = pd.to_datetime(df_hist["date"])
+        df_hist["date"] = pd.to_datetime(df_hist["date"], format="ISO8601")
         df_hist["unit_price"] = df_hist["unit_price"].astype(float)
     
         # 조회기간 필터
@@ -1193,50 +1593,55 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         # 🔥 브랜드 강제 유지
         df_low = df_low[
             df_low["product_url"].astype(str).str.strip().str.lower()
-            .isin(df_work["product_url"].astype(str).str.strip().str.lower())
+            .isin(df_work["_url_key"])
         ]
             
         results = []
         product_details = {}
-    
-        for url in df_low["product_url"].unique():
-    
-            row = df_work[df_work["product_url"] == url]
-            if row.empty:
-                continue
-    
-            row = row.iloc[0]
-    
-            df_prod = df_low[df_low["product_url"] == url]
-    
-            sd = df_prod["date"].min().date()
-            ed = df_prod["date"].max().date()
-    
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-    
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-    
-            url_key = str(url).strip().lower()
-    
-            results.append({"product_url": url_key})
-    
-            # 해당 날짜 raw 가격 조회
-            raw_min = (
+
+        # 🔥 동점 제품별 round-trip 대신 기간/최저가 구간을 groupby로 계산 + raw 일괄 조회
+        low_urls = df_low["product_url"].unique().tolist()
+        low_ranges = df_low.groupby("product_url")["date"].agg(["min", "max"])
+        raw_rows_by_url = {}
+        if low_urls:
+            # 🔥 단발 .execute()는 PostgREST 행 한도에서 잘림 — 정렬 고정 후 페이지 수집
+            raw_q = (
                 supabase.table("raw_daily_prices_unit")
-                .select("unit_normal_price, unit_sale_price")
-                .eq("product_url", url)
-                .gte("date", str(sd))
-                .lte("date", str(ed))
-                .order("unit_sale_price", desc=False)
-                .limit(1)
-                .execute()
+                .select("product_url, date, unit_normal_price, unit_sale_price")
+                .in_("product_url", low_urls)
+                .gte("date", str(low_ranges["min"].min().date()))
+                .lte("date", str(low_ranges["max"].max().date()))
+                .order("product_url", desc=False)
+                .order("date", desc=False)
             )
-            if raw_min.data:
-                rm = raw_min.data[0]
+            for r in fetch_all(raw_q):
+                raw_rows_by_url.setdefault(r["product_url"], []).append(r)
+
+        # 🔥 URL마다 df_work 전체를 boolean 마스크로 재스캔하지 않도록 set 멤버십으로 검사
+        df_work_url_set = set(df_work["product_url"])
+        for url in low_urls:
+
+            if url not in df_work_url_set:
+                continue
+
+            sd = low_ranges.loc[url, "min"].date()
+            ed = low_ranges.loc[url, "max"].date()
+
+            url_key = str(url).strip().lower()
+
+            results.append(url_key)
+
+            # 해당 날짜 raw 가격: 일괄 조회분에서 할인가 최저 행 선택
+            sd_str, ed_str = str(sd), str(ed)
+            cand = [
+                r for r in raw_rows_by_url.get(url, [])
+                if sd_str <= r["date"] <= ed_str
+            ]
+            if cand:
+                rm = min(
+                    cand,
+                    key=lambda r: float(r["unit_sale_price"]) if r.get("unit_sale_price") else float("inf"),
+                )
                 norm = float(rm["unit_normal_price"]) if rm.get("unit_normal_price") else None
                 disc = float(rm["unit_sale_price"]) if rm.get("unit_sale_price") else None
                 if norm and disc and norm > disc:
@@ -1253,7 +1658,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         return {
             "type": "product_list",
             "text": f"{period_label} 최저가 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
     
@@ -1274,11 +1679,11 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         # 🔥 브랜드 필터 유지
         df_hist = df_hist[
             df_hist["product_url"].astype(str).str.strip().str.lower()
-            .isin(df_work["product_url"].astype(str).str.strip().str.lower())
+            .isin(df_work["_url_key"])
         ]
         
 
-        df_hist["date"] = pd.to_datetime(df_hist["date"])
+        df_hist["date"] = pd.to_datetime(df_hist["date"], format="ISO8601")
         df_hist["unit_price"] = df_hist["unit_price"].astype(float)
     
         # 조회기간 필터
@@ -1299,24 +1704,25 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
     
         results = []
         product_details = {}
-    
+
+        # 🔥 url마다 전체 프레임 equality 스캔 대신 set 멤버십 + groupby 분할 1회
+        work_urls = set(df_work["product_url"])
+        hi_by_url = dict(tuple(df_hi.groupby("product_url", sort=False)))
+
         for url in df_hi["product_url"].unique():
-    
-            row = df_work[df_work["product_url"] == url]
-            if row.empty:
+
+            if url not in work_urls:
                 continue
-    
-            row = row.iloc[0]
-    
-            df_prod = df_hi[df_hi["product_url"] == url]
-    
+
+            df_prod = hi_by_url[url]
+
             sd = df_prod["date"].min().date()
             ed = df_prod["date"].max().date()
     
             url_key = str(url).strip().lower()
     
-            results.append({"product_url": url_key})
-    
+            results.append(url_key)
+
             raw_max = (
                 supabase.table("raw_daily_prices_unit")
                 .select("unit_normal_price, unit_sale_price")
@@ -1345,7 +1751,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         return {
             "type": "product_list",
             "text": f"{period_label} 최고가 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
@@ -1369,24 +1775,20 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         for r in res.data:
             key = str(r["product_url"]).strip().lower()
             out_map.setdefault(key, []).append(r["date"])
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(out_map.keys())]
+        df = df_work[df_work["_url_key"].isin(out_map.keys())]
         if df.empty:
             return "해당 제품의 품절 이력이 없습니다."
         results = []
         product_details = {}  # 🔥 추가
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
+        for url in df["_url_key"]:
             dates = sorted(out_map.get(url, []))
             date_str = ", ".join(dates)
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}\n  ❌ 품절 날짜: {date_str}",
-                "product_url": url
-            })
+            results.append(url)
             product_details[url] = f"❌ 품절 날짜: {date_str}"
         return {
             "type": "product_list",
             "text": f"품절 날짜 정보 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
@@ -1410,24 +1812,20 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         for r in res.data:
             key = str(r["product_url"]).strip().lower()
             restore_map.setdefault(key, []).append(r["date"])
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(restore_map.keys())]
+        df = df_work[df_work["_url_key"].isin(restore_map.keys())]
         if df.empty:
             return "해당 제품의 복원 이력이 없습니다."
         results = []
         product_details = {}  # 🔥 추가
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
+        for url in df["_url_key"]:
             dates = sorted(restore_map.get(url, []))
             date_str = ", ".join(dates)
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}\n  🔄 복원 날짜: {date_str}",
-                "product_url": url
-            })
+            results.append(url)
             product_details[url] = f"🔄 복원 날짜: {date_str}"
         return {
             "type": "product_list",
             "text": f"복원 날짜 정보 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
@@ -1451,24 +1849,21 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         for r in res.data:
             key = str(r["product_url"]).strip().lower()
             new_map.setdefault(key, []).append(r["date"])
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(new_map.keys())]
+        df = df_work[df_work["_url_key"].isin(new_map.keys())]
         if df.empty:
             return "해당 제품의 출시 이력이 없습니다."
         results = []
         product_details = {}  # 🔥 추가
-        for _, row in df.iterrows():
-            dates = sorted(new_map[row["product_url"]])
+        for raw_url in df["product_url"]:
+            dates = sorted(new_map[raw_url])
             date_str = ", ".join(dates)
-            url = str(row["product_url"])
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}\n  🆕 출시 날짜: {date_str}",
-                "product_url": url
-            })
+            url = str(raw_url)
+            results.append(url)
             product_details[url] = f"🆕 출시 날짜: {date_str}"  # 🔥 추가
         return {
             "type": "product_list",
             "text": f"출시 날짜 정보 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,  # 🔥 추가
         }
 
@@ -1511,14 +1906,13 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             restore_map.setdefault(key, []).append(r["date"])
 
         all_urls = set(list(out_map.keys()) + list(restore_map.keys()))
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(all_urls)]
+        df = df_work[df_work["_url_key"].isin(all_urls)]
         if df.empty:
             return "해당 제품의 품절 또는 복원 이력이 없습니다."
 
         results = []
         product_details = {}
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
+        for url in df["_url_key"]:
             out_dates = sorted(out_map.get(url, []))
             restore_dates = sorted(restore_map.get(url, []))
             all_events = (
@@ -1527,44 +1921,37 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             )
             all_events.sort(key=lambda x: x[0])
             timeline_str = " → ".join([f"{label} {d}" for d, label in all_events])
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}\n  {timeline_str}",
-                "product_url": url
-            })
+            results.append(url)
             product_details[url] = timeline_str
 
         return {
             "type": "product_list",
             "text": f"품절 및 복원 날짜 정보 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
     if intent == "NEW":
-        res = (
-            supabase.table("product_lifecycle_events")
-            .select("product_url, date")
-            .eq("lifecycle_event", "NEW_PRODUCT")
+        # 🔥 전체 테이블 다운로드 후 isin 대신 df_work URL로 서버측 필터
+        scope_urls = df_work["product_url"].drop_duplicates().tolist()
+        rows = _query_events_scoped(
+            "product_lifecycle_events", "product_url, date",
+            scope_urls, date_from, date_to, lifecycle_event="NEW_PRODUCT",
         )
-        if date_from:
-            res = res.gte("date", date_from.strftime("%Y-%m-%d"))
-        if date_to:
-            res = res.lte("date", date_to.strftime("%Y-%m-%d"))
-        res = res.execute()
-        if not res.data:
+        if not rows:
             return None
-        new_product_data = {str(r["product_url"]).strip().lower(): r["date"] for r in res.data}
+        new_product_data = {str(r["product_url"]).strip().lower(): r["date"] for r in rows}
 
         
         df = df_work[
-            df_work["product_url"].str.strip().str.lower().isin(new_product_data.keys())
+            df_work["_url_key"].isin(new_product_data.keys())
         ].copy()
         
         if df.empty:
             return None
         
         df = df.drop_duplicates(subset=["product_url"])
-        df["product_url_key"] = df["product_url"].astype(str).str.strip().str.lower()
+        df["product_url_key"] = df["_url_key"]
         df["launch_date"] = pd.to_datetime(df["product_url_key"].map(new_product_data))
         
         if any(k in question for k in ["순서","최신","최근"]):
@@ -1575,48 +1962,33 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         results = []
         product_details = {}
         
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
-            launch_date = row["launch_date"]
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-            product_name = row['product_name']
-            url = str(row["product_url"]).strip().lower()
+        for url in df["product_url_key"]:
             launch_date = new_product_data.get(url)
-            results.append({
-                "text": f"• {row['brand']} - {product_name}{category_str}\n  🆕 출시일: {launch_date}",
-                "product_url": url
-            })
+            results.append(url)
             product_details[url] = f"🆕 출시일: {launch_date}"
         if not results:
             return None
         return {
             "type": "product_list",
             "text": f"{period_label} 신제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
             "launch_dates": new_product_data
         }
 
     if intent == "OUT":
-        date_from_str = date_from.strftime("%Y-%m-%d") if date_from else None
-        date_to_str = date_to.strftime("%Y-%m-%d") if date_to else None
+        # 🔥 전체 테이블 다운로드 후 isin 대신 df_work URL로 서버측 필터
+        scope_urls = df_work["product_url"].drop_duplicates().tolist()
 
         # 1) product_lifecycle_events 에서 OUT_OF_STOCK / RESTOCK 수집
-        res_lc = supabase.table("product_lifecycle_events").select("product_url, date, lifecycle_event")
-        if date_from_str:
-            res_lc = res_lc.gte("date", date_from_str)
-        if date_to_str:
-            res_lc = res_lc.lte("date", date_to_str)
-        res_lc = res_lc.execute()
+        rows_lc = _query_events_scoped(
+            "product_lifecycle_events", "product_url, date, lifecycle_event",
+            scope_urls, date_from, date_to,
+        )
 
         out_map = {}
         restore_map = {}
-        for r in (res_lc.data or []):
+        for r in rows_lc:
             key = str(r["product_url"]).strip().lower()
             if r["lifecycle_event"] == "OUT_OF_STOCK":
                 out_map.setdefault(key, set()).add(r["date"])
@@ -1624,14 +1996,12 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                 restore_map.setdefault(key, set()).add(r["date"])
 
         # 2) product_price_change_events 에서 추가 품절(unit_price=0) / 복원(prev_price=0) 수집
-        res_pc = supabase.table("product_price_change_events").select("product_url, date, unit_price, prev_price")
-        if date_from_str:
-            res_pc = res_pc.gte("date", date_from_str)
-        if date_to_str:
-            res_pc = res_pc.lte("date", date_to_str)
-        res_pc = res_pc.execute()
-
-        for r in (res_pc.data or []):
+        rows_pc = _query_events_scoped(
+            "product_price_change_events", "product_url, date, unit_price, prev_price",
+            scope_urls, date_from, date_to,
+        )
+
+        for r in rows_pc:
             key = str(r["product_url"]).strip().lower()
             try:
                 cur = float(r["unit_price"]) if r["unit_price"] is not None else None
@@ -1651,122 +2021,60 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         restore_map = {k: sorted(v) for k, v in restore_map.items()}
 
         urls = list(out_map.keys())
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(urls)].drop_duplicates(subset=["product_url"])
+        df = df_work[df_work["_url_key"].isin(urls)].drop_duplicates(subset=["product_url"])
         if df.empty:
             return None
 
-        results = []
-        product_details = {}
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
-            out_dates = out_map.get(url, [])
-            restore_dates = restore_map.get(url, [])
-
-            all_events = (
-                [(d, "❌ 품절") for d in out_dates] +
-                [(d, "🔄 복원") for d in restore_dates]
-            )
-            all_events.sort(key=lambda x: x[0])
-            timeline_str = " → ".join([f"{label} {d}" for d, label in all_events])
-
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
+        result_urls, product_details = _timeline_results(df, out_map, restore_map)
 
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}{category_str}\n  {timeline_str}",
-                "product_url": url
-            })
-            product_details[url] = timeline_str
-
-        if not results:
+        if not result_urls:
             return None
         # 제품 수 기준 (품절 횟수 아님)
-        unique_product_count = len(set(r["product_url"] for r in results))
+        unique_product_count = len(set(result_urls))
         return {
             "type": "product_list",
             "text": f"{period_label} 품절 제품 ({unique_product_count}개)",
-            "products": [r["product_url"] for r in results],
+            "products": result_urls,
             "product_details": product_details,
         }
 
     if intent == "RESTORE":
-        res_restore = (
-            supabase.table("product_lifecycle_events")
-            .select("product_url, date")
-            .eq("lifecycle_event", "RESTOCK")
+        # 🔥 전체 테이블 다운로드 후 isin 대신 df_work URL로 서버측 필터
+        scope_urls = df_work["product_url"].drop_duplicates().tolist()
+        rows_restore = _query_events_scoped(
+            "product_lifecycle_events", "product_url, date",
+            scope_urls, date_from, date_to, lifecycle_event="RESTOCK",
         )
-        if date_from:
-            res_restore = res_restore.gte("date", date_from.strftime("%Y-%m-%d"))
-        if date_to:
-            res_restore = res_restore.lte("date", date_to.strftime("%Y-%m-%d"))
-        res_restore = res_restore.execute()
-        if not res_restore.data:
+        if not rows_restore:
             return None
 
-        res_out = (
-            supabase.table("product_lifecycle_events")
-            .select("product_url, date")
-            .eq("lifecycle_event", "OUT_OF_STOCK")
+        rows_out = _query_events_scoped(
+            "product_lifecycle_events", "product_url, date",
+            scope_urls, date_from, date_to, lifecycle_event="OUT_OF_STOCK",
         )
-        if date_from:
-            res_out = res_out.gte("date", date_from.strftime("%Y-%m-%d"))
-        if date_to:
-            res_out = res_out.lte("date", date_to.strftime("%Y-%m-%d"))
-        res_out = res_out.execute()
 
         restore_map = {}
-        for r in res_restore.data:
+        for r in rows_restore:
             key = str(r["product_url"]).strip().lower()
             restore_map.setdefault(key, []).append(r["date"])
         out_map = {}
-        for r in (res_out.data or []):
+        for r in rows_out:
             key = str(r["product_url"]).strip().lower()
             out_map.setdefault(key, []).append(r["date"])
 
         urls = list(restore_map.keys())
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(urls)]
+        df = df_work[df_work["_url_key"].isin(urls)]
         if df.empty:
             return None
 
-        results = []
-        product_details = {}
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
-            out_dates = sorted(out_map.get(url, []))
-            restore_dates = sorted(restore_map.get(url, []))
-            all_events = (
-                [(d, "❌ 품절") for d in out_dates] +
-                [(d, "🔄 복원") for d in restore_dates]
-            )
-            all_events.sort(key=lambda x: x[0])
-            timeline_str = " → ".join([f"{label} {d}" for d, label in all_events])
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-            product_name = row['product_name']
-            results.append({
-                "text": f"• {row['brand']} - {product_name}{category_str}\n  {timeline_str}",
-                "product_url": url
-            })
-            product_details[url] = timeline_str
+        result_urls, product_details = _timeline_results(df, out_map, restore_map)
 
-        if not results:
+        if not result_urls:
             return None
         return {
             "type": "product_list",
-            "text": f"{period_label} 복원 제품 ({len(results)}개)",
-            "products": [
-                str(r["product_url"]).strip().lower()
-                for r in results
-                if r.get("product_url")
-            ],
+            "text": f"{period_label} 복원 제품 ({len(result_urls)}개)",
+            "products": result_urls,
             "product_details": product_details,
         }
 
@@ -1804,43 +2112,16 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             restore_map.setdefault(key, []).append(r["date"])
 
         all_urls = set(list(out_map.keys()) + list(restore_map.keys()))
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(all_urls)]
+        df = df_work[df_work["_url_key"].isin(all_urls)]
         if df.empty:
             return "해당 기간 품절 또는 복원 제품이 없습니다."
 
-        results = []
-        product_details = {}
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
-            out_dates = sorted(out_map.get(url, []))
-            restore_dates = sorted(restore_map.get(url, []))
-            # 시간순 인터리브
-            all_events = (
-                [(d, "❌ 품절") for d in out_dates] +
-                [(d, "🔄 복원") for d in restore_dates]
-            )
-            all_events.sort(key=lambda x: x[0])
-            timeline_str = " → ".join([f"{label} {d}" for d, label in all_events])
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-            results.append({
-                "text": f"• {row['brand']} - {row['product_name']}{category_str}\n  {timeline_str}",
-                "product_url": url
-            })
-            product_details[url] = timeline_str
+        result_urls, product_details = _timeline_results(df, out_map, restore_map)
 
         return {
             "type": "product_list",
-            "text": f"{period_label} 품절/복원 제품 ({len(results)}개)",
-            "products": [
-                str(r["product_url"]).strip().lower()
-                for r in results
-                if r.get("product_url")
-            ],
+            "text": f"{period_label} 품절/복원 제품 ({len(result_urls)}개)",
+            "products": result_urls,
             "product_details": product_details,
         }
 
@@ -1870,43 +2151,23 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         out_data = {str(r["product_url"]).strip().lower(): r["date"] for r in (res_out.data or [])}
 
         all_urls = set(list(new_data.keys()) + list(out_data.keys()))
-        df = df_work[df_work["product_url"].str.strip().str.lower().isin(all_urls)]
+        df = df_work[df_work["_url_key"].isin(all_urls)]
         if df.empty:
             return "해당 기간 신제품 또는 품절 제품이 없습니다."
 
+        df_urls_norm = df["_url_key"]
+
         new_results = []
         product_details = {}  # 🔥 추가
-        for _, row in df[df["product_url"].str.strip().str.lower().isin(new_data)].iterrows():
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-            url = str(row["product_url"]).strip().lower()
-            new_results.append({
-                "text": f"• {row['brand']} - {row['product_name']}{category_str}\n  🆕 출시일: {new_data.get(url)}",
-                "product_url": url
-            })
+        for url in df_urls_norm[df_urls_norm.isin(new_data)]:
+            new_results.append(url)
             product_details[url] = f"🆕 출시일: {new_data.get(url)}"
 
         out_results = []
-        for _, row in df[df["product_url"].str.strip().str.lower().isin(out_data)].iterrows():
-            categories = []
-            if pd.notna(row.get("category1")) and row["category1"]:
-                categories.append(row["category1"])
-            if pd.notna(row.get("category2")) and row["category2"]:
-                categories.append(row["category2"])
-            category_str = f" [{' > '.join(categories)}]" if categories else ""
-            url = str(row["product_url"]).strip().lower()
-            out_results.append({
-                "text": f"• {row['brand']} - {row['product_name']}{category_str}\n  📅 품절일: {out_data.get(url)}",
-                "product_url": url
-            })
+        for url in df_urls_norm[df_urls_norm.isin(out_data)]:
+            out_results.append(url)
             product_details[url] = f"📅 품절일: {out_data.get(url)}"
 
-        all_results = new_results + out_results
-
         if new_results and out_results:
             text = f"🆕 신제품 ({len(new_results)}개) + ❌ 품절 ({len(out_results)}개)"
         elif new_results:
@@ -1919,13 +2180,9 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         return {
             "type": "product_list",
             "text": text,
-            "products": [
-                str(r["product_url"]).strip().lower()
-                for r in all_results
-                if r.get("product_url")
-            ],
-            "new_products": [str(r["product_url"]).strip().lower() for r in new_results],
-            "out_products": [str(r["product_url"]).strip().lower() for r in out_results],
+            "products": new_results + out_results,
+            "new_products": new_results,
+            "out_products": out_results,
             "product_details": product_details,  # 🔥 추가
         }
 
@@ -1950,7 +2207,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         product_events = {}  # url -> [(date, prev, curr, normal)]
         for row in chg_res.data:
             url = str(row["product_url"]).strip().lower()
-            product_row = df_work[df_work["product_url"].str.strip().str.lower() == url]
+            product_row = df_work[df_work["_url_key"] == url]
             if product_row.empty:
                 continue
 
@@ -1999,7 +2256,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                 )
 
             product_details[url] = " / ".join(parts)
-            results.append({"product_url": url})
+            results.append(url)
 
         # 판매가 인상/인하 질문이면 정상가 변동도 합치기
         if "판매가" in question:
@@ -2011,10 +2268,14 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                 .lte("date", date_to.strftime("%Y-%m-%d"))
                 .execute()
             )
+            # 🔥 행마다 URL 컬럼 전체를 재정규화하지 않도록 정규화 키 인덱스를 1회 구축
+            cc_by_url = (
+                df_work
+                .drop_duplicates("_url_key").set_index("_url_key")["capsule_count"]
+            )
             for row in (normal_chg_res.data or []):
                 url = str(row["product_url"]).strip().lower()
-                product_row = df_work[df_work["product_url"].str.strip().str.lower() == url]
-                if product_row.empty:
+                if url not in cc_by_url.index:
                     continue
                 prev_p = float(row["prev_price"])
                 curr_p = float(row["normal_price"])
@@ -2026,7 +2287,7 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                     continue
                 if intent == "DISCOUNT_PRICE_DOWN" and diff >= 0:
                     continue
-                cc = float(product_row.iloc[0].get("capsule_count") or 1)
+                cc = float(cc_by_url[url] or 1)
                 prev_unit = prev_p / cc
                 curr_unit = curr_p / cc
                 diff_pct = (curr_unit - prev_unit) / prev_unit * 100 if prev_unit > 0 else 0
@@ -2036,12 +2297,12 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
                     product_details[url] += f" / {entry}"
                 else:
                     product_details[url] = entry
-                    results.append({"product_url": url})
+                    results.append(url)
 
         return {
             "type": "product_list",
             "text": f"{period_label} 판매가 {direction} 제품 ({len(results)}개)" if "판매가" in question else f"{period_label} 할인가 {direction} 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
    
@@ -2061,34 +2322,45 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
             return "해당 기간 내 정상가 변동이 없습니다."
     
         df = pd.DataFrame(res.data)
-    
-        product_details = {}
-        results = []
-        for _, row in df.iterrows():
-            url = str(row["product_url"]).strip().lower()
-            # ✅ df_summary 대신 df_work 사용 (브랜드 필터 반영)
-            product_row = df_work[df_work["product_url"].str.strip().str.lower() == url]
-            if product_row.empty:
-                continue
-            diff = float(row["price_diff"])
-            arrow = "📈" if diff > 0 else "📉"
-            cc = float(product_row.iloc[0].get("capsule_count") or 1)
-            prev_unit = float(row["prev_price"]) / cc
-            curr_unit = float(row["normal_price"]) / cc
-            diff_unit = curr_unit - prev_unit
-            diff_pct = (diff_unit / prev_unit * 100) if prev_unit > 0 else 0
-            detail = f"{arrow} 정상가 {prev_unit:,.1f}원 → {curr_unit:,.1f}원 ({diff_pct:+.1f}%) | {row['date']}"
-            if url in product_details:
-                product_details[url] += f"  /  {detail}"
-            else:
-                product_details[url] = detail
-                results.append({"product_url": url})
+
+        # 🔥 이벤트 행마다 df_work 전체 스캔 대신 정규화 URL 인덱스를 1회 구성 (해시 조인)
+        # ✅ df_summary 대신 df_work 사용 (브랜드 필터 반영)
+        cc_by_url = (
+            df_work
+            .drop_duplicates("_url_key")
+            .set_index("_url_key")["capsule_count"]
+        )
+
+        # 🔥 행별 Python 루프 대신 열 단위 산술 + 벡터 문자열 결합으로 상세 문구 일괄 생성
+        df["_url_key"] = df["product_url"].astype(str).str.strip().str.lower()
+        df = df[df["_url_key"].isin(cc_by_url.index)]
+        if df.empty:
+            return "해당 기간 내 정상가 변동이 없습니다."
+        cc = pd.to_numeric(df["_url_key"].map(cc_by_url), errors="coerce")
+        cc = cc.mask(cc == 0).fillna(1.0)  # 캡슐 수 0/미상은 1개로 간주 (기존 `or 1`)
+        prev_unit = df["prev_price"].astype(float) / cc
+        curr_unit = df["normal_price"].astype(float) / cc
+        diff_pct = ((curr_unit - prev_unit) / prev_unit * 100).where(prev_unit > 0, 0)
+        arrow = pd.Series(
+            np.where(df["price_diff"].astype(float) > 0, "📈", "📉"), index=df.index
+        )
+        details = (
+            arrow + " 정상가 "
+            + prev_unit.map("{:,.1f}".format) + "원 → "
+            + curr_unit.map("{:,.1f}".format) + "원 ("
+            + diff_pct.map("{:+.1f}".format) + "%) | "
+            + df["date"].astype(str)
+        )
+        # sort=False: 날짜 내림차순 응답에서 제품의 첫 등장 순서를 그대로 보존
+        grouped = details.groupby(df["_url_key"], sort=False).agg("  /  ".join)
+        results = list(grouped.index)
+        product_details = grouped.to_dict()
         if not results:
             return "해당 기간 내 정상가 변동이 없습니다."
         return {
             "type": "product_list",
             "text": f"{period_label} 정상가 변동 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
     
@@ -2104,39 +2376,40 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
         if df.empty:
             return None
         df["unit_price"] = df["unit_price"].astype(float)
-        df["date"] = pd.to_datetime(df["date"])
+        df["date"] = pd.to_datetime(df["date"], format="ISO8601")
         
         # 🔥 조회기간 필터
         df = df[
             (df["date"] >= pd.Timestamp(date_from)) &
             (df["date"] <= pd.Timestamp(date_to))
         ]
-        volatility = (
-            df.groupby("product_url")["unit_price"]
-            .agg(lambda x: x.max() - x.min())
-            .sort_values(ascending=False)
-        )
+        # 🔥 Python lambda 대신 cython 집계 경로 사용 (min/max 결과는 아래 루프에서 재활용)
+        g = df.groupby("product_url")["unit_price"]
+        g_min = g.min()
+        g_max = g.max()
+        volatility = (g_max - g_min).sort_values(ascending=False)
         if volatility.empty:
             return None
         product_details = {}
         results = []
+        # 🔥 제품마다 df_work 전체를 재스캔하지 않도록 정규화 URL 집합을 1회 구성
+        work_urls_norm = set(df_work["_url_key"])
         for url, val in volatility.items():
             if val == 0:
                 continue
             norm_url = str(url).strip().lower()
-            row = df_work[df_work["product_url"].str.strip().str.lower() == norm_url]
-            if row.empty:
+            if norm_url not in work_urls_norm:
                 continue
-            lo = df[df["product_url"] == url]["unit_price"].min()
-            hi = df[df["product_url"] == url]["unit_price"].max()
+            lo = g_min[url]
+            hi = g_max[url]
             product_details[norm_url] = f"💰 최저 {lo:,.1f}원 ~ 최고 {hi:,.1f}원 (변동폭 {val:,.1f}원)"
-            results.append({"product_url": norm_url})
+            results.append(norm_url)
         if not results:
             return None
         return {
             "type": "product_list",
             "text": f"{period_label} 가격 변동 제품 ({len(results)}개)",
-            "products": [r["product_url"] for r in results],
+            "products": results,
             "product_details": product_details,
         }
 
@@ -2148,38 +2421,25 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
     # 수정: 전체 쿼리를 붙여쓰기로도 검색
     keywords = [w for w in question.split() if len(w) >= 2]
     if keywords:
-        df_search = df_work.copy()
-        
+        df_search = df_work
+
         # 1) 전체 질문을 공백 제거한 통합 키워드로 먼저 시도
         full_nkw = _norm_kw(question)
-        full_mask = (
-            _norm_series(df_search["product_name"]).str.contains(full_nkw, case=False) |
-            _norm_series(df_search["brand"]).str.contains(full_nkw, case=False) |
-            _norm_series(df_search["category1"]).str.contains(full_nkw, case=False) |
-            _norm_series(df_search["category2"]).str.contains(full_nkw, case=False) |
-            _norm_series(df_search["brew_type_kr"]).str.contains(full_nkw, case=False)
-        )
-        df_full = df_search[full_mask]
-        
-        # 2) 개별 키워드 AND 검색
-        df_and = df_search.copy()
+        # 🔥 컬럼 5개 개별 스캔 대신 load 시 구성한 search_blob 1회 스캔
+        full_mask = df_search["search_blob"].str.contains(full_nkw, case=False)
+
+        # 2) 개별 키워드 AND 검색 — 프레임을 줄여가는 대신 마스크를 누적
+        and_mask = pd.Series(True, index=df_search.index)
         for keyword in keywords:
             nkw = _norm_kw(keyword)
-            mask = (
-                _norm_series(df_and["product_name"]).str.contains(nkw, case=False) |
-                _norm_series(df_and["brand"]).str.contains(nkw, case=False) |
-                _norm_series(df_and["category1"]).str.contains(nkw, case=False) |
-                _norm_series(df_and["category2"]).str.contains(nkw, case=False) |
-                _norm_series(df_and["brew_type_kr"]).str.contains(nkw, case=False)
-            )
-            df_and = df_and[mask]
-            if df_and.empty:
+            and_mask = and_mask & df_search["search_blob"].str.contains(nkw, case=False)
+            if not and_mask.any():
                 break
-        
-        # 3) 두 결과 합치기 (중복 제거)
-        df_search = pd.concat([df_full, df_and]).drop_duplicates(subset=["product_url"])
+
+        # 3) 두 결과 합치기 — concat + drop_duplicates 대신 OR 마스크 1회 적용 (중복 자체가 생기지 않음)
+        df_search = df_search[full_mask | and_mask]
         if not df_search.empty:
-            products = [str(r["product_url"]).strip().lower() for _, r in df_search.iterrows()]
+            products = df_search["_url_key"].tolist()
             return {
                 "type": "product_list",
                 "text": f"'{question}' 검색 결과 ({len(products)}개)",
@@ -2188,10 +2448,23 @@ def _execute_rule_inner(intent, question, df_summary, date_from=None, date_to=No
 
     return None
 
+@st.cache_resource
+def get_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+@st.cache_data(ttl=300)
+def _llm_context(df_head: pd.DataFrame) -> str:
+    # 프롬프트 컨텍스트를 compact JSON으로 1회 직렬화 — dict repr 대비 토큰/직렬화 비용 절감
+    return df_head.to_json(orient="records", force_ascii=False)
+
 def llm_fallback(question: str, df_summary: pd.DataFrame):
-    context = df_summary.head(50)[
-        ["product_name", "current_unit_price", "is_discount", "is_new_product", "brew_type_kr"]
-    ].to_dict(orient="records")
+    # 🔥 캐시 키 해싱 비용 축소 — 전체 요약 프레임 대신 실제 사용하는 50행×5열만 전달
+    context = _llm_context(
+        df_summary.head(50)[
+            ["product_name", "current_unit_price", "is_discount", "is_new_product", "brew_type_kr"]
+        ]
+    )
 
     prompt = f"""
 당신은 커피 캡슐 가격 분석 전문가입니다.
@@ -2210,8 +2483,7 @@ def llm_fallback(question: str, df_summary: pd.DataFrame):
 {question}
 """
 
-    from openai import OpenAI
-    client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+    client = get_openai_client()
     response = client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[{"role": "user", "content": prompt}],
@@ -2232,77 +2504,107 @@ def query_events_bulk(supabase, product_urls, date_from, date_to, chunk_size=200
     all_data = []
     for i in range(0, len(product_urls), chunk_size):
         chunk = product_urls[i:i+chunk_size]
-        res = (
+        q = (
             supabase.table("product_all_events")
             .select("product_url, date, unit_price, event_type")
             .in_("product_url", chunk)
             .gte("date", date_from.strftime("%Y-%m-%d"))
             .lte("date", date_to.strftime("%Y-%m-%d"))
-            .execute()
+            .order("product_url", desc=False)
+            .order("date", desc=False)
         )
-        if res.data:
-            all_data.extend(res.data)
+        all_data.extend(fetch_all(q))
     return pd.DataFrame(all_data) if all_data else pd.DataFrame(
         columns=["product_url", "date", "unit_price"]
     )
     
+# clean_product_name용 패턴/교정 맵 — 호출마다 재컴파일/재생성하지 않도록 모듈 스코프에 구성
+_NAME_CTRL_RE = re.compile(r"[\x00-\x1f\x7f-\x9f]")
+_NAME_FIX_MAP = {
+    "본   직영": "본사직영",
+    "본  직영": "본사직영",
+    "본 직영": "본사직영",
+    "바닐   향": "바닐라향",
+    "바닐  향": "바닐라향",
+    "네스프   ": "네스프레소",
+    "스타   스": "스타벅스",
+}
+_NAME_FIX_ITEMS = tuple(_NAME_FIX_MAP.items())
+_NAME_VANILLA_RE = re.compile(r"바닐.*?향")
+_NAME_HQ_RE = re.compile(r"본.*?직영")
+_NAME_WS_RE = re.compile(r"\s{2,}")
+
 def clean_product_name(s: str) -> str:
     if s is None:
         return ""
     s = str(s)
-    s = re.sub(r"[\x00-\x1f\x7f-\x9f]", "", s).strip()
-    fix_map = {
-        "본   직영": "본사직영",
-        "본  직영": "본사직영",
-        "본 직영": "본사직영",
-        "바닐   향": "바닐라향",
-        "바닐  향": "바닐라향",
-        "네스프   ": "네스프레소",
-        "스타   스": "스타벅스",
-    }
-    for bad, good in fix_map.items():
+    s = _NAME_CTRL_RE.sub("", s).strip()
+    for bad, good in _NAME_FIX_ITEMS:
         if bad in s:
             s = s.replace(bad, good)
-    s = re.sub(r"바닐.*?향", "바닐라향", s)
-    s = re.sub(r"본.*?직영", "본사직영", s)
-    s = re.sub(r"\s{2,}", " ", s).strip()
+    s = _NAME_VANILLA_RE.sub("바닐라향", s)
+    s = _NAME_HQ_RE.sub("본사직영", s)
+    s = _NAME_WS_RE.sub(" ", s).strip()
     return s
 
+def clean_product_names(series: pd.Series) -> pd.Series:
+    """clean_product_name의 벌크 버전 — apply 대신 컬럼 단위 str 연산으로 일괄 정제"""
+    s = series.fillna("").astype(str)
+    # 🔥 고유값에만 정제 수행 후 map 복원 — 중복 이름에 동일 변환을 반복하지 않음
+    uniq = pd.Series(s.unique())
+    cleaned = uniq.str.replace(_NAME_CTRL_RE, "", regex=True).str.strip()
+    for bad, good in _NAME_FIX_ITEMS:
+        cleaned = cleaned.str.replace(bad, good, regex=False)
+    cleaned = cleaned.str.replace(_NAME_VANILLA_RE, "바닐라향", regex=True)
+    cleaned = cleaned.str.replace(_NAME_HQ_RE, "본사직영", regex=True)
+    cleaned = cleaned.str.replace(_NAME_WS_RE, " ", regex=True).str.strip()
+    return s.map(dict(zip(uniq, cleaned)))
+
 def detect_encoding_issues(df: pd.DataFrame):
     if "product_name_raw" not in df.columns:
         return
-    mask = df["product_name_raw"].str.contains(" ", na=False)
+    try:
+        # 🔥 pyarrow가 있으면 SIMD 경로의 substring 검색 사용 (object-dtype 스캔 대비 수 배 빠름)
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        arrow_mask = pc.match_substring(
+            pa.array(df["product_name_raw"], from_pandas=True), " "
+        )
+        mask = pd.Series(arrow_mask.to_pandas(), index=df.index).fillna(False).astype(bool)
+    except ImportError:
+        mask = df["product_name_raw"].str.contains(" ", na=False)
     issues = df[mask][["product_url", "product_name_raw"]]
     if not issues.empty:
         import logging
         logging.warning(f"[ENCODING ISSUE] {len(issues)}건 감지됨")
-        try:
-            supabase.table("product_name_encoding_issues").insert(
-                issues.to_dict(orient="records")
-            ).execute()
-        except Exception as e:
-            logging.error(f"로그 저장 실패: {e}")
+    return issues
+
+
+@st.cache_data(ttl=300)
+def encoding_issues_cached(df: pd.DataFrame):
+    # 🔥 rerun마다 전체 프레임을 다시 스캔하지 않도록 캐시
+    return detect_encoding_issues(df)
 
 
 def _norm_series(s: pd.Series) -> pd.Series:
-    return (
-        s.fillna("")
-        .astype(str)
-        .str.lower()
-        .str.replace(" ", "", regex=False)
-    )
+    # 🔥 고유값에만 변환 수행 후 map 복원 — O(행수) 문자열 연산을 O(카디널리티)로
+    s = s.fillna("").astype(str)
+    uniq = pd.Series(s.unique())
+    normed = uniq.str.lower().str.replace(" ", "", regex=False)
+    return s.map(dict(zip(uniq, normed)))
 
 # ✅ 이 줄 추가
 def _norm_kw(kw: str) -> str:
     return kw.lower().replace(" ", "")
 
+@st.cache_data(ttl=300)
 def options_from(df: pd.DataFrame, col: str):
     if col not in df.columns:
         return []
 
+    # 🔥 고유값으로 줄인 뒤 문자열 연산 — O(행수)가 아니라 O(카디널리티)
     vals = (
-        df[col]
-        .dropna()
+        pd.Series(df[col].dropna().unique())
         .astype(str)
         .str.strip()
     )
@@ -2311,6 +2613,19 @@ def options_from(df: pd.DataFrame, col: str):
 
     return sorted(vals.unique().tolist())
 
+@st.cache_data(ttl=300)
+def filter_eq(df: pd.DataFrame, col: str, val: str) -> pd.DataFrame:
+    """selectbox 선택값 필터 결과 캐시 — 위젯 틱마다 boolean 스캔을 반복하지 않음"""
+    return df[df[col] == val]
+
+@st.cache_data(ttl=300)
+def summary_date_range(df: pd.DataFrame):
+    """조회 가능 날짜 범위 — rerun마다 날짜 컬럼 전체를 재파싱하지 않도록 캐시"""
+    return (
+        pd.to_datetime(df["first_seen_date"].dropna(), format="ISO8601").min().date(),
+        pd.to_datetime(df["last_seen_date"].dropna(), format="ISO8601").max().date(),
+    )
+
 def format_product_label(row):
     brand = row.get("brand")
     product_name = row.get("product_name")
@@ -2341,6 +2656,33 @@ def format_product_label(row):
     return " - ".join(parts)
 
 
+def format_product_labels(df):
+    """format_product_label의 벌크 버전 — notna/strip을 컬럼 단위로 1회 수행"""
+    brands = df["brand"].fillna("").astype(str).str.strip()
+    names = df["product_name"].fillna("").astype(str).str.strip()
+    cat1s = df["category1"].fillna("").astype(str).str.strip()
+    cat2s = df["category2"].fillna("").astype(str).str.strip()
+    labels = []
+    for brand, product_name, category1, category2 in zip(brands, names, cat1s, cat2s):
+        if brand in {"카누 바리스타", "네슬레", "일리카페"}:
+            labels.append(f"{brand} - {product_name}")
+        elif brand == "네스프레소":
+            parts = [brand]
+            if category2:
+                parts.append(category2)
+            parts.append(product_name)
+            labels.append(" - ".join(parts))
+        else:
+            parts = [brand]
+            if category1:
+                parts.append(category1)
+            if category2:
+                parts.append(category2)
+            parts.append(product_name)
+            labels.append(" - ".join(parts))
+    return labels
+
+
 import re
 
 def render_card(bg, border, title, content):
@@ -2388,10 +2730,17 @@ def get_normal_price_change_dates(product_url, date_from, date_to):
 # =========================
 # 4️⃣ 체크박스 key 등록
 # =========================
+def register_dynamic_key(widget_key: str) -> str:
+    """동적 생성 위젯 key 등록 — 초기화 시 session_state 전체를 훑지 않도록 함"""
+    st.session_state.setdefault("_dynamic_keys", set()).add(widget_key)
+    return widget_key
+
+
 def register_product_checkbox_key(product_url: str, widget_key: str):
     if "product_checkbox_keys" not in st.session_state:
         st.session_state["product_checkbox_keys"] = {}
     st.session_state["product_checkbox_keys"].setdefault(product_url, set()).add(widget_key)
+    register_dynamic_key(widget_key)
 
 def remove_product_everywhere(product_url: str):
     clean_url = str(product_url).strip("_").strip()
@@ -2416,7 +2765,7 @@ if "search_history" not in st.session_state:
 if "saved_queries" not in st.session_state:
     # Supabase에서 저장된 검색어 로드
     try:
-        sq_res = supabase.table("saved_queries").select("*").order("created_at", desc=False).execute()
+        sq_res = supabase.table("saved_queries").select("id, query_text").order("created_at", desc=False).execute()
         st.session_state.saved_queries = sq_res.data if sq_res.data else []
     except:
         st.session_state.saved_queries = []
@@ -2471,162 +2820,76 @@ st.title("☕ Coffee Capsule Price Intelligence")
 
 df_all = load_product_summary()
 
-
-# -------------------------
-# 브랜드 정규화
-# -------------------------
-df_all["brand"] = (
-    df_all["brand"]
-    .astype(str)
-    .str.strip()
-    .str.replace("�", "", regex=False)
-)
-
-df_all["brand"] = df_all["brand"].replace({
-    "네레": "네슬레",
-    "네스프레": "네스프레소",
-    "일리": "일리카페",
-    "카누": "카누 바리스타",
-    "카누 바스타": "카누 바리스타"
-})
-
-# -------------------------
-# category1 정규화
-# -------------------------
-df_all["category1"] = (
-    df_all["category1"]
-    .astype(str)
-    .str.strip()
-    .str.replace("�", "", regex=False)
-)
-
-# 카누 전용
-df_all["category1"] = df_all["category1"].str.replace(
-    r"카.*바리스타.*캡슐",
-    "카누 바리스타 전용캡슐",
-    regex=True
-).str.replace("전용슐", "전용캡슐")
-
-# 카누 네스프레소 호환
-df_all["category1"] = df_all["category1"].str.replace(
-    r"카.*네스프레소.*캡슐",
-    "카누 네스프레소 호환캡슐",
-    regex=True
-)
-
-# 카누 돌체구스토 호환
-df_all["category1"] = df_all["category1"].str.replace(
-    r"카.*돌체.*캡슐",
-    "카누 돌체구스토 호환캡슐",
-    regex=True
-)
-
-# 돌체구스토 통합
-df_all["category1"] = df_all["category1"].str.replace(
-    r"돌체.*캡.*",
-    "돌체구스토 캡슐",
-    regex=True
-)
-
-# 스타벅스 오타 수정
-df_all["category1"] = df_all["category1"].replace({
-    "스타벅스by네스프소": "스타벅스by네스프레소"
-})
-
-df_all["category2"] = (
-    df_all["category2"]
-    .astype(str)
-    .str.strip()
-    .str.replace("�", "", regex=False)
-)
-
-df_all["category2"] = df_all["category2"].replace({
-    "버츄": "버츄오",
-    "버추오": "버츄오",
-    "오리": "오리지널"
-})
-
-df_all["category2"] = df_all["category2"].replace({
-    "None": None
-})
-
-# -------------------------
-# 🔎 검색용 컬럼 생성 (공백 무시 검색)
-# -------------------------
-
-df_all["product_name_search"] = (
-    df_all["product_name"]
-    .astype(str)
-    .str.lower()
-    .str.replace(" ", "", regex=False)
-)
-
-df_all["brew_type_search"] = (
-    df_all["brew_type_kr"]
-    .astype(str)
-    .str.lower()
-    .str.replace(" ", "", regex=False)
-)
-
-df_all["category1_search"] = (
-    df_all["category1"]
-    .astype(str)
-    .str.lower()
-    .str.replace(" ", "", regex=False)
-)
-
-df_all["category2_search"] = (
-    df_all["category2"]
-    .astype(str)
-    .str.lower()
-    .str.replace(" ", "", regex=False)
-)
-
-# -------------------------
-# URL 정리
-# -------------------------
-df_all["product_url"] = (
-    df_all["product_url"]
-    .astype(str)
-    .str.strip("_")
-    .str.strip()
-)
-
 if df_all is None or df_all.empty:
     st.warning("아직 집계된 제품 데이터가 없습니다.")
     st.stop()
 
-# 제품명 정제
-df_all["product_name_raw"] = df_all["product_name"]
-df_all["product_name"] = df_all["product_name"].apply(clean_product_name)
-df_all["category1"] = df_all["category1"].str.replace("전용슐", "전용캡슐", regex=False)
-df_all["category2"] = df_all["category2"].str.replace("전용슐", "전용캡슐", regex=False)
-
-# 🔎 검색용 컬럼 생성
-df_all["product_name_search"] = (
-    df_all["product_name"]
-    .astype(str)
-    .str.lower()
-    .str.replace(" ", "", regex=False)
-)
-
 # -------------------------
 # 깨진 문자열 감지 (운영 로그 전용)
 # -------------------------
 try:
-    encoding_issues = detect_encoding_issues(df_all)
+    encoding_issues = encoding_issues_cached(df_all)
     if isinstance(encoding_issues, pd.DataFrame) and not encoding_issues.empty:
         print(f"[ENCODING] 깨진 제품명 {len(encoding_issues)}건 감지")
         log_records = encoding_issues[[
             "product_url",
             "product_name_raw"
         ]].to_dict(orient="records")
-        supabase.table("product_name_encoding_issues") \
-                .insert(log_records) \
-                .execute()
+        # 🔥 동일 배치는 세션당 1회만 Supabase에 기록 (rerun마다 insert 방지)
+        _log_hash = hashlib.md5(
+            "|".join(sorted(encoding_issues["product_url"])).encode("utf-8")
+        ).hexdigest()
+        _logged = st.session_state.setdefault("encoding_logged", set())
+        if _log_hash not in _logged:
+            log_async("product_name_encoding_issues", log_records)
+            _logged.add(_log_hash)
 except Exception as e:
     print(f"[ENCODING_LOG_ERROR] {e}")
 
+# -------------------------
+# 🔎 product_url 인덱스 뷰 (루프 내 O(1) 조회용)
+# -------------------------
+pid_by_url = dict(zip(df_all["product_url"], df_all["pid"]))
+
+def selected_pid_set():
+    """현재 선택된 제품들의 pid 스냅샷 (렌더 루프 직전에 1회 계산)"""
+    sel = st.session_state.selected_products
+    return {pid_by_url[u] for u in sel if u in pid_by_url}
+
+@st.cache_data(ttl=300)
+def index_by_url(df: pd.DataFrame) -> pd.DataFrame:
+    """rerun마다 drop_duplicates/set_index를 재수행하지 않도록 캐시"""
+    return df.drop_duplicates(subset=["product_url"]).set_index("product_url", drop=False)
+
+df_by_url = index_by_url(df_all)
+
+# 질문 파서용 brew_type 목록 — 질문마다 unique() 재계산 방지
+BREW_TYPE_LIST = df_all["brew_type_kr"].dropna().unique().tolist()
+
+# 질문 파서용 브랜드 목록 (소문자 버전까지 미리 계산)
+BRAND_LIST = df_all["brand"].dropna().unique().tolist()
+BRAND_LIST_LOWER = [str(b).lower() for b in BRAND_LIST]
+
+# extract_brew_type용 단일 패스 매처 (정규화 brew → 원본, 긴 키워드 우선 lookahead)
+_BREW_NORMS = {b.lower().replace(" ", ""): b for b in BREW_TYPE_LIST if b}
+if _BREW_NORMS:
+    _BREW_KW_RE = _intent_re.compile(
+        "(?=(" + "|".join(map(_intent_re.escape, sorted(_BREW_NORMS, key=len, reverse=True))) + "))"
+    )
+    _BREW_KW_CONTAINED = {
+        nb: [n2 for n2 in _BREW_NORMS if n2 != nb and n2 in nb]
+        for nb in _BREW_NORMS
+    }
+else:
+    _BREW_KW_RE = None
+    _BREW_KW_CONTAINED = {}
+
+def get_product_row(product_url):
+    """product_url로 요약 행 1건 조회 (없으면 None)"""
+    if product_url in df_by_url.index:
+        return df_by_url.loc[product_url]
+    return None
+
 # -------------------------
 # 조회 기준 선택 및 조회 조건 통합
 # -------------------------
@@ -2640,8 +2903,7 @@ with col_main_right:
 
 col_tabs, col_controls = st.columns([3, 1])
 with col_controls:
-    _min_date = pd.to_datetime(df_all["first_seen_date"].dropna()).min().date()
-    _max_date = pd.to_datetime(df_all["last_seen_date"].dropna()).max().date()
+    _min_date, _max_date = summary_date_range(df_all)
     col_from, col_to = st.columns(2)
     with col_from:
         st.write("시작일")
@@ -2664,7 +2926,42 @@ with col_controls:
             label_visibility="collapsed"
         )
 
-    st.button("📊 조회하기", type="primary", use_container_width=True, key="btn_search_trigger", on_click=lambda: st.session_state.update({"show_results": True}))
+    def _on_search_trigger():
+        """조회하기 클릭 콜백 — 필터 로그를 위젯 틱마다가 아니라 조회 시점에 1회 기록"""
+        st.session_state.show_results = True
+
+        sel_brand = st.session_state.get("filter_brand", "(전체)")
+        sel_cat1 = st.session_state.get("filter_cat1", "(전체)")
+        sel_cat2 = st.session_state.get("filter_cat2", "(전체)")
+        if sel_brand == "(전체)" and sel_cat1 == "(전체)" and sel_cat2 == "(전체)":
+            return
+
+        current_filter = f"{sel_brand}|{sel_cat1}|{sel_cat2}"
+        if st.session_state.get("last_filter") == current_filter:
+            return
+
+        logged_df = df_all
+        if sel_brand != "(전체)":
+            logged_df = logged_df[logged_df["brand"] == sel_brand]
+        if sel_cat1 != "(전체)":
+            logged_df = logged_df[logged_df["category1"] == sel_cat1]
+        if sel_cat2 != "(전체)":
+            logged_df = logged_df[logged_df["category2"] == sel_cat2]
+
+        log_async("search_logs", {
+            "search_type": "FILTER",
+            "search_term": current_filter,
+            "filter_data": {
+                "brand": sel_brand,
+                "category1": sel_cat1,
+                "category2": sel_cat2
+            },
+            "result_count": len(logged_df),
+            "created_at": datetime.now().isoformat()
+        })
+        st.session_state.last_filter = current_filter
+
+    st.button("📊 조회하기", type="primary", use_container_width=True, key="btn_search_trigger", on_click=_on_search_trigger)
 
     if st.button("🗑️ 전체 초기화", use_container_width=True, key="btn_reset_all"):
         st.session_state.selected_products = set()
@@ -2686,14 +2983,12 @@ with col_controls:
         if "last_filter" in st.session_state:
             del st.session_state.last_filter
 
-        keys_to_delete = [
-            key for key in list(st.session_state.keys())
-            if key.startswith(("tab", "chk_tab", "remove_product_", "delete_"))
-        ]
+        # 🔥 전체 session_state 스캔 대신 생성 시 등록해 둔 동적 key만 제거
         st.session_state.selected_products = set()
         st.session_state["_removed_products"] = set()
-        for key in keys_to_delete:
-            del st.session_state[key]
+        for key in st.session_state.pop("_dynamic_keys", set()):
+            if key in st.session_state:
+                del st.session_state[key]
         st.rerun()
 
 
@@ -2720,25 +3015,14 @@ with col_tabs:
 
             if "," in search_keyword:
                 keywords = [k.strip() for k in search_keyword.split(",") if k.strip()]
-                mask = False
-                for kw in keywords:
-                    nkw = _norm_kw(kw)
-                    mask |= _norm_series(df_all["product_name"]).str.contains(nkw, case=False)
-                    mask |= _norm_series(df_all["brand"]).str.contains(nkw, case=False)
-                    mask |= _norm_series(df_all["category1"]).str.contains(nkw, case=False)
-                    mask |= _norm_series(df_all["category2"]).str.contains(nkw, case=False)
-                    mask |= _norm_series(df_all["brew_type_kr"]).str.contains(nkw, case=False)
+                # 🔥 키워드별 K회 스캔 대신 정규식 alternation으로 컬럼당 1회 스캔
+                pattern = "|".join(re.escape(_norm_kw(kw)) for kw in keywords)
+                mask = df_all["search_blob"].str.contains(pattern, case=False, regex=True)
                 candidates_df = df_all[mask].copy()
             else:
                 # 1) 전체 붙여쓰기 통합 검색
                 full_nkw = _norm_kw(search_keyword)
-                full_mask = (
-                    _norm_series(df_all["product_name"]).str.contains(full_nkw, case=False) |
-                    _norm_series(df_all["brand"]).str.contains(full_nkw, case=False) |
-                    _norm_series(df_all["category1"]).str.contains(full_nkw, case=False) |
-                    _norm_series(df_all["category2"]).str.contains(full_nkw, case=False) |
-                    _norm_series(df_all["brew_type_kr"]).str.contains(full_nkw, case=False)
-                )
+                full_mask = df_all["search_blob"].str.contains(full_nkw, case=False)
                 df_full = df_all[full_mask].copy()
             
                 # 2) 기존 AND 검색
@@ -2747,13 +3031,7 @@ with col_tabs:
                 for kw in keywords:
                     if len(kw) >= 2:
                         nkw = _norm_kw(kw)
-                        keyword_mask = (
-                            _norm_series(candidates_df["product_name"]).str.contains(nkw, case=False) |
-                            _norm_series(candidates_df["brand"]).str.contains(nkw, case=False) |
-                            _norm_series(candidates_df["category1"]).str.contains(nkw, case=False) |
-                            _norm_series(candidates_df["category2"]).str.contains(nkw, case=False) |
-                            _norm_series(candidates_df["brew_type_kr"]).str.contains(nkw, case=False)
-                        )
+                        keyword_mask = candidates_df["search_blob"].str.contains(nkw, case=False)
                         candidates_df = candidates_df[keyword_mask]
                         if candidates_df.empty:
                             break
@@ -2761,15 +3039,12 @@ with col_tabs:
                 # 3) 두 결과 합치기 (중복 제거)
                 candidates_df = pd.concat([df_full, candidates_df]).drop_duplicates(subset=["product_url"])
 
-            try:
-                supabase.table("search_logs").insert({
-                    "search_type": "KEYWORD",
-                    "search_term": search_keyword,
-                    "result_count": len(candidates_df),
-                    "created_at": datetime.now().isoformat()
-                }).execute()
-            except Exception as e:
-                print("검색 로그 저장 실패:", e)
+            log_async("search_logs", {
+                "search_type": "KEYWORD",
+                "search_term": search_keyword,
+                "result_count": len(candidates_df),
+                "created_at": datetime.now().isoformat()
+            })
 
             existing_idx = None
             for idx, history in enumerate(st.session_state.search_history):
@@ -2786,13 +3061,18 @@ with col_tabs:
 
             search_result = {
                 "keyword": search_keyword,
-                "results": sorted_df["product_url"].tolist()
+                "results": sorted_df["product_url"].tolist(),
+                # 🔥 렌더용 프레임을 검색 시점에 1회 구성 (rerun마다 재조립 방지)
+                "frame": sorted_df.fillna(""),
             }
 
             if existing_idx is not None:
                 st.session_state.search_history[existing_idx] = search_result
             else:
                 st.session_state.search_history.append(search_result)
+                # 🔥 카드(위젯) 수가 계속 누적되지 않도록 최근 10건만 유지
+                if len(st.session_state.search_history) > 10:
+                    st.session_state.search_history = st.session_state.search_history[-10:]
 
         st.markdown("### 📦 비교할 제품 선택")
 
@@ -2820,7 +3100,7 @@ with col_tabs:
                                 st.markdown(f"**🔍 {history['keyword']}**")
 
                             with col_delete:
-                                if st.button("🗑️", key=f"delete_search_{history_idx}", help="검색 결과 삭제"):
+                                if st.button("🗑️", key=register_dynamic_key(f"delete_search_{history_idx}"), help="검색 결과 삭제"):
                                     for product_url in history["results"]:
                                         st.session_state.selected_products.discard(product_url)
                                         if "product_checkbox_keys" in st.session_state:
@@ -2834,12 +3114,13 @@ with col_tabs:
                             if not history['results']:
                                 st.caption("📭 검색 결과 없음")
                             else:
-                                sorted_df = (
-                                    df_all[df_all["product_url"].isin(history["results"])]
-                                    .fillna("")
-                                    .drop_duplicates(subset=["product_url"])
-                                    .sort_values(by=["brand", "category1", "category2", "product_name"])
-                                )
+                                # 🔥 저장 시점에 만들어 둔 프레임을 그대로 사용 (구버전 항목만 재조립)
+                                sorted_df = history.get("frame")
+                                if sorted_df is None:
+                                    sorted_df = (
+                                        df_by_url.loc[[u for u in history["results"] if u in df_by_url.index]]
+                                        .fillna("")
+                                    )
 
                                 with st.expander(
                                     f"목록 펼치기 / 접기 ({len(sorted_df)}개)",
@@ -2859,11 +3140,23 @@ with col_tabs:
                                             for u in tab1_urls:
                                                 st.session_state.selected_products.discard(u)
                                     st.divider()
-                                    for _, row in sorted_df.iterrows():
-                                        product_url = row["product_url"]
-                                        label = format_product_label(row)
+                                    _selected_pids = selected_pid_set()
+                                    # 🔥 행 단위 notna 대신 라벨 일괄 생성 + 컬럼 zip 순회
+                                    grid_rows = list(zip(
+                                        sorted_df["product_url"], sorted_df["pid"], format_product_labels(sorted_df)
+                                    ))
+                                    # 🔥 체크박스 위젯 수 제한 — 20개 초과분은 요청 시에만 렌더
+                                    _PAGE_SIZE = 20
+                                    if len(grid_rows) > _PAGE_SIZE:
+                                        show_all = st.checkbox(
+                                            f"전체 보기 (+{len(grid_rows) - _PAGE_SIZE}개)",
+                                            key=register_dynamic_key(f"show_all_tab1_{history_idx}"),
+                                        )
+                                        if not show_all:
+                                            grid_rows = grid_rows[:_PAGE_SIZE]
+                                    for product_url, pid, label in grid_rows:
                                         scope = f"hist_{history_idx}"
-                                        is_selected = product_url in st.session_state.selected_products
+                                        is_selected = pid in _selected_pids
                                         k = mk_widget_key("chk_tab1", product_url, scope) + ("_1" if is_selected else "_0")
                                         register_product_checkbox_key(product_url, k)
                                         col_chk, col_lbl = st.columns([0.06, 0.94], vertical_alignment="center")
@@ -2916,7 +3209,7 @@ with col_tabs:
                 key="filter_brand"
             )
 
-        df1 = df_all if sel_brand == "(전체)" else df_all[df_all["brand"] == sel_brand]
+        df1 = df_all if sel_brand == "(전체)" else filter_eq(df_all, "brand", sel_brand)
 
         with col2:
             VALID_CAT1 = [
@@ -2937,7 +3230,7 @@ with col_tabs:
                 key="filter_cat1"
             )
 
-        df2 = df1 if sel_cat1 == "(전체)" else df1[df1["category1"] == sel_cat1]
+        df2 = df1 if sel_cat1 == "(전체)" else filter_eq(df1, "category1", sel_cat1)
 
         with col3:
             VALID_CAT2 = ["버츄오", "오리지널"]
@@ -2950,27 +3243,10 @@ with col_tabs:
                 key="filter_cat2"
             )
 
-        candidates_df = df2 if sel_cat2 == "(전체)" else df2[df2["category2"] == sel_cat2]
+        candidates_df = df2 if sel_cat2 == "(전체)" else filter_eq(df2, "category2", sel_cat2)
 
         if sel_brand != "(전체)" or sel_cat1 != "(전체)" or sel_cat2 != "(전체)":
             st.session_state.active_mode = "필터 선택"
-            current_filter = f"{sel_brand}|{sel_cat1}|{sel_cat2}"
-            if "last_filter" not in st.session_state or st.session_state.last_filter != current_filter:
-                try:
-                    supabase.table("search_logs").insert({
-                        "search_type": "FILTER",
-                        "search_term": current_filter,
-                        "filter_data": {
-                            "brand": sel_brand,
-                            "category1": sel_cat1,
-                            "category2": sel_cat2
-                        },
-                        "result_count": len(candidates_df),
-                        "created_at": datetime.now().isoformat()
-                    }).execute()
-                    st.session_state.last_filter = current_filter
-                except Exception as e:
-                    print("필터 로그 저장 실패:", e)
 
         st.markdown("### 📦 비교할 제품 선택")
 
@@ -2994,31 +3270,24 @@ with col_tabs:
                     for u in tab2_urls:
                         st.session_state.selected_products.discard(u)
             st.divider()
-            for _, row in unique_df.iterrows():
-                product_url = row["product_url"]
-                label = format_product_label(row)
-                scope = f"{sel_brand}|{sel_cat1}|{sel_cat2}"
-                is_selected = product_url in st.session_state.selected_products
-                k = mk_widget_key("chk_tab2", product_url, scope) + ("_1" if is_selected else "_0")
-                register_product_checkbox_key(product_url, k)
-                col_chk, col_lbl = st.columns([0.02, 0.98], vertical_alignment="center")
-                with col_chk:
-                    checked = st.checkbox("", key=k, value=is_selected)
-                with col_lbl:
-                    st.markdown(
-                        f"""
-                        <div style="
-                            white-space:normal;
-                            word-break:keep-all;
-                            overflow-wrap:break-word;
-                            line-height:1.35;
-                            padding:5px 0 6px 0;
-                        ">
-                            {label}
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
+            # 🔥 제품별 st.checkbox N개 대신 단일 data_editor 그리드 (위젯 1개로 일괄 렌더)
+            _selected_pids = selected_pid_set()
+            grid_df = pd.DataFrame({
+                "선택": [pid in _selected_pids for pid in unique_df["pid"]],
+                "제품": format_product_labels(unique_df),
+            })
+            scope = f"{sel_brand}|{sel_cat1}|{sel_cat2}"
+            # 선택 상태가 바뀌면 key도 바뀌어 그리드가 세션 상태 기준으로 다시 초기화됨
+            _sel_fingerprint = "|".join(sorted(u for u in tab2_urls if u in st.session_state.selected_products))
+            grid_key = mk_widget_key("grid_tab2", _sel_fingerprint, scope)
+            edited_grid = st.data_editor(
+                grid_df,
+                hide_index=True,
+                use_container_width=True,
+                disabled=["제품"],
+                key=grid_key,
+            )
+            for product_url, checked in zip(unique_df["product_url"], edited_grid["선택"]):
                 if checked:
                     st.session_state.selected_products.add(product_url)
                 else:
@@ -3107,13 +3376,15 @@ with col_tabs:
             st.session_state.question_history = []
             intent = classify_intent(question)
 
-            date_from = st.session_state.get("date_from", datetime.now() - timedelta(days=90))
-            date_to = st.session_state.get("date_to", datetime.now())
+            # 🔥 datetime.now()는 1회만 평가 — 기본값/보정 분기에서 재호출하지 않음
+            _now = datetime.now()
+            date_from = st.session_state.get("date_from", _now - timedelta(days=90))
+            date_to = st.session_state.get("date_to", _now)
 
             if not isinstance(date_from, datetime):
-                date_from = datetime.combine(date_from, datetime.min.time()) if hasattr(date_from, 'year') else datetime.now() - timedelta(days=90)
+                date_from = datetime.combine(date_from, datetime.min.time()) if hasattr(date_from, 'year') else _now - timedelta(days=90)
             if not isinstance(date_to, datetime):
-                date_to = datetime.combine(date_to, datetime.min.time()) if hasattr(date_to, 'year') else datetime.now()
+                date_to = datetime.combine(date_to, datetime.min.time()) if hasattr(date_to, 'year') else _now
 
             filtered_df = df_all.copy()
 
@@ -3198,7 +3469,7 @@ with col_tabs:
                             else:
                                 st.markdown("⭐", help="이미 저장됨")
                         with col_delete:
-                            if st.button("🗑️", key=f"delete_q_{idx}", help="질문 삭제"):
+                            if st.button("🗑️", key=register_dynamic_key(f"delete_q_{idx}"), help="질문 삭제"):
                                 st.session_state.question_history.pop(
                                     len(st.session_state.question_history) - 1 - idx
                                 )
@@ -3231,7 +3502,7 @@ with col_tabs:
                                     product_urls_set = set(str(u).strip().lower() for u in product_urls)
                                 
                                     sorted_df = (
-                                        df_all[df_all["product_url"].astype(str).str.strip().str.lower().isin(product_urls_set)]
+                                        df_all[df_all["_url_key"].isin(product_urls_set)]
                                         .fillna("")
                                         .drop_duplicates(subset=["product_url"])
                                     )
@@ -3256,19 +3527,21 @@ with col_tabs:
                                     # 🔥 질문에 '순서/최신/최근' 있으면 날짜순
                                     if any(k in history["question"] for k in ["순서","최신","최근"]):
                                         if "launch_dates" in answer_data:
-                                            sorted_df["product_url_key"] = sorted_df["product_url"].astype(str).str.strip().str.lower()
+                                            sorted_df["product_url_key"] = sorted_df["_url_key"]
                                             sorted_df["launch_date"] = sorted_df["product_url_key"].map(answer_data["launch_dates"])
                                             sorted_df = sorted_df.sort_values("launch_date", ascending=False)
                                     else:
                                         sorted_df = sorted_df.sort_values(
                                             by=["brand","category1","category2","product_name"]
                                         )                            
-                                    for _, row in sorted_df.iterrows():
-                                        product_url = row["product_url"]
+                                    _selected_pids = selected_pid_set()
+                                    # 🔥 행 단위 notna 대신 라벨 일괄 생성 + 컬럼 zip 순회
+                                    for product_url, pid, label in zip(
+                                        sorted_df["product_url"], sorted_df["pid"], format_product_labels(sorted_df)
+                                    ):
                                         product_url_key = str(product_url).strip().lower()  # 🔥 product_details 키 조회용
-                                        label = format_product_label(row)
                                         scope = f"tab3_{idx}_{scope_prefix}"
-                                        is_selected = product_url in st.session_state.selected_products
+                                        is_selected = pid in _selected_pids
                                         k = mk_widget_key("chk_tab3", product_url, scope) + ("_1" if is_selected else "_0")
                                         register_product_checkbox_key(product_url, k)
                                         col_chk, col_lbl = st.columns([0.02, 0.98], vertical_alignment="center")
@@ -3323,1449 +3596,1376 @@ with col_tabs:
 # =========================
 # 8️⃣ 결과 표시
 # =========================
-selected_products = list(st.session_state.selected_products)
-
-if selected_products:
+@st.fragment
+def render_results():
+    """선택 제품 비교 영역 — 이 영역 내 위젯 조작 시 전체 스크립트 대신 여기만 재실행"""
+    selected_products = list(st.session_state.selected_products)
+    # 🔥 set 순회 순서가 바뀌어도 동일 선택이면 로더 캐시에 적중하도록 키 정규화
+    selected_key = _urls_key(selected_products)
 
-    st.divider()
+    if selected_products:
 
-    col_title, col_download = st.columns([4, 1])
-    with col_title:
-        st.subheader(f"📊 조회 결과 ({len(selected_products)}개 제품)")
-    with col_download:
-        download_placeholder = st.empty()
+        st.divider()
 
-    if date_from > date_to:
-        st.error("❌ 시작일이 종료일보다 늦습니다. 기간을 다시 설정해주세요.")
-        st.stop()
+        col_title, col_download = st.columns([4, 1])
+        with col_title:
+            st.subheader(f"📊 조회 결과 ({len(selected_products)}개 제품)")
+        with col_download:
+            download_placeholder = st.empty()
 
-    st.info(f"📅 조회 기간: {date_from.strftime('%Y-%m-%d')} ~ {date_to.strftime('%Y-%m-%d')}")
+        if date_from > date_to:
+            st.error("❌ 시작일이 종료일보다 늦습니다. 기간을 다시 설정해주세요.")
+            st.stop()
 
-    timeline_rows = []
-    lifecycle_rows = []
+        st.info(f"📅 조회 기간: {date_from.strftime('%Y-%m-%d')} ~ {date_to.strftime('%Y-%m-%d')}")
 
-    filter_date_from = pd.to_datetime(date_from)
-    filter_date_to = pd.to_datetime(date_to)
+        timeline_rows = []
+        lifecycle_rows = []
 
-    df_all_events = load_events_bulk(
-        selected_products,
-        filter_date_from,
-        filter_date_to
-    )
+        filter_date_from = pd.to_datetime(date_from)
+        filter_date_to = pd.to_datetime(date_to)
 
-    df_lifecycle_all = load_lifecycle_bulk(
-        selected_products,
-        filter_date_from,
-        filter_date_to
-    )
+        # 🔥 rerun마다 전체 재조회 대신 저장소에 없는 URL만 delta-merge (반환 deep-copy 없음)
+        df_all_events, events_by_url = _delta_load(
+            "events", load_events_bulk, selected_key, filter_date_from, filter_date_to
+        )
 
-    df_raw_unit_all = load_raw_unit_bulk(
-        selected_products,
-        filter_date_from,
-        filter_date_to
-    )
+        df_lifecycle_all, life_by_url = _delta_load(
+            "life", load_lifecycle_bulk, selected_key, filter_date_from, filter_date_to
+        )
 
-    for product_url in selected_products:
-        product_row = df_all[df_all["product_url"] == product_url]
+        df_raw_unit_all = load_raw_unit_bulk(
+            selected_key,
+            filter_date_from,
+            filter_date_to
+        )
 
-        if product_row.empty:
-            st.session_state.selected_products.discard(product_url)
-            continue
+        # 🔥 raw_daily_prices도 조회 기간으로 서버측 필터된 벌크 1회 조회 (카드 영역과 캐시 공유)
+        df_raw_daily_all = load_raw_daily_bulk(
+            selected_key,
+            filter_date_from.strftime("%Y-%m-%d"),
+            filter_date_to.strftime("%Y-%m-%d")
+        )
+        # 🔥 할인 시작/종료 판정 컬럼과 날짜 파싱은 전체 프레임에 1회 선계산 — 제품 K개마다 반복 제거
+        if not df_raw_daily_all.empty:
+            df_raw_daily_all["date_dt"] = pd.to_datetime(df_raw_daily_all["date"], format="ISO8601", cache=True)
+            df_raw_daily_all["is_disc"] = (
+                (df_raw_daily_all["normal_price"] > 0)
+                & (df_raw_daily_all["sale_price"] > 0)
+                & (df_raw_daily_all["sale_price"] < df_raw_daily_all["normal_price"])
+            )
+            _grp_raw = df_raw_daily_all.groupby("product_url", sort=False)
+            df_raw_daily_all["prev_is_disc"] = _grp_raw["is_disc"].shift(1, fill_value=False)
+            df_raw_daily_all["prev_sale"] = _grp_raw["sale_price"].shift(1).fillna(0)
+        raw_daily_by_url = dict(tuple(df_raw_daily_all.groupby("product_url", sort=False))) if not df_raw_daily_all.empty else {}
+
+        # 🔥 제품마다 전체 벌크 프레임을 boolean 마스크로 재스캔하지 않도록 1회 분할
+        #    (events/life 파티션은 _delta_load가 저장소 뷰로 제공, 캐스팅은 벌크 로더 캐시 내부에서 1회 수행)
+        raw_unit_by_url = dict(tuple(df_raw_unit_all.groupby("product_url", sort=False))) if not df_raw_unit_all.empty else {}
+        out_dates_by_url, restore_dates_by_url = lifecycle_date_arrays(df_lifecycle_all)
+        _no_dates = np.array([], dtype="datetime64[ns]")
+
+        for product_url in selected_products:
+            row = get_product_row(product_url)
+
+            if row is None:
+                st.session_state.selected_products.discard(product_url)
+                continue
 
-        row = product_row.iloc[0]
-        pname = row["product_name"]
+            pname = row["product_name"]
 
-        df_price = df_all_events[
-            df_all_events["product_url"] == row["product_url"]
-        ].copy()
-        if not df_price.empty:
-            tmp = df_price.copy()
+            df_price = events_by_url.get(row["product_url"], df_all_events.iloc[0:0])
+            if not df_price.empty:
+                # 1️⃣ display_name 먼저 정의
+                if row['brand'] == '네스프레소':
+                    cat2 = str(row.get('category2') or '').strip()
+                    display_name = f"{row['brand']} - {cat2} - {pname}" if cat2 else f"{row['brand']} - {pname}"
+                else:
+                    display_name = f"{row['brand']} - {pname}"
 
-            # 1️⃣ display_name 먼저 정의
-            if row['brand'] == '네스프레소':
-                cat2 = str(row.get('category2') or '').strip()
-                display_name = f"{row['brand']} - {cat2} - {pname}" if cat2 else f"{row['brand']} - {pname}"
-            else:
-                display_name = f"{row['brand']} - {pname}"
+                # 2️⃣ copy 없이 assign으로 새 프레임 1회 생성 — 공유 groupby 파티션(df_price)은 불변 유지
+                #    (event_date/unit_price는 벌크 로드 시 이미 캐스팅됨)
+                tmp = df_price.assign(product_name=display_name).sort_values("event_date")
             
-            # 2️⃣ 그 다음 사용
-            tmp["product_name"] = display_name
-            tmp["event_date"] = pd.to_datetime(tmp["date"])
-            tmp = tmp.sort_values("event_date")
-            
-            # 3️⃣ 중복 제거 (DISCOUNT 우선)
-            type_priority = {"DISCOUNT": 1, "NORMAL": 0}
-            tmp["_priority"] = tmp["event_type"].map(type_priority).fillna(0)
-            tmp = (
-                tmp.sort_values(["event_date", "_priority"])
-                   .drop_duplicates(subset=["event_date"], keep="last")
-                   .drop(columns=["_priority"])
-            )
+                # 3️⃣ 중복 제거 (DISCOUNT 우선)
+                # ⚠️ category 컬럼의 .map은 categorical을 돌려줘 숫자 정렬이 깨짐 — 수치 dtype 강제
+                type_priority = {"DISCOUNT": 1, "NORMAL": 0}
+                tmp["_priority"] = pd.to_numeric(
+                    tmp["event_type"].map(type_priority), errors="coerce"
+                ).fillna(0)
+                tmp = (
+                    tmp.sort_values(["event_date", "_priority"])
+                       .drop_duplicates(subset=["event_date"], keep="last")
+                       .drop(columns=["_priority"])
+                )
             
-            all_dates = pd.date_range(
-                start=tmp["event_date"].min(),
-                end=tmp["event_date"].max(),
-                freq="D"
-            )
+                all_dates = pd.date_range(
+                    start=tmp["event_date"].min(),
+                    end=tmp["event_date"].max(),
+                    freq="D"
+                )
             
-            tmp = tmp.set_index("event_date").reindex(all_dates).reset_index()
-            tmp.rename(columns={"index": "event_date"}, inplace=True)
-
-            tmp["unit_price"] = tmp["unit_price"].ffill()
-            tmp["product_name"] = tmp["product_name"].ffill()
-
-            tmp.loc[tmp["unit_price"] == 0, "unit_price"] = None
+                tmp = tmp.set_index("event_date").reindex(all_dates).reset_index()
+                tmp.rename(columns={"index": "event_date"}, inplace=True)
 
-            tmp["normal_price"] = None
-            tmp["discount_rate"] = None
-            tmp["price_detail"] = ""
+                tmp["unit_price"] = tmp["unit_price"].ffill()
+                tmp["product_name"] = tmp["product_name"].ffill()
 
-            df_raw_tmp = df_raw_unit_all[
-                df_raw_unit_all["product_url"] == row["product_url"]
-            ].copy()
+                tmp.loc[tmp["unit_price"] == 0, "unit_price"] = None
 
-            if not df_raw_tmp.empty:
-                df_raw_tmp["date"] = pd.to_datetime(df_raw_tmp["date"])
+                tmp["normal_price"] = None
+                tmp["discount_rate"] = None
+                tmp["price_detail"] = ""
 
-                if "normal_price" in tmp.columns:
-                    tmp.drop(columns=["normal_price"], inplace=True)
+                df_raw_tmp = raw_unit_by_url.get(row["product_url"], df_raw_unit_all.iloc[0:0])
 
-                tmp = tmp.merge(
-                    df_raw_tmp[["date", "unit_normal_price"]],
-                    left_on="event_date",
-                    right_on="date",
-                    how="left"
-                )
-
-                tmp.rename(columns={"unit_normal_price": "normal_price"}, inplace=True)
-                tmp.drop(columns=["date"], inplace=True, errors="ignore")
-                tmp = tmp.reset_index(drop=True)
+                if not df_raw_tmp.empty:
+                    if "normal_price" in tmp.columns:
+                        tmp.drop(columns=["normal_price"], inplace=True)
 
-                tmp["normal_price"] = pd.to_numeric(tmp["normal_price"], errors="coerce")
-                tmp["unit_price"] = pd.to_numeric(tmp["unit_price"], errors="coerce")
-
-            tmp["discount_rate"] = None
-            tmp["is_discount"] = (tmp["event_type"] == "DISCOUNT").astype(bool)
+                    tmp = tmp.merge(
+                        df_raw_tmp[["date", "unit_normal_price"]],
+                        left_on="event_date",
+                        right_on="date",
+                        how="left"
+                    )
 
-            mask = (
-                (tmp["is_discount"]) &
-                (tmp["normal_price"].notna()) &
-                (tmp["unit_price"].notna()) &
-                (tmp["normal_price"] > 0)
-            )
+                    tmp.rename(columns={"unit_normal_price": "normal_price"}, inplace=True)
+                    tmp.drop(columns=["date"], inplace=True, errors="ignore")
+                    tmp = tmp.reset_index(drop=True)
 
-            tmp.loc[mask, "discount_rate"] = (
-                (tmp.loc[mask, "normal_price"] - tmp.loc[mask, "unit_price"])
-                / tmp.loc[mask, "normal_price"]
-            ) * 100
-
-            # 조회 기간 내 통계 사전 계산
-            _discount_prices = tmp.loc[tmp["is_discount"] & tmp["unit_price"].notna(), "unit_price"]
-            _normal_prices   = tmp.loc[~tmp["is_discount"] & tmp["unit_price"].notna(), "unit_price"]
-
-            if not _discount_prices.empty:
-                _stat_avg = _discount_prices.mean()
-                _stat_min = _discount_prices.min()
-                _stat_max = _discount_prices.max()
-                _stat_label = "할인가"
-            elif not _normal_prices.empty:
-                _stat_avg = _normal_prices.mean()
-                _stat_min = _normal_prices.min()
-                _stat_max = _normal_prices.max()
-                _stat_label = "정상가"
-            else:
-                _stat_avg = _stat_min = _stat_max = None
-                _stat_label = ""
+                tmp["discount_rate"] = None
+                tmp["is_discount"] = (tmp["event_type"] == "DISCOUNT").astype(bool)
 
-            _stat_str = (
-                f"평균 {_stat_avg:,.1f}원 | 최저 {_stat_min:,.1f}원 | 최고 {_stat_max:,.1f}원"
-                if _stat_avg is not None else ""
-            )
+                mask = (
+                    (tmp["is_discount"]) &
+                    (tmp["normal_price"].notna()) &
+                    (tmp["unit_price"].notna()) &
+                    (tmp["normal_price"] > 0)
+                )
 
-            for idx2, price_row in tmp.iterrows():
-                if pd.isna(price_row["unit_price"]):
-                    tmp.at[idx2, "price_detail"] = "품절"
-                elif price_row["is_discount"]:
-                    base = (
-                        f"정상가: {price_row['normal_price']:,.1f}원 → 할인가: {price_row['unit_price']:,.1f}원"
-                        if pd.notna(price_row["normal_price"])
-                        else f"할인가: {price_row['unit_price']:,.1f}원"
-                    )
-                    tmp.at[idx2, "price_detail"] = f"{base} | {_stat_str}" if _stat_str else base
+                tmp.loc[mask, "discount_rate"] = (
+                    (tmp.loc[mask, "normal_price"] - tmp.loc[mask, "unit_price"])
+                    / tmp.loc[mask, "normal_price"]
+                ) * 100
+
+                # 조회 기간 내 통계 사전 계산
+                _discount_prices = tmp.loc[tmp["is_discount"] & tmp["unit_price"].notna(), "unit_price"]
+                _normal_prices   = tmp.loc[~tmp["is_discount"] & tmp["unit_price"].notna(), "unit_price"]
+
+                if not _discount_prices.empty:
+                    _stat_avg = _discount_prices.mean()
+                    _stat_min = _discount_prices.min()
+                    _stat_max = _discount_prices.max()
+                    _stat_label = "할인가"
+                elif not _normal_prices.empty:
+                    _stat_avg = _normal_prices.mean()
+                    _stat_min = _normal_prices.min()
+                    _stat_max = _normal_prices.max()
+                    _stat_label = "정상가"
                 else:
-                    base = f"정상가: {price_row['unit_price']:,.1f}원"
-                    tmp.at[idx2, "price_detail"] = f"{base} | {_stat_str}" if _stat_str else base
-
-            df_life = df_lifecycle_all[
-                df_lifecycle_all["product_url"] == product_url
-            ].copy()
+                    _stat_avg = _stat_min = _stat_max = None
+                    _stat_label = ""
 
-            if not df_life.empty:
-                df_life["date"] = pd.to_datetime(df_life["date"])
-                out_dates = sorted(
-                    df_life[df_life["lifecycle_event"]=="OUT_OF_STOCK"]["date"].dt.date
-                )
-                restore_dates = sorted(
-                    df_life[df_life["lifecycle_event"]=="RESTOCK"]["date"].dt.date
+                _stat_str = (
+                    f"평균 {_stat_avg:,.1f}원 | 최저 {_stat_min:,.1f}원 | 최고 {_stat_max:,.1f}원"
+                    if _stat_avg is not None else ""
                 )
 
-                from bisect import bisect_right
-
-                out_dates_sorted = sorted(out_dates)
-                restore_dates_sorted = sorted(restore_dates)
-
-                for r2 in tmp.itertuples():
-                    current_date = r2.event_date.date()
-                    i_out = bisect_right(out_dates_sorted, current_date) - 1
-                    last_out = out_dates_sorted[i_out] if i_out >= 0 else None
-                    i_restore = bisect_right(restore_dates_sorted, current_date) - 1
-                    last_restore = restore_dates_sorted[i_restore] if i_restore >= 0 else None
-                    if last_out and (not last_restore or last_out > last_restore):
-                        tmp.at[r2.Index, "unit_price"] = None
-
-            tmp.loc[tmp["unit_price"].isna(), "price_detail"] = "품절"
-            def make_price_status(row):
-                if pd.isna(row["unit_price"]):
-                    return "품절"
-                if row["is_discount"]:
-                    if pd.notna(row["discount_rate"]) and row["discount_rate"] > 0:
-                        return f"💸 할인 ({row['discount_rate']:.0f}% 할인)"
-                    return "💸 할인"
-                return "정상가"
-            tmp["price_status"] = tmp.apply(make_price_status, axis=1)
-
-            tmp["product_url"] = row["product_url"]
-
-            timeline_rows.append(
-                tmp[["product_url", "product_name", "event_date", "unit_price", "price_status", "price_detail"]]
-            )
+                for idx2, price_row in tmp.iterrows():
+                    if pd.isna(price_row["unit_price"]):
+                        tmp.at[idx2, "price_detail"] = "품절"
+                    elif price_row["is_discount"]:
+                        base = (
+                            f"정상가: {price_row['normal_price']:,.1f}원 → 할인가: {price_row['unit_price']:,.1f}원"
+                            if pd.notna(price_row["normal_price"])
+                            else f"할인가: {price_row['unit_price']:,.1f}원"
+                        )
+                        tmp.at[idx2, "price_detail"] = f"{base} | {_stat_str}" if _stat_str else base
+                    else:
+                        base = f"정상가: {price_row['unit_price']:,.1f}원"
+                        tmp.at[idx2, "price_detail"] = f"{base} | {_stat_str}" if _stat_str else base
+
+                # 🔥 행별 bisect 루프 대신 searchsorted 브로드캐스트로 품절 구간 일괄 마스킹
+                #    (제품별 정렬 배열은 lifecycle_date_arrays에서 캐시 선계산)
+                out_ts = out_dates_by_url.get(product_url, _no_dates)
+                restore_ts = restore_dates_by_url.get(product_url, _no_dates)
+
+                if len(out_ts):
+                    ev = tmp["event_date"].to_numpy()
+                    i_out = np.searchsorted(out_ts, ev, side="right") - 1
+                    has_out = i_out >= 0
+                    last_out = out_ts[np.clip(i_out, 0, None)]
+                    if len(restore_ts):
+                        i_res = np.searchsorted(restore_ts, ev, side="right") - 1
+                        has_res = i_res >= 0
+                        last_res = restore_ts[np.clip(i_res, 0, None)]
+                        mask = has_out & (~has_res | (last_out > last_res))
+                    else:
+                        mask = has_out
+                    tmp.loc[mask, "unit_price"] = None
+
+                tmp.loc[tmp["unit_price"].isna(), "price_detail"] = "품절"
+
+                # 🔥 행별 apply 대신 np.select로 상태 문자열 일괄 생성
+                _rate = pd.to_numeric(tmp["discount_rate"], errors="coerce")
+                _rate_label = "💸 할인 (" + _rate.round(0).astype("Int64").astype(str) + "% 할인)"
+                tmp["price_status"] = np.select(
+                    [
+                        tmp["unit_price"].isna(),
+                        tmp["is_discount"] & (_rate > 0),
+                        tmp["is_discount"],
+                    ],
+                    ["품절", _rate_label, "💸 할인"],
+                    default="정상가",
+                )
 
-            df_life = df_lifecycle_all[
-                df_lifecycle_all["product_url"] == product_url
-            ].copy()
-            if not df_life.empty:
-                df_life["date"] = pd.to_datetime(df_life["date"], errors="coerce")
-                df_life = df_life.dropna(subset=["date"])
+                tmp["product_url"] = row["product_url"]
 
-                lc_tmp = df_life.copy()
-                if row['brand'] == '네스프레소':
-                    cat2 = str(row.get('category2') or '').strip()
-                    display_name = f"{row['brand']} - {cat2} - {pname}" if cat2 else f"{row['brand']} - {pname}"
-                else:
-                    display_name = f"{row['brand']} - {pname}"
-                lc_tmp["product_name"] = display_name
-                lc_tmp["event_date"] = pd.to_datetime(lc_tmp["date"])
+                timeline_rows.append(
+                    tmp[["product_url", "product_name", "event_date", "unit_price", "price_status", "price_detail"]]
+                )
 
-                lc_final = lc_tmp.drop_duplicates(subset=["product_name", "event_date", "lifecycle_event"])
+                df_life = life_by_url.get(product_url, df_lifecycle_all.iloc[0:0])
+                if not df_life.empty:
+                    df_life = df_life.dropna(subset=["date"])
 
-                lc_final = lc_final[
-                    (lc_final["event_date"] >= filter_date_from) &
-                    (lc_final["event_date"] <= filter_date_to)
-                ]
+                    if row['brand'] == '네스프레소':
+                        cat2 = str(row.get('category2') or '').strip()
+                        display_name = f"{row['brand']} - {cat2} - {pname}" if cat2 else f"{row['brand']} - {pname}"
+                    else:
+                        display_name = f"{row['brand']} - {pname}"
+                    # dropna가 이미 새 프레임을 반환했으므로 copy 불필요 — assign으로 컬럼만 추가
+                    lc_tmp = df_life.assign(product_name=display_name, event_date=df_life["date"])
 
-                if not tmp.empty:
-                    zero_dates = tmp[tmp["unit_price"].isna()]["event_date"].tolist()
-                    existing_out = lc_final[lc_final["lifecycle_event"] == "OUT_OF_STOCK"]["event_date"].tolist()
-                    existing_restock = lc_final[lc_final["lifecycle_event"] == "RESTOCK"]["event_date"].tolist()
+                    lc_final = lc_tmp.drop_duplicates(subset=["product_name", "event_date", "lifecycle_event"])
 
-                    new_rows = []
-                    for zdate in sorted(zero_dates):
-                        if zdate in existing_out:
-                            continue
-                        prior_restocks = [d for d in existing_restock if d <= zdate]
-                        prior_outs = [d for d in existing_out + [r["event_date"] for r in new_rows] if d <= zdate]
-                        if not prior_outs or (prior_restocks and max(prior_restocks) > max(prior_outs)):
-                            new_rows.append({
-                                "product_name": display_name,
-                                "event_date": zdate,
-                                "lifecycle_event": "OUT_OF_STOCK"
-                            })
-                            existing_out.append(zdate)
+                    lc_final = lc_final[
+                        (lc_final["event_date"] >= filter_date_from) &
+                        (lc_final["event_date"] <= filter_date_to)
+                    ]
 
-                    if new_rows:
-                        lc_final = pd.concat([lc_final, pd.DataFrame(new_rows)], ignore_index=True)
+                    # 🔥 이벤트 종류별 날짜 목록을 groupby 1회로 분리 —
+                    #    같은 lifecycle_event 컬럼을 불리언 마스크로 3번 재스캔하지 않음
+                    lc_dates_by_event = {
+                        ev: grp["event_date"].tolist()
+                        for ev, grp in lc_final.groupby("lifecycle_event", observed=True)
+                    }
 
-                raw_lc_res = (
-                    supabase.table("raw_daily_prices")
-                    .select("date, normal_price")
-                    .eq("product_url", row["product_url"])
-                    .order("date", desc=False)
-                    .execute()
-                )
-                if raw_lc_res.data:
-                    raw_lc_df = pd.DataFrame(raw_lc_res.data)
-                    raw_lc_df["normal_price"] = raw_lc_df["normal_price"].astype(float)
-                    raw_lc_df["date"] = pd.to_datetime(raw_lc_df["date"])
-                    raw_lc_df["prev_price"] = raw_lc_df["normal_price"].shift(1)
-
-                    restock_from_raw = raw_lc_df[
-                        (raw_lc_df["prev_price"] == 0) & (raw_lc_df["normal_price"] > 0)
-                    ]["date"].tolist()
-
-                    existing_restock_dates = lc_final[lc_final["lifecycle_event"] == "RESTOCK"]["event_date"].tolist()
-
-                    for rdate in restock_from_raw:
-                        if rdate >= filter_date_from and rdate <= filter_date_to:
-                            if rdate not in existing_restock_dates:
-                                lc_final = pd.concat([lc_final, pd.DataFrame([{
+                    if not tmp.empty:
+                        zero_dates = tmp[tmp["unit_price"].isna()]["event_date"].tolist()
+                        existing_out = lc_dates_by_event.get("OUT_OF_STOCK", [])
+                        existing_restock = lc_dates_by_event.get("RESTOCK", [])
+
+                        new_rows = []
+                        for zdate in sorted(zero_dates):
+                            if zdate in existing_out:
+                                continue
+                            prior_restocks = [d for d in existing_restock if d <= zdate]
+                            prior_outs = [d for d in existing_out + [r["event_date"] for r in new_rows] if d <= zdate]
+                            if not prior_outs or (prior_restocks and max(prior_restocks) > max(prior_outs)):
+                                new_rows.append({
                                     "product_name": display_name,
-                                    "event_date": rdate,
-                                    "lifecycle_event": "RESTOCK"
-                                }])], ignore_index=True)
-
-                if not lc_final.empty:
-                    lifecycle_rows.append(
-                        lc_final[["product_name", "event_date", "lifecycle_event"]]
-                    )
+                                    "event_date": zdate,
+                                    "lifecycle_event": "OUT_OF_STOCK"
+                                })
+                                existing_out.append(zdate)
+
+                        if new_rows:
+                            lc_final = pd.concat([lc_final, pd.DataFrame(new_rows)], ignore_index=True)
+
+                    # 🔥 제품별 무제한 조회 대신 기간 필터된 벌크 프레임 재사용
+                    raw_lc_slice = raw_daily_by_url.get(row["product_url"], df_raw_daily_all.iloc[0:0])
+                    if not raw_lc_slice.empty:
+                        # date_dt는 벌크 프레임에서 1회 파싱됨 — 재파싱 없이 컬럼 교체
+                        raw_lc_df = raw_lc_slice.assign(date=raw_lc_slice["date_dt"])
+                        raw_lc_df["prev_price"] = raw_lc_df["normal_price"].shift(1)
+
+                        restock_from_raw = raw_lc_df[
+                            (raw_lc_df["prev_price"] == 0) & (raw_lc_df["normal_price"] > 0)
+                        ]["date"].tolist()
+
+                        # 위에서 합쳐진 new_rows는 전부 OUT_OF_STOCK — 복원 날짜 목록은 그대로 유효
+                        existing_restock_dates = lc_dates_by_event.get("RESTOCK", [])
+
+                        # 🔥 행마다 concat 금지 — 새 행을 모아 1회만 병합
+                        restock_rows = [
+                            {
+                                "product_name": display_name,
+                                "event_date": rdate,
+                                "lifecycle_event": "RESTOCK"
+                            }
+                            for rdate in restock_from_raw
+                            if filter_date_from <= rdate <= filter_date_to
+                            and rdate not in existing_restock_dates
+                        ]
+                        if restock_rows:
+                            lc_final = pd.concat([lc_final, pd.DataFrame(restock_rows)], ignore_index=True)
 
-            zero_price_dates = tmp[tmp["unit_price"].isna() & (tmp["price_detail"] == "품절")]["event_date"].tolist()
+                    if not lc_final.empty:
+                        lifecycle_rows.append(
+                            lc_final[["product_name", "event_date", "lifecycle_event"]]
+                        )
 
-            if zero_price_dates and not df_life.empty:
-                existing_out_dates = df_life[df_life["lifecycle_event"] == "OUT_OF_STOCK"]["date"].tolist()
-                for zdate in zero_price_dates:
-                    if zdate not in existing_out_dates:
-                        new_row = pd.DataFrame([{
-                            "date": zdate,
-                            "lifecycle_event": "OUT_OF_STOCK"
-                        }])
-                        df_life = pd.concat([df_life, new_row], ignore_index=True)
+                zero_price_dates = tmp[tmp["unit_price"].isna() & (tmp["price_detail"] == "품절")]["event_date"].tolist()
 
-    # =========================
-    # 8-1️⃣ 개당 가격 타임라인 비교 차트
-    # =========================
+                if zero_price_dates and not df_life.empty:
+                    existing_out_dates = set(df_life[df_life["lifecycle_event"] == "OUT_OF_STOCK"]["date"].tolist())
+                    out_rows_new = [
+                        {"date": zdate, "lifecycle_event": "OUT_OF_STOCK"}
+                        for zdate in zero_price_dates
+                        if zdate not in existing_out_dates
+                    ]
+                    if out_rows_new:
+                        df_life = pd.concat([df_life, pd.DataFrame(out_rows_new)], ignore_index=True)
 
-    if timeline_rows:
+        # =========================
+        # 8-1️⃣ 개당 가격 타임라인 비교 차트
+        # =========================
 
-        df_timeline = pd.concat(timeline_rows, ignore_index=True)
-        df_timeline = df_timeline.sort_values(["product_name", "event_date"])
-        df_timeline["unit_price"] = pd.to_numeric(df_timeline["unit_price"], errors="coerce")
-        df_timeline["segment"] = (
-            df_timeline["unit_price"].isna()
-            .groupby(df_timeline["product_name"])
-            .cumsum()
-        )
-        df_chart = df_timeline.dropna(subset=["unit_price"]).copy()
+        if timeline_rows:
 
-        df_chart["dup_rank"] = (
-            df_chart.groupby(["event_date", "unit_price"])
-            .cumcount()
-        )
-        df_chart["event_date_jitter"] = (
-            df_chart["event_date"] +
-            pd.to_timedelta(df_chart["dup_rank"] * 0.06, unit="D")
-        )
+            df_timeline = pd.concat(timeline_rows, ignore_index=True)
+            df_timeline = df_timeline.sort_values(["product_name", "event_date"])
+            # unit_price는 벌크 로더에서 이미 float32로 캐스팅됨 — 재변환 불필요
+            df_timeline["segment"] = (
+                df_timeline["unit_price"].isna()
+                .groupby(df_timeline["product_name"])
+                .cumsum()
+            )
+            df_chart = df_timeline.dropna(subset=["unit_price"])
 
-        def get_or_create_color_map(keys: list) -> dict:
-            palette = [
-                "#4c78a8","#f58518","#e45756","#72b7b2","#54a24b",
-                "#eeca3b","#b279a2","#ff9da6","#9d755d","#bab0ac",
-                "#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd",
-                "#8c564b","#e377c2","#7f7f7f","#bcbd22","#17becf",
-            ]
-            if "color_map" not in st.session_state:
-                st.session_state["color_map"] = {}
-            cmap = st.session_state["color_map"]
-            for k in sorted(set([str(x) for x in keys if str(x).strip()])):
-                if k not in cmap:
-                    cmap[k] = palette[len(cmap) % len(palette)]
-            st.session_state["color_map"] = cmap
-            return cmap
-
-        def color_dot(hex_color: str) -> str:
-            return (
-                f"<span style='"
-                f"color:{hex_color};"
-                f"font-size:22px;"
-                f"margin-right:12px;"
-                f"display:inline-block;"
-                f"vertical-align:middle;"
-                f"'>●</span>"
+            df_chart["dup_rank"] = (
+                df_chart.groupby(["event_date", "unit_price"])
+                .cumcount()
+            )
+            df_chart["event_date_jitter"] = (
+                df_chart["event_date"] +
+                pd.to_timedelta(df_chart["dup_rank"] * 0.06, unit="D")
             )
 
-        col_chart, col_legend = st.columns([3, 1])
-
-        color_map = get_or_create_color_map(df_chart["product_name"].unique().tolist())
-        color_domain = list(color_map.keys())
-        color_range = [color_map[k] for k in color_domain]
-
-        with col_chart:
-            show_overlap = st.toggle("겹친 제품 수 표시", value=False, key="toggle_overlap")
-
-            base_line = (
-                alt.Chart(df_chart)
-                .mark_line()
-                .encode(
-                    x=alt.X("event_date:T", title="날짜", axis=alt.Axis(format="%m/%d")),
-                    y=alt.Y("unit_price:Q", title="개당 가격 (원)"),
-                    color=alt.Color(
-                        "product_name:N",
-                        scale=alt.Scale(domain=color_domain, range=color_range),
-                        legend=None
-                    ),
-                    detail="segment:N",
+            def get_or_create_color_map(keys: list) -> dict:
+                palette = [
+                    "#4c78a8","#f58518","#e45756","#72b7b2","#54a24b",
+                    "#eeca3b","#b279a2","#ff9da6","#9d755d","#bab0ac",
+                    "#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd",
+                    "#8c564b","#e377c2","#7f7f7f","#bcbd22","#17becf",
+                ]
+                if "color_map" not in st.session_state:
+                    st.session_state["color_map"] = {}
+                cmap = st.session_state["color_map"]
+                for k in sorted(set([str(x) for x in keys if str(x).strip()])):
+                    if k not in cmap:
+                        cmap[k] = palette[len(cmap) % len(palette)]
+                st.session_state["color_map"] = cmap
+                return cmap
+
+            def color_dot(hex_color: str) -> str:
+                return (
+                    f"<span style='"
+                    f"color:{hex_color};"
+                    f"font-size:22px;"
+                    f"margin-right:12px;"
+                    f"display:inline-block;"
+                    f"vertical-align:middle;"
+                    f"'>●</span>"
                 )
-            )
 
-            # 라이프사이클 이벤트를 df_chart 형태로 변환해서 합치기
-            if lifecycle_rows:
-                df_life_for_count = pd.concat(lifecycle_rows, ignore_index=True).copy()
-                df_life_for_count = df_life_for_count.merge(
-                    df_chart[["product_name", "event_date", "unit_price"]].drop_duplicates(),
-                    on=["product_name", "event_date"],
-                    how="left"
+            col_chart, col_legend = st.columns([3, 1])
+
+            color_map = get_or_create_color_map(df_chart["product_name"].unique().tolist())
+            color_domain = list(color_map.keys())
+            color_range = [color_map[k] for k in color_domain]
+
+            with col_chart:
+                show_overlap = st.toggle("겹친 제품 수 표시", value=False, key="toggle_overlap")
+
+                base_line = (
+                    # 인코딩에 쓰는 컬럼만 인라인 — websocket으로 나가는 스펙 바이트 절감
+                    alt.Chart(df_chart[["event_date", "unit_price", "product_name", "segment"]])
+                    .mark_line()
+                    .encode(
+                        x=alt.X("event_date:T", title="날짜", axis=alt.Axis(format="%m/%d")),
+                        y=alt.Y("unit_price:Q", title="개당 가격 (원)"),
+                        color=alt.Color(
+                            "product_name:N",
+                            scale=alt.Scale(domain=color_domain, range=color_range),
+                            legend=None
+                        ),
+                        detail="segment:N",
+                    )
                 )
-                # unit_price가 없으면 해당 제품의 직전 가격으로 채우기
-                for idx2, r2 in df_life_for_count[df_life_for_count["unit_price"].isna()].iterrows():
-                    product_prices = df_chart[
-                        (df_chart["product_name"] == r2["product_name"]) &
-                        (df_chart["event_date"] <= r2["event_date"]) &
-                        (df_chart["unit_price"].notna())
-                    ]
-                    if not product_prices.empty:
-                        closest = product_prices.sort_values("event_date").iloc[-1]
-                        df_life_for_count.at[idx2, "unit_price"] = closest["unit_price"]
+
+                # 라이프사이클 이벤트를 df_chart 형태로 변환해서 합치기
+                if lifecycle_rows:
+                    df_life_for_count = pd.concat(lifecycle_rows, ignore_index=True)
+                    df_life_for_count = df_life_for_count.merge(
+                        df_chart[["product_name", "event_date", "unit_price"]].drop_duplicates(),
+                        on=["product_name", "event_date"],
+                        how="left"
+                    )
+                    # unit_price가 없으면 해당 제품의 직전 가격으로 채우기
+                    # 🔥 행별 루프 제거 — NaN 행 전체를 정렬 1회 + merge_asof 백워드 조인으로 일괄 보충
+                    na_mask = df_life_for_count["unit_price"].isna()
+                    if na_mask.any():
+                        price_ts_fill = (
+                            df_chart.dropna(subset=["unit_price"])
+                            [["product_name", "event_date", "unit_price"]]
+                            .rename(columns={"unit_price": "asof_price"})
+                            .sort_values("event_date")
+                        )
+                        na_rows = (
+                            df_life_for_count[na_mask]
+                            .dropna(subset=["event_date"])
+                            .sort_values("event_date")
+                        )
+                        joined_fill = pd.merge_asof(
+                            na_rows, price_ts_fill,
+                            on="event_date", by="product_name", direction="backward",
+                        )
+                        joined_fill.index = na_rows.index
+                        df_life_for_count.loc[na_rows.index, "unit_price"] = joined_fill["asof_price"]
                 
-                df_life_for_count = df_life_for_count.dropna(subset=["unit_price"])
-                df_life_for_count["price_detail"] = df_life_for_count["lifecycle_event"]
-                df_life_for_count["price_status"] = df_life_for_count["lifecycle_event"]
-                df_chart_for_points = pd.concat(
-                    [df_chart, df_life_for_count[["product_name", "event_date", "unit_price", "price_detail", "price_status"]]],
-                    ignore_index=True
-                )
-            else:
-                df_chart_for_points = df_chart.copy()
+                    df_life_for_count = df_life_for_count.dropna(subset=["unit_price"])
+                    df_life_for_count["price_detail"] = df_life_for_count["lifecycle_event"]
+                    df_life_for_count["price_status"] = df_life_for_count["lifecycle_event"]
+                    df_chart_for_points = pd.concat(
+                        [df_chart, df_life_for_count[["product_name", "event_date", "unit_price", "price_detail", "price_status"]]],
+                        ignore_index=True
+                    )
+                else:
+                    # 아래 groupby는 읽기 전용이므로 복사 없이 그대로 사용
+                    df_chart_for_points = df_chart
             
-            df_points = (
-                df_chart_for_points.groupby(["event_date", "unit_price"])
-                .agg(
-                    product_names=("product_name", lambda x: "\n".join(sorted(set(x)))),
-                    price_detail=("price_detail", lambda x: " / ".join(dict.fromkeys(x))),
-                    price_status=("price_status", "first"),
-                    count=("product_name", lambda x: len(set(x))),
-                    product_name=("product_name", "first"),
+                # 🔥 그룹마다 set/dict를 만드는 Python lambda 집계 제거 —
+                #    중복 제거·정렬을 프레임 전체에 벡터 연산으로 먼저 끝내고,
+                #    그룹별로는 내장 str.join만 남긴다 (count는 dedupe 후 size == nunique)
+                point_key = ["event_date", "unit_price"]
+                g_names = (
+                    df_chart_for_points[point_key + ["product_name"]]
+                    .drop_duplicates()
+                    .sort_values(point_key + ["product_name"])
+                    .groupby(point_key)["product_name"]
                 )
-                .reset_index()
-            )
-
-            df_overlap = df_points[df_points["count"] > 1].copy()
-            df_single = df_points[df_points["count"] == 1].copy()
-
-            point_single = (
-                alt.Chart(df_single)
-                .mark_point(size=60, filled=True)
-                .encode(
-                    x=alt.X("event_date:T"),
-                    y=alt.Y("unit_price:Q"),
-                    color=alt.Color(
-                        "product_name:N",
-                        scale=alt.Scale(domain=color_domain, range=color_range),
-                        legend=None
-                    ),
-                    tooltip=[
-                        alt.Tooltip("product_names:N", title="제품"),
-                        alt.Tooltip("event_date:T", title="날짜", format="%Y-%m-%d"),
-                        alt.Tooltip("price_detail:N", title="가격 정보"),
-                        alt.Tooltip("price_status:N", title="상태"),
-                    ],
+                g_details = (
+                    df_chart_for_points[point_key + ["price_detail"]]
+                    .drop_duplicates()  # 첫 등장 순서 유지 — dict.fromkeys와 동일
+                    .groupby(point_key)["price_detail"]
                 )
-            )
-
-            layers = [base_line, point_single]
+                g_first = df_chart_for_points.groupby(point_key)[["product_name", "price_status"]].first()
+                df_points = pd.DataFrame({
+                    "product_names": g_names.agg("\n".join),
+                    "price_detail": g_details.agg(" / ".join),
+                    "price_status": g_first["price_status"],
+                    "count": g_names.size(),
+                    "product_name": g_first["product_name"],
+                }).reset_index()
+
+                df_overlap = df_points.loc[
+                    df_points["count"] > 1,
+                    ["event_date", "unit_price", "product_names", "price_detail", "count"],
+                ]
+                df_single = df_points.loc[
+                    df_points["count"] == 1,
+                    ["event_date", "unit_price", "product_name", "product_names", "price_detail", "price_status"],
+                ]
 
-            if not df_overlap.empty:
-                point_overlap = (
-                    alt.Chart(df_overlap)
-                    .mark_point(size=120, filled=True, color="red")
+                point_single = (
+                    alt.Chart(df_single)
+                    .mark_point(size=60, filled=True)
                     .encode(
                         x=alt.X("event_date:T"),
                         y=alt.Y("unit_price:Q"),
+                        color=alt.Color(
+                            "product_name:N",
+                            scale=alt.Scale(domain=color_domain, range=color_range),
+                            legend=None
+                        ),
                         tooltip=[
-                            alt.Tooltip("product_names:N", title="제품 (겹침)"),
+                            alt.Tooltip("product_names:N", title="제품"),
                             alt.Tooltip("event_date:T", title="날짜", format="%Y-%m-%d"),
                             alt.Tooltip("price_detail:N", title="가격 정보"),
-                            alt.Tooltip("count:Q", title="겹친 제품 수"),
+                            alt.Tooltip("price_status:N", title="상태"),
                         ],
                     )
                 )
-                layers.append(point_overlap)
 
-                if show_overlap:
-                    text_overlap = (
+                layers = [base_line, point_single]
+
+                if not df_overlap.empty:
+                    point_overlap = (
                         alt.Chart(df_overlap)
-                        .mark_text(dy=-10, fontSize=11, fontWeight="bold", color="red")
+                        .mark_point(size=120, filled=True, color="red")
                         .encode(
                             x=alt.X("event_date:T"),
                             y=alt.Y("unit_price:Q"),
-                            text=alt.Text("count:Q"),
+                            tooltip=[
+                                alt.Tooltip("product_names:N", title="제품 (겹침)"),
+                                alt.Tooltip("event_date:T", title="날짜", format="%Y-%m-%d"),
+                                alt.Tooltip("price_detail:N", title="가격 정보"),
+                                alt.Tooltip("count:Q", title="겹친 제품 수"),
+                            ],
                         )
                     )
-                    layers.append(text_overlap)
-
-            if lifecycle_rows:
-                df_life_all = pd.concat(lifecycle_rows, ignore_index=True)
+                    layers.append(point_overlap)
+
+                    if show_overlap:
+                        text_overlap = (
+                            alt.Chart(df_overlap)
+                            .mark_text(dy=-10, fontSize=11, fontWeight="bold", color="red")
+                            .encode(
+                                x=alt.X("event_date:T"),
+                                y=alt.Y("unit_price:Q"),
+                                text=alt.Text("count:Q"),
+                            )
+                        )
+                        layers.append(text_overlap)
 
-                icon_config = {
-                    "NEW_PRODUCT": {"color": "green", "label": "NEW"},
-                    "OUT_OF_STOCK": {"color": "red", "label": "품절"},
-                    "RESTOCK": {"color": "orange", "label": "복원"},
-                }
+                if lifecycle_rows:
+                    df_life_all = pd.concat(lifecycle_rows, ignore_index=True)
 
-                for event_type, cfg in icon_config.items():
-                    df_filtered = df_life_all[df_life_all["lifecycle_event"] == event_type].copy()
-                    if df_filtered.empty:
-                        continue
-
-                    df_filtered = df_filtered.merge(
+                    # 🔥 가격 조인은 전체 이벤트에 1회만 수행 (이벤트 타입별 반복 merge 제거)
+                    df_life_all = df_life_all.merge(
                         df_timeline[["product_name", "event_date", "unit_price", "price_detail"]],
                         on=["product_name", "event_date"],
                         how="left"
                     )
 
-                    if event_type in ["OUT_OF_STOCK", "RESTOCK"]:
+                    icon_config = {
+                        "NEW_PRODUCT": {"color": "green", "label": "NEW"},
+                        "OUT_OF_STOCK": {"color": "red", "label": "품절"},
+                        "RESTOCK": {"color": "orange", "label": "복원"},
+                    }
+
+                    # 🔥 merge_asof의 정렬 복사/by-그룹 오버헤드 제거 —
+                    #    제품별 정렬 배열을 1회 만들고 searchsorted로 asof 가격을 찾는다
+                    price_ts = (
+                        df_timeline.dropna(subset=["unit_price"])
+                        [["product_name", "event_date", "unit_price", "price_detail"]]
+                        .sort_values("event_date")
+                    )
+                    price_arrays = {
+                        pname_key: (
+                            grp["event_date"].to_numpy(),
+                            grp["unit_price"].to_numpy(),
+                            grp["price_detail"].to_numpy(object),
+                        )
+                        for pname_key, grp in price_ts.groupby("product_name", sort=False)
+                    }
+
+                    def _asof_arrays(life_names, life_dates, direction):
+                        """제품별 searchsorted로 (asof 가격, asof 상세) 배열 계산"""
+                        prices = np.full(len(life_dates), np.nan)
+                        details = np.full(len(life_dates), None, dtype=object)
+                        for pname_key in pd.unique(life_names):
+                            arrs = price_arrays.get(pname_key)
+                            if arrs is None:
+                                continue
+                            p_dates, p_prices, p_details = arrs
+                            sel = life_names == pname_key
+                            target = life_dates[sel]
+                            if direction == "backward":
+                                idx = np.searchsorted(p_dates, target, side="right") - 1
+                            else:  # nearest — 동거리면 merge_asof처럼 이전 쪽 선택
+                                right = np.searchsorted(p_dates, target, side="left")
+                                left = np.clip(right - 1, 0, len(p_dates) - 1)
+                                right = np.clip(right, 0, len(p_dates) - 1)
+                                use_right = np.abs(p_dates[right] - target) < np.abs(target - p_dates[left])
+                                idx = np.where(use_right, right, left)
+                            valid = idx >= 0
+                            sub_p = prices[sel]
+                            sub_d = details[sel]
+                            sub_p[valid] = p_prices[idx[valid]]
+                            sub_d[valid] = p_details[idx[valid]]
+                            prices[sel] = sub_p
+                            details[sel] = sub_d
+                        return prices, details
+
+                    life_marker_frames = []
+                    for event_type, cfg in icon_config.items():
+                        df_filtered = df_life_all[df_life_all["lifecycle_event"] == event_type].copy()
+                        df_filtered = df_filtered.dropna(subset=["event_date"])
+                        if df_filtered.empty:
+                            continue
+
+                        # OUT은 품절 직전 가격, RESTOCK/NEW는 가장 가까운 가격
+                        direction = "backward" if event_type == "OUT_OF_STOCK" else "nearest"
+                        asof_raw_price, asof_raw_detail = _asof_arrays(
+                            df_filtered["product_name"].to_numpy(),
+                            df_filtered["event_date"].to_numpy(),
+                            direction,
+                        )
+                        asof_price = pd.Series(asof_raw_price, index=df_filtered.index)
+                        asof_detail = pd.Series(asof_raw_detail, index=df_filtered.index)
+
                         if event_type == "OUT_OF_STOCK":
-                            for idx2, r2 in df_filtered.iterrows():
-                                product_prices = df_timeline[
-                                    (df_timeline["product_name"] == r2["product_name"]) &
-                                    (df_timeline["event_date"] <= r2["event_date"]) &
-                                    (df_timeline["unit_price"].notna())
-                                ]
-                                if not product_prices.empty:
-                                    closest = product_prices.sort_values("event_date").iloc[-1]
-                                    df_filtered.at[idx2, "unit_price"] = closest["unit_price"]
+                            df_filtered["unit_price"] = asof_price.where(
+                                asof_price.notna(), df_filtered["unit_price"]
+                            )
                             df_filtered["price_detail"] = "-"
                             df_filtered["price_status"] = "품절"
-
                         elif event_type == "RESTOCK":
-                            for idx2, r2 in df_filtered.iterrows():
-                                product_prices = df_timeline[
-                                    (df_timeline["product_name"] == r2["product_name"]) &
-                                    (df_timeline["unit_price"].notna())
-                                ]
-                                if not product_prices.empty:
-                                    pp = product_prices.copy()
-                                    pp["date_diff"] = (pp["event_date"] - r2["event_date"]).abs()
-                                    closest = pp.sort_values("date_diff").iloc[0]
-                                    df_filtered.at[idx2, "unit_price"] = closest["unit_price"]
-                                    df_filtered.at[idx2, "price_detail"] = closest["price_detail"]
-                    else:
-                        for idx2, r2 in df_filtered[df_filtered["unit_price"].isna()].iterrows():
-                            product_prices = df_timeline[
-                                (df_timeline["product_name"] == r2["product_name"]) &
-                                (df_timeline["unit_price"].notna())
-                            ]
-                            if not product_prices.empty:
-                                pp = product_prices.copy()
-                                pp["date_diff"] = (pp["event_date"] - r2["event_date"]).abs().dt.total_seconds()
-                                closest = pp.nsmallest(1, "date_diff").iloc[0]
-                                df_filtered.at[idx2, "unit_price"] = closest["unit_price"]
-                                df_filtered.at[idx2, "price_detail"] = closest["price_detail"]
-
-                    if df_filtered.empty:
-                        continue
+                            df_filtered["unit_price"] = asof_price.where(
+                                asof_price.notna(), df_filtered["unit_price"]
+                            )
+                            df_filtered["price_detail"] = asof_detail.where(
+                                asof_detail.notna(), df_filtered["price_detail"]
+                            )
+                        else:
+                            # NEW_PRODUCT는 가격이 비어 있는 행만 보충
+                            na_mask = df_filtered["unit_price"].isna() & asof_price.notna()
+                            df_filtered.loc[na_mask, "unit_price"] = asof_price.loc[na_mask]
+                            df_filtered.loc[na_mask, "price_detail"] = asof_detail.loc[na_mask]
+
+                        event_label_map = {
+                            "NEW_PRODUCT": "신제품",
+                            "OUT_OF_STOCK": "품절",
+                            "RESTOCK": "복원",
+                        }
+                        df_filtered["event_label"] = df_filtered["lifecycle_event"].map(event_label_map).fillna(df_filtered["lifecycle_event"])
+                        df_filtered["marker_label"] = cfg["label"]
+
+                        life_marker_frames.append(
+                            df_filtered[["product_name", "event_date", "unit_price", "price_detail", "event_label", "marker_label"]]
+                        )
 
-                    event_label_map = {
-                        "NEW_PRODUCT": "신제품",
-                        "OUT_OF_STOCK": "품절",
-                        "RESTOCK": "복원",
-                    }
-                    df_filtered["event_label"] = df_filtered["lifecycle_event"].map(event_label_map).fillna(df_filtered["lifecycle_event"])
+                    # 🔥 타입별 point+text 6개 레이어 대신 색상 인코딩 하나로 2개 레이어만 생성
+                    #    (Vega 스펙/직렬화 데이터가 레이어 수에 비례해 줄어듦)
+                    if life_marker_frames:
+                        df_life_markers = pd.concat(life_marker_frames, ignore_index=True)
+                        marker_scale = alt.Scale(
+                            domain=[cfg["label"] for cfg in icon_config.values()],
+                            range=[cfg["color"] for cfg in icon_config.values()],
+                        )
 
-                    point_layer = (
-                        alt.Chart(df_filtered)
-                        .mark_point(size=150, shape="triangle-up", color=cfg["color"])
-                        .encode(
-                            x="event_date:T",
-                            y="unit_price:Q",
-                            tooltip=[
-                                alt.Tooltip("product_name:N", title="제품"),
-                                alt.Tooltip("event_date:T", title="날짜", format="%Y-%m-%d"),
-                                alt.Tooltip("price_detail:N", title="가격 정보"),
-                                alt.Tooltip("event_label:N", title="이벤트"),
-                            ],
+                        point_layer = (
+                            alt.Chart(df_life_markers)
+                            .mark_point(size=150, shape="triangle-up")
+                            .encode(
+                                x="event_date:T",
+                                y="unit_price:Q",
+                                color=alt.Color("marker_label:N", scale=marker_scale, legend=None),
+                                tooltip=[
+                                    alt.Tooltip("product_name:N", title="제품"),
+                                    alt.Tooltip("event_date:T", title="날짜", format="%Y-%m-%d"),
+                                    alt.Tooltip("price_detail:N", title="가격 정보"),
+                                    alt.Tooltip("event_label:N", title="이벤트"),
+                                ],
+                            )
                         )
-                    )
 
-                    text_layer = (
-                        alt.Chart(df_filtered)
-                        .mark_text(dy=12, fontSize=11, fontWeight="bold", color=cfg["color"])
-                        .encode(
-                            x="event_date:T",
-                            y="unit_price:Q",
-                            text=alt.value(cfg["label"]),
+                        text_layer = (
+                            alt.Chart(df_life_markers)
+                            .mark_text(dy=12, fontSize=11, fontWeight="bold")
+                            .encode(
+                                x="event_date:T",
+                                y="unit_price:Q",
+                                text=alt.Text("marker_label:N"),
+                                color=alt.Color("marker_label:N", scale=marker_scale, legend=None),
+                            )
                         )
-                    )
 
-                    layers.append(point_layer)
-                    layers.append(text_layer)
+                        layers.append(point_layer)
+                        layers.append(text_layer)
 
-            chart = alt.layer(*layers).properties(height=420).interactive()
-            st.altair_chart(chart, use_container_width=True)
+                chart = alt.layer(*layers).properties(height=420).interactive()
+                st.altair_chart(chart, use_container_width=True)
 
-        with col_legend:
-            st.markdown("#### 📋 제품 목록")
+            with col_legend:
+                st.markdown("#### 📋 제품 목록")
 
-            unique_urls = sorted(df_chart["product_url"].unique())
+                unique_urls = sorted(df_chart["product_url"].unique())
 
-            for product_url in unique_urls:
-                product_row = df_all[df_all["product_url"] == product_url]
-                if product_row.empty:
-                    continue
+                for product_url in unique_urls:
+                    row = get_product_row(product_url)
+                    if row is None:
+                        continue
 
-                row = product_row.iloc[0]
-                label = format_product_label(row)
-                # 차트의 product_name 컬럼과 동일한 방식으로 생성
-                pname_legend = row["product_name"]
-                if row['brand'] == '네스프레소':
-                    cat2 = str(row.get('category2') or '').strip()
-                    chart_display_name = f"{row['brand']} - {cat2} - {pname_legend}" if cat2 else f"{row['brand']} - {pname_legend}"
-                else:
-                    chart_display_name = f"{row['brand']} - {pname_legend}"
-                hex_color = color_map.get(chart_display_name, "#999999")
-
-                col_btn, col_name = st.columns([1, 10])
-
-                with col_btn:
-                    if st.button("×", key=f"remove_product_{product_url}", help="차트에서 제거"):
-                        clean_url = product_url.strip("_")
-                        remove_product_everywhere(clean_url)
-                        st.rerun()
-
-                with col_name:
-                    html = (
-                        f"<div style='display:flex; align-items:center; gap:12px;'>"
-                        f"<span style='color:{hex_color}; font-size:22px; line-height:1; flex:0 0 auto;'>●</span>"
-                        f"<div style='white-space:normal; word-break:keep-all; overflow-wrap:break-word; line-height:1.4;'>"
-                        f"<b>{label}</b>"
-                        f"</div>"
-                        f"</div>"
-                    )
-                    st.markdown(html, unsafe_allow_html=True)
+                    label = format_product_label(row)
+                    # 차트의 product_name 컬럼과 동일한 방식으로 생성
+                    pname_legend = row["product_name"]
+                    if row['brand'] == '네스프레소':
+                        cat2 = str(row.get('category2') or '').strip()
+                        chart_display_name = f"{row['brand']} - {cat2} - {pname_legend}" if cat2 else f"{row['brand']} - {pname_legend}"
+                    else:
+                        chart_display_name = f"{row['brand']} - {pname_legend}"
+                    hex_color = color_map.get(chart_display_name, "#999999")
 
-        # =========================
-        # 🔥 엑셀 다운로드
-        # =========================
-        with download_placeholder:
+                    col_btn, col_name = st.columns([1, 10])
 
-            from io import BytesIO
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, PatternFill
-            from openpyxl.utils import get_column_letter
+                    with col_btn:
+                        if st.button("×", key=register_dynamic_key(f"remove_product_{product_url}"), help="차트에서 제거"):
+                            clean_url = product_url.strip("_")
+                            remove_product_everywhere(clean_url)
+                            st.rerun()
 
-            # raw_daily_prices_unit 전체 조회 (정상가 + 할인가)
-            raw_res = (
-                supabase.table("raw_daily_prices_unit")
-                .select("product_url, date, unit_normal_price, unit_sale_price")
-                .in_("product_url", selected_products)
-                .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                .execute()
-            )
-            raw_df = pd.DataFrame(raw_res.data) if raw_res.data else pd.DataFrame()
-            if not raw_df.empty:
-                raw_df["date"] = pd.to_datetime(raw_df["date"]).dt.strftime("%Y-%m-%d")
-                raw_df["unit_normal_price"] = pd.to_numeric(raw_df["unit_normal_price"], errors="coerce")
-                raw_df["unit_sale_price"] = pd.to_numeric(raw_df["unit_sale_price"], errors="coerce")
-
-            def get_price_cols(product_url, date_str):
-                """raw_daily_prices_unit에서 정상가/할인가/할인율 반환"""
-                if raw_df.empty:
-                    return None, None, None
-                row = raw_df[
-                    (raw_df["product_url"] == product_url) &
-                    (raw_df["date"] == date_str)
-                ]
-                if row.empty:
+                    with col_name:
+                        html = (
+                            f"<div style='display:flex; align-items:center; gap:12px;'>"
+                            f"<span style='color:{hex_color}; font-size:22px; line-height:1; flex:0 0 auto;'>●</span>"
+                            f"<div style='white-space:normal; word-break:keep-all; overflow-wrap:break-word; line-height:1.4;'>"
+                            f"<b>{label}</b>"
+                            f"</div>"
+                            f"</div>"
+                        )
+                        st.markdown(html, unsafe_allow_html=True)
+
+            # =========================
+            # 🔥 엑셀 다운로드
+            # =========================
+            with download_placeholder:
+
+                from io import BytesIO
+                import openpyxl
+                from openpyxl.styles import Font, Alignment, PatternFill
+                from openpyxl.utils import get_column_letter
+
+                # 🔥 rerun마다 재조회하지 않도록 캐시된 벌크 로더 재사용 (타임라인 영역과 동일 캐시 적중)
+                raw_unit_xl = load_raw_unit_bulk(selected_key, filter_date_from, filter_date_to)
+
+                # 🔥 호출마다 전체 프레임 boolean 스캔 대신 (url, date) 키 O(1) 조회
+                raw_price_by_key = (
+                    {
+                        (u, d): (n, s)
+                        for u, d, n, s in zip(
+                            raw_unit_xl["product_url"],
+                            raw_unit_xl["date"].dt.strftime("%Y-%m-%d"),
+                            raw_unit_xl["unit_normal_price"],
+                            raw_unit_xl["unit_sale_price"],
+                        )
+                    }
+                    if not raw_unit_xl.empty else {}
+                )
+
+                def get_price_cols(product_url, date_str):
+                    """raw_daily_prices_unit에서 정상가/할인가/할인율 반환"""
+                    hit = raw_price_by_key.get((product_url, date_str))
+                    if hit is None:
+                        return None, None, None
+                    norm, disc = hit
+                    norm = float(norm) if pd.notna(norm) else None
+                    disc = float(disc) if pd.notna(disc) else None
+                    if norm and disc and norm > 0 and disc > 0 and norm >= disc:
+                        rate = round((norm - disc) / norm * 100, 1)
+                        return round(norm, 1), round(disc, 1), rate
+                    elif norm and norm > 0:
+                        return round(norm, 1), None, None
                     return None, None, None
-                norm = row.iloc[0]["unit_normal_price"]
-                disc = row.iloc[0]["unit_sale_price"]
-                norm = float(norm) if pd.notna(norm) else None
-                disc = float(disc) if pd.notna(disc) else None
-                if norm and disc and norm > 0 and disc > 0 and norm >= disc:
-                    rate = round((norm - disc) / norm * 100, 1)
-                    return round(norm, 1), round(disc, 1), rate
-                elif norm and norm > 0:
-                    return round(norm, 1), None, None
-                return None, None, None
-
-            excel_rows = []
-
-            for product_url in selected_products:
-                product_row = df_all[df_all["product_url"] == product_url]
-                if product_row.empty:
-                    continue
-                p_row = product_row.iloc[0]
-                brand = str(p_row["brand"]).strip()
-                pname = str(p_row["product_name"]).strip()
-                if p_row["brand"] == "네스프레소":
-                    cat2 = str(p_row.get("category2") or "").strip()
-                    product_name_full = f"{cat2} - {pname}" if cat2 else pname
-                else:
-                    product_name_full = pname
-
-                # 이벤트 히스토리와 동일한 로직으로 이벤트 수집
-                ev_rows = []
-
-                # 1) 할인 시작/종료 - raw_daily_prices에서 직접 계산
-                raw_xl_res = (
-                    supabase.table("raw_daily_prices")
-                    .select("date, normal_price, sale_price")
-                    .eq("product_url", product_url)
-                    .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                    .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                    .order("date", desc=False)
-                    .execute()
+
+                # 🔥 제품별 정상가/할인가 변동 쿼리도 캐시된 벌크 dict로 대체
+                normal_events_xl = load_normal_events_bulk(
+                    selected_key,
+                    filter_date_from.strftime("%Y-%m-%d"),
+                    filter_date_to.strftime("%Y-%m-%d")
+                )
+                price_change_by_url = load_price_change_bulk(
+                    selected_key,
+                    filter_date_from.strftime("%Y-%m-%d"),
+                    filter_date_to.strftime("%Y-%m-%d")
                 )
-                if raw_xl_res.data:
-                    raw_xl = pd.DataFrame(raw_xl_res.data)
-                    raw_xl["normal_price"] = pd.to_numeric(raw_xl["normal_price"], errors="coerce").fillna(0)
-                    raw_xl["sale_price"] = pd.to_numeric(raw_xl["sale_price"], errors="coerce").fillna(0)
-                    cc_xl = float(p_row.get("capsule_count") or 1)
-                    raw_xl["is_disc"] = (
-                        (raw_xl["normal_price"] > 0) &
-                        (raw_xl["sale_price"] > 0) &
-                        (raw_xl["sale_price"] < raw_xl["normal_price"])
-                    )
-                    raw_xl["prev_is_disc"] = raw_xl["is_disc"].shift(1, fill_value=False)
-                    raw_xl["prev_sale"] = raw_xl["sale_price"].shift(1, fill_value=0)
 
-                    for _, rr in raw_xl.iterrows():
-                        date_str = str(rr["date"])
-                        norm_u = round(rr["normal_price"] / cc_xl, 1)
-                        sale_u = round(rr["sale_price"] / cc_xl, 1)
+                excel_rows = []
 
-                        if rr["is_disc"] and not rr["prev_is_disc"]:
-                            rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
-                            ev_rows.append({
-                                "날짜": date_str,
-                                "이벤트": "💸 할인 시작",
-                                "정상가": norm_u, "할인가": sale_u, "할인율": f"{rate:.1f}%"
-                            })
-                        elif not rr["is_disc"] and rr["prev_is_disc"] and rr["normal_price"] > 0:
+                for product_url in selected_products:
+                    p_row = get_product_row(product_url)
+                    if p_row is None:
+                        continue
+                    brand = str(p_row["brand"]).strip()
+                    pname = str(p_row["product_name"]).strip()
+                    if p_row["brand"] == "네스프레소":
+                        cat2 = str(p_row.get("category2") or "").strip()
+                        product_name_full = f"{cat2} - {pname}" if cat2 else pname
+                    else:
+                        product_name_full = pname
+
+                    # 이벤트 히스토리와 동일한 로직으로 이벤트 수집
+                    ev_rows = []
+
+                    # 1) 할인 시작/종료 - raw_daily_prices에서 직접 계산 (캐시된 벌크 슬라이스 재사용)
+                    raw_xl_slice = raw_daily_by_url.get(product_url, df_raw_daily_all.iloc[0:0])
+                    if not raw_xl_slice.empty:
+                        # is_disc/prev_is_disc/prev_sale는 벌크 프레임에 선계산됨
+                        raw_xl = raw_xl_slice.assign(
+                            normal_price=raw_xl_slice["normal_price"].fillna(0),
+                            sale_price=raw_xl_slice["sale_price"].fillna(0),
+                        )
+                        cc_xl = float(p_row.get("capsule_count") or 1)
+
+                        for _, rr in raw_xl.iterrows():
+                            date_str = str(rr["date"])
+                            norm_u = round(rr["normal_price"] / cc_xl, 1)
+                            sale_u = round(rr["sale_price"] / cc_xl, 1)
+
+                            if rr["is_disc"] and not rr["prev_is_disc"]:
+                                rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
+                                ev_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": "💸 할인 시작",
+                                    "정상가": norm_u, "할인가": sale_u, "할인율": f"{rate:.1f}%"
+                                })
+                            elif not rr["is_disc"] and rr["prev_is_disc"] and rr["normal_price"] > 0:
+                                ev_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": "💸 할인 종료",
+                                    "정상가": norm_u, "할인가": None, "할인율": None
+                                })
+                            elif rr["is_disc"] and rr["prev_is_disc"] and abs(rr["sale_price"] - rr["prev_sale"]) > 0.5:
+                                direction = "💸 할인가 하락" if rr["sale_price"] < rr["prev_sale"] else "💸 할인가 상승"
+                                rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
+                                ev_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": direction,
+                                    "정상가": norm_u, "할인가": sale_u, "할인율": f"{rate:.1f}%"
+                                })
+
+                    # 2) 라이프사이클 이벤트 (신제품, 품절, 복원) — 캐시된 벌크 슬라이스 재사용
+                    lc_slice = life_by_url.get(product_url, df_lifecycle_all.iloc[0:0]).dropna(subset=["date"])
+                    lc_map = {
+                        "NEW_PRODUCT": "🆕 신제품",
+                        "OUT_OF_STOCK": "❌ 품절",
+                        "RESTOCK": "🔄 복원",
+                    }
+                    for lc_date, ev_type in zip(lc_slice["date"], lc_slice["lifecycle_event"]):
+                        ev_label = lc_map.get(ev_type, "")
+                        if not ev_label:
+                            continue
+                        lc_date_str = lc_date.strftime("%Y-%m-%d")
+                        if ev_type == "OUT_OF_STOCK":
+                            prev_date = (lc_date - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+                            n, d, r = get_price_cols(product_url, prev_date)
                             ev_rows.append({
-                                "날짜": date_str,
-                                "이벤트": "💸 할인 종료",
-                                "정상가": norm_u, "할인가": None, "할인율": None
+                                "날짜": lc_date_str, "이벤트": ev_label,
+                                "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
                             })
-                        elif rr["is_disc"] and rr["prev_is_disc"] and abs(rr["sale_price"] - rr["prev_sale"]) > 0.5:
-                            direction = "💸 할인가 하락" if rr["sale_price"] < rr["prev_sale"] else "💸 할인가 상승"
-                            rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
+                        elif ev_type in ("RESTOCK", "NEW_PRODUCT"):
+                            n, d, r = get_price_cols(product_url, lc_date_str)
                             ev_rows.append({
-                                "날짜": date_str,
-                                "이벤트": direction,
-                                "정상가": norm_u, "할인가": sale_u, "할인율": f"{rate:.1f}%"
+                                "날짜": lc_date_str, "이벤트": ev_label,
+                                "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
                             })
 
-                # 2) 라이프사이클 이벤트 (신제품, 품절, 복원)
-                lc_res = (
-                    supabase.table("product_lifecycle_events")
-                    .select("date, lifecycle_event")
-                    .eq("product_url", product_url)
-                    .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                    .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                    .execute()
-                )
-                lc_map = {
-                    "NEW_PRODUCT": "🆕 신제품",
-                    "OUT_OF_STOCK": "❌ 품절",
-                    "RESTOCK": "🔄 복원",
-                }
-                for lc in (lc_res.data or []):
-                    ev_type = lc["lifecycle_event"]
-                    ev_label = lc_map.get(ev_type, "")
-                    if not ev_label:
-                        continue
-                    if ev_type == "OUT_OF_STOCK":
-                        prev_date = (pd.Timestamp(lc["date"]) - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
-                        n, d, r = get_price_cols(product_url, prev_date)
+                    # 3) 정상가 변동 — 캐시된 벌크 dict 재사용
+                    cc = float(p_row.get("capsule_count") or 0)
+                    for nr in normal_events_xl.get(product_url, []):
+                        prev_p = float(nr["prev_price"])
+                        curr_p = float(nr["normal_price"])
+                        if curr_p == 0 or prev_p == 0:
+                            continue
+                        diff = curr_p - prev_p
+                        ev_label = "📈 정상가 상승" if diff > 0 else "📉 정상가 하락"
+                        n, d, r = get_price_cols(product_url, nr["date"])
                         ev_rows.append({
-                            "날짜": lc["date"], "이벤트": ev_label,
+                            "날짜": nr["date"], "이벤트": ev_label,
                             "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
                         })
-                    elif ev_type in ("RESTOCK", "NEW_PRODUCT"):
-                        n, d, r = get_price_cols(product_url, lc["date"])
+
+                    # 4) 할인가 변동 — 캐시된 벌크 dict 재사용
+                    chg_label_map = {
+                        "DISCOUNT_DOWN": "💸 할인가 하락",
+                        "DISCOUNT_UP": "💸 할인가 상승",
+                    }
+                    for chg in price_change_by_url.get(product_url, []):
+                        n, d, r = get_price_cols(product_url, chg["date"])
                         ev_rows.append({
-                            "날짜": lc["date"], "이벤트": ev_label,
+                            "날짜": chg["date"],
+                            "이벤트": chg_label_map.get(chg["price_change_type"], ""),
                             "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
                         })
 
-                # 3) 정상가 변동
-                normal_res = (
-                    supabase.table("product_normal_price_events")
-                    .select("date, prev_price, normal_price, price_diff")
-                    .eq("product_url", product_url)
-                    .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                    .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                    .execute()
-                )
-                cc = float(p_row.get("capsule_count") or 0)
-                for nr in (normal_res.data or []):
-                    prev_p = float(nr["prev_price"])
-                    curr_p = float(nr["normal_price"])
-                    if curr_p == 0 or prev_p == 0:
-                        continue
-                    diff = curr_p - prev_p
-                    ev_label = "📈 정상가 상승" if diff > 0 else "📉 정상가 하락"
-                    n, d, r = get_price_cols(product_url, nr["date"])
-                    ev_rows.append({
-                        "날짜": nr["date"], "이벤트": ev_label,
-                        "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
-                    })
+                    # 중복 제거 후 날짜순 정렬
+                    seen = set()
+                    deduped = []
+                    for ev in sorted(ev_rows, key=lambda x: x["날짜"]):
+                        key = (ev["날짜"], ev["이벤트"])
+                        if key not in seen:
+                            seen.add(key)
+                            deduped.append(ev)
+
+                    for ev in deduped:
+                        excel_rows.append({
+                            "브랜드": brand,
+                            "제품명": product_name_full,
+                            "날짜": ev["날짜"],
+                            "이벤트": ev["이벤트"],
+                            "정상가": ev["정상가"],
+                            "할인가": ev["할인가"],
+                            "할인율": ev["할인율"],
+                        })
 
-                # 4) 할인가 변동
-                chg_res = (
-                    supabase.table("product_price_change_events")
-                    .select("date, price_change_type, unit_price, prev_price")
-                    .eq("product_url", product_url)
-                    .in_("price_change_type", ["DISCOUNT_DOWN", "DISCOUNT_UP"])
-                    .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                    .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                    .execute()
-                )
-                chg_label_map = {
-                    "DISCOUNT_DOWN": "💸 할인가 하락",
-                    "DISCOUNT_UP": "💸 할인가 상승",
-                }
-                for chg in (chg_res.data or []):
-                    n, d, r = get_price_cols(product_url, chg["date"])
-                    ev_rows.append({
-                        "날짜": chg["date"],
-                        "이벤트": chg_label_map.get(chg["price_change_type"], ""),
-                        "정상가": n, "할인가": d, "할인율": f"{r:.1f}%" if r else None
-                    })
+                if not excel_rows:
+                    st.info("다운로드할 이벤트 데이터가 없습니다.")
+                else:
+                    excel_data = pd.DataFrame(excel_rows)
+                    excel_data = excel_data.sort_values(["브랜드", "제품명", "날짜"], ascending=[True, True, False])
+
+                    output = BytesIO()
+                    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+                        excel_data.to_excel(writer, sheet_name="이벤트 히스토리", index=False)
+                        ws = writer.sheets["이벤트 히스토리"]
+
+                        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+                        header_font = Font(bold=True, color="FFFFFF")
+                        for cell in ws[1]:
+                            cell.fill = header_fill
+                            cell.font = header_font
+                            cell.alignment = Alignment(horizontal="center")
+
+                        # 정상가/할인가 숫자 포맷
+                        col_idx_map = {cell.value: cell.column for cell in ws[1]}
+                        for col_name in ["정상가", "할인가"]:
+                            col_idx = col_idx_map.get(col_name)
+                            if col_idx:
+                                for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
+                                    for cell in row:
+                                        if cell.value is not None:
+                                            cell.number_format = '#,##0.0'
+
+                        for i, col_name in enumerate(excel_data.columns, start=1):
+                            series_as_str = excel_data[col_name].astype(str).fillna("")
+                            max_len = max([len(str(col_name))] + series_as_str.map(len).tolist())
+                            width = min(max(max_len + 2, 10), 60)
+                            ws.column_dimensions[get_column_letter(i)].width = width
+
+                    output.seek(0)
+
+                    st.download_button(
+                        label="📥 엑셀 다운로드",
+                        data=output.getvalue(),
+                        file_name=f"Coffee Capsule Price Intelligence_{datetime.now().strftime('%Y%m%d')}.xlsx",
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True
+                    )
 
-                # 중복 제거 후 날짜순 정렬
-                seen = set()
-                deduped = []
-                for ev in sorted(ev_rows, key=lambda x: x["날짜"]):
-                    key = (ev["날짜"], ev["이벤트"])
-                    if key not in seen:
-                        seen.add(key)
-                        deduped.append(ev)
-
-                for ev in deduped:
-                    excel_rows.append({
-                        "브랜드": brand,
-                        "제품명": product_name_full,
-                        "날짜": ev["날짜"],
-                        "이벤트": ev["이벤트"],
-                        "정상가": ev["정상가"],
-                        "할인가": ev["할인가"],
-                        "할인율": ev["할인율"],
-                    })
+        else:
+            st.info("다운로드할 데이터가 없습니다.")
 
-            if not excel_rows:
-                st.info("다운로드할 이벤트 데이터가 없습니다.")
-            else:
-                excel_data = pd.DataFrame(excel_rows)
-                excel_data = excel_data.sort_values(["브랜드", "제품명", "날짜"], ascending=[True, True, False])
-
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine="openpyxl") as writer:
-                    excel_data.to_excel(writer, sheet_name="이벤트 히스토리", index=False)
-                    ws = writer.sheets["이벤트 히스토리"]
-
-                    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-                    header_font = Font(bold=True, color="FFFFFF")
-                    for cell in ws[1]:
-                        cell.fill = header_fill
-                        cell.font = header_font
-                        cell.alignment = Alignment(horizontal="center")
-
-                    # 정상가/할인가 숫자 포맷
-                    col_idx_map = {cell.value: cell.column for cell in ws[1]}
-                    for col_name in ["정상가", "할인가"]:
-                        col_idx = col_idx_map.get(col_name)
-                        if col_idx:
-                            for row in ws.iter_rows(min_row=2, min_col=col_idx, max_col=col_idx):
-                                for cell in row:
-                                    if cell.value is not None:
-                                        cell.number_format = '#,##0.0'
-
-                    for i, col_name in enumerate(excel_data.columns, start=1):
-                        series_as_str = excel_data[col_name].astype(str).fillna("")
-                        max_len = max([len(str(col_name))] + series_as_str.map(len).tolist())
-                        width = min(max(max_len + 2, 10), 60)
-                        ws.column_dimensions[get_column_letter(i)].width = width
-
-                output.seek(0)
-
-                st.download_button(
-                    label="📥 엑셀 다운로드",
-                    data=output.getvalue(),
-                    file_name=f"Coffee Capsule Price Intelligence_{datetime.now().strftime('%Y%m%d')}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
+        # =========================
+        # 8-2️⃣ 제품별 카드
+        # =========================
 
-    else:
-        st.info("다운로드할 데이터가 없습니다.")
+        # 🔥 할인 기간은 카드 루프 밖에서 벌크 1회 조회 (제품당 1쿼리 → 전체 1쿼리)
+        discount_periods_by_url = load_discount_periods_bulk(
+            selected_key,
+            filter_date_from.strftime("%Y-%m-%d"),
+            filter_date_to.strftime("%Y-%m-%d")
+        )
 
-    # =========================
-    # 8-2️⃣ 제품별 카드
-    # =========================
+        # 🔥 raw_daily 벌크 프레임(df_raw_daily_all/raw_daily_by_url)은 타임라인 영역에서 이미 준비됨
+        normal_events_by_url = load_normal_events_bulk(
+            selected_key,
+            filter_date_from.strftime("%Y-%m-%d"),
+            filter_date_to.strftime("%Y-%m-%d")
+        )
 
-    for product_url in selected_products:
+        # 🔥 신제품 배지용 최신 발견일은 groupby 1회로 선계산 (제품별 lifecycle 필터 제거)
+        latest_new_by_url = (
+            df_lifecycle_all.loc[df_lifecycle_all["lifecycle_event"] == "NEW_PRODUCT"]
+            .groupby("product_url")["date"].max()
+            if not df_lifecycle_all.empty else pd.Series(dtype="datetime64[ns]")
+        )
 
-        product_row = df_all[df_all["product_url"] == product_url]
+        # 🔥 이벤트 히스토리의 날짜별 가격도 벌크 프레임에서 (url, date) O(1) 조회 — 이벤트당 쿼리 제거
+        raw_unit_price_by_key = (
+            {
+                (u, d): (n, s)
+                for u, d, n, s in zip(
+                    df_raw_unit_all["product_url"],
+                    df_raw_unit_all["date"].dt.strftime("%Y-%m-%d"),
+                    df_raw_unit_all["unit_normal_price"],
+                    df_raw_unit_all["unit_sale_price"],
+                )
+            }
+            if not df_raw_unit_all.empty else {}
+        )
 
-        if product_row.empty:
-            st.session_state.selected_products.discard(product_url)
-            continue
+        def get_raw_price_str(product_url, date_str):
+            """벌크 로드된 raw_daily_prices_unit에서 해당 날짜 가격 문자열 반환"""
+            hit = raw_unit_price_by_key.get((product_url, date_str))
+            if hit is None:
+                return ""
+            norm, disc = hit
+            norm = float(norm) if pd.notna(norm) else None
+            disc = float(disc) if pd.notna(disc) else None
+            if norm and disc and norm > 0 and disc > 0 and norm >= disc:
+                disc_rate = (norm - disc) / norm * 100
+                return f"정상가: {norm:,.1f}원 | 할인가: {disc:,.1f}원 | 할인율: {disc_rate:.1f}%"
+            elif norm and norm > 0:
+                return f"정상가: {norm:,.1f}원"
+            return ""
+
+        # 🔥 제품마다 4열 st.metric 그리드를 만드는 대신 비교 요약을 st.dataframe 1회로 렌더
+        #    (제품 수만큼 늘던 컴포넌트 트리/웹소켓 페이로드가 표 하나로 고정)
+        overview_rows = []
+        for _url in selected_products:
+            _p = get_product_row(_url)
+            if _p is None:
+                continue
+            _nv = _p.get("normal_unit_price")
+            if _nv is not None and pd.notna(_nv):
+                _price_str = "품절" if float(_nv) == 0 else f"{float(_nv):,.1f}원"
+            else:
+                _price_str = "-"
+            _discs = discount_periods_by_url.get(_p["product_url"], [])
+            _disc_str = (
+                f"{len(_discs)}회 (최근 {_discs[-1]['discount_start_date']} ~ {_discs[-1]['discount_end_date']})"
+                if _discs else "-"
+            )
+            overview_rows.append({
+                "제품": format_product_label(_p),
+                "개당 정상가": _price_str,
+                "할인 구간": _disc_str,
+                "신제품": "🆕" if _p.get("is_new_product") else "",
+                "관측 시작": _p.get("first_seen_date"),
+                "마지막 관측": _p.get("last_seen_date"),
+                "이벤트 수": _p.get("event_count"),
+            })
+        if overview_rows:
+            st.dataframe(
+                pd.DataFrame(overview_rows),
+                use_container_width=True,
+                hide_index=True,
+            )
 
-        p = product_row.iloc[0]
-        label = format_product_label(p)
-        st.markdown(f"### {label}")
-
-        df_life = load_lifecycle_events(p["product_url"])
-        if not df_life.empty:
-            df_life["date"] = pd.to_datetime(df_life["date"], errors="coerce")
-            df_life = df_life.dropna(subset=["date"])
-            df_life = df_life[
-                (df_life["date"] >= pd.Timestamp(filter_date_from)) &
-                (df_life["date"] <= pd.Timestamp(filter_date_to))
-            ]
+        for product_url in selected_products:
 
-        normal_change_res = (
-            supabase.table("product_normal_price_events")
-            .select("date, prev_price, normal_price, price_diff")
-            .eq("product_url", p["product_url"])
-            .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-            .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-            .order("date", desc=True)
-            .limit(1)
-            .execute()
-        )
+            p = get_product_row(product_url)
 
-        normal_change_rows = normal_change_res.data if normal_change_res.data else []
+            if p is None:
+                st.session_state.selected_products.discard(product_url)
+                continue
 
-        c1, c2, c3, c4 = st.columns(4)
+            label = format_product_label(p)
+            st.markdown(f"### {label}")
 
-        with c1:
-            normal_value = p.get("normal_unit_price")
-            if normal_value is not None and pd.notna(normal_value):
-                if float(normal_value) == 0:
-                    st.metric("개당 정상가", "품절", delta="재고 없음")
-                else:
-                    st.metric("개당 정상가", f"{float(normal_value):,.1f}원")
-            else:
-                st.metric("개당 정상가", "-")
+            # 🔥 벌크 프레임 슬라이스 재사용 (제품별 재로딩/재파싱 제거)
+            df_life = life_by_url.get(p["product_url"], df_lifecycle_all.iloc[0:0]).dropna(subset=["date"])
 
-        cards = []
-        # raw_daily_prices에서 직접 할인 기간 계산
-        def calc_disc_periods_for_card(product_url, dfrom, dto):
-            r = (
-                supabase.table("raw_daily_prices")
-                .select("date, normal_price, sale_price")
-                .eq("product_url", product_url)
-                .gte("date", dfrom)
-                .lte("date", dto)
-                .order("date", desc=False)
-                .execute()
-            )
-            if not r.data:
-                return []
-            periods = []
-            start = None
-            prev_date = None
-            prev_sale = None
-            for rd in r.data:
-                n = float(rd["normal_price"]) if rd["normal_price"] else 0
-                s = float(rd["sale_price"]) if rd["sale_price"] else 0
-                is_disc = n > 0 and s > 0 and s < n
-                if is_disc:
-                    if start is None:
-                        start = rd["date"]
-                    prev_date = rd["date"]
-                    prev_sale = s
-                else:
-                    if start is not None:
-                        periods.append({
-                            "discount_start_date": start,
-                            "discount_end_date": prev_date,
-                            "_last_price": prev_sale
-                        })
-                        start = None
-            if start is not None:
-                periods.append({
-                    "discount_start_date": start,
-                    "discount_end_date": prev_date,
-                    "_last_price": prev_sale
-                })
-            return periods
+            # 🔥 벌크 조회분에서 최신 1건만 사용 (url별 날짜 내림차순 정렬됨)
+            normal_change_rows = normal_events_by_url.get(p["product_url"], [])[:1]
 
-        discount_rows = calc_disc_periods_for_card(
-            p["product_url"],
-            filter_date_from.strftime("%Y-%m-%d"),
-            filter_date_to.strftime("%Y-%m-%d")
-        )
+            # (개당 정상가 등 비교 지표는 루프 앞의 요약 st.dataframe으로 이동)
+            cards = []
+            discount_rows = discount_periods_by_url.get(p["product_url"], [])
 
-        if discount_rows:
-            last = discount_rows[-1]
-            last_price = last.get("_last_price")
-            cc_card = float(p.get("capsule_count") or 1)
-            last_price_unit = round(last_price / cc_card, 1) if last_price else None
-            price_str = f"<br>마지막 할인가: {last_price_unit:,.1f}원" if last_price_unit else ""
-            cards.append(render_card(
-                "#e9f3ec",
-                "#2f7d32",
-                "💸 할인",
-                f"총 {len(discount_rows)}회 | 최근: {last['discount_start_date']} ~ {last['discount_end_date']}{price_str}"
-            ))
-        if not df_life.empty:
-            new_events = df_life[df_life["lifecycle_event"] == "NEW_PRODUCT"]
-            if not new_events.empty:
-                latest_new = new_events.sort_values("date", ascending=False).iloc[0]
+            if discount_rows:
+                last = discount_rows[-1]
+                last_price = last.get("_last_price")
+                cc_card = float(p.get("capsule_count") or 1)
+                last_price_unit = round(last_price / cc_card, 1) if last_price else None
+                price_str = f"<br>마지막 할인가: {last_price_unit:,.1f}원" if last_price_unit else ""
+                cards.append(render_card(
+                    "#e9f3ec",
+                    "#2f7d32",
+                    "💸 할인",
+                    f"총 {len(discount_rows)}회 | 최근: {last['discount_start_date']} ~ {last['discount_end_date']}{price_str}"
+                ))
+            # 🔥 요약 테이블의 is_new_product를 우선 신뢰 — False면 lifecycle 조회 자체를 생략
+            _summary_new = p.get("is_new_product")
+            if _summary_new is not None and pd.notna(_summary_new) and not _summary_new:
+                latest_new_date = None
+            else:
+                latest_new_date = latest_new_by_url.get(p["product_url"])
+            if latest_new_date is not None and pd.notna(latest_new_date):
                 cards.append(render_card(
                     bg="#f6f1e6",
                     border="#c88a00",
                     title="🆕 신제품",
-                    content=f"발견일: {latest_new['date'].date()}"
+                    content=f"발견일: {latest_new_date.date()}"
                 ))
 
-        if not df_life.empty:
-            restore_events = df_life[df_life["lifecycle_event"] == "RESTOCK"]
-            if not restore_events.empty:
-                restore_dates_str = "<br>".join([
-                    f"날짜: {r['date'].date()}"
-                    for _, r in restore_events.sort_values("date", ascending=False).iterrows()
-                ])
-                cards.append(render_card(
-                    bg="#fff8e1",
-                    border="#f59e0b",
-                    title="🔄 복원",
-                    content=restore_dates_str
-                ))
-
-        raw_res = (
-            supabase.table("raw_daily_prices")
-            .select("date, normal_price")
-            .eq("product_url", p["product_url"])
-            .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-            .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-            .order("date", desc=False)
-            .execute()
-        )
-        if raw_res.data:
-            raw_df = pd.DataFrame(raw_res.data)
-            raw_df["normal_price"] = raw_df["normal_price"].astype(float)
-            raw_df["date"] = pd.to_datetime(raw_df["date"])
-
-            out_rows = raw_df[raw_df["normal_price"] == 0].copy()
-            out_rows["prev_normal"] = raw_df["normal_price"].shift(1)
-            out_start_rows = out_rows[out_rows["prev_normal"] != 0]
-            lifecycle_out_dates = []
             if not df_life.empty:
-                lifecycle_out_dates = [
-                    str(d.date()) for d in df_life[df_life["lifecycle_event"] == "OUT_OF_STOCK"]["date"].tolist()
-                ]
-            missing_out = out_start_rows[~out_start_rows["date"].dt.strftime("%Y-%m-%d").isin(lifecycle_out_dates)]
-
-            all_out_dates = lifecycle_out_dates + [
-                str(r["date"].date()) for _, r in missing_out.iterrows()
-            ]
-            all_out_dates = sorted(list(set(all_out_dates)), reverse=True)
-            all_out_dates = [d for d in all_out_dates if d and str(d) != "NaT"]
-
-            if all_out_dates and not any("품절" in c for c in cards):
-                out_dates_str = "<br>".join([f"날짜: {d}" for d in all_out_dates])
-                cards.append(render_card(
-                    bg="#e8f0f8",
-                    border="#2c5aa0",
-                    title="❌ 품절",
-                    content=out_dates_str
-                ))
-
-            raw_df["prev_price"] = raw_df["normal_price"].shift(1)
-            restore_rows = raw_df[(raw_df["prev_price"] == 0) & (raw_df["normal_price"] > 0)]
-            if not restore_rows.empty and not any("복원" in c for c in cards):
-                restore_dates_str = "<br>".join([f"날짜: {r['date'].date()}" for _, r in restore_rows.iterrows()])
-                cards.append(render_card(
-                    bg="#fff8e1",
-                    border="#f59e0b",
-                    title="🔄 복원",
-                    content=restore_dates_str
-                ))
+                restore_events = df_life[df_life["lifecycle_event"] == "RESTOCK"]
+                if not restore_events.empty:
+                    restore_dates_str = "<br>".join([
+                        f"날짜: {r['date'].date()}"
+                        for _, r in restore_events.sort_values("date", ascending=False).iterrows()
+                    ])
+                    cards.append(render_card(
+                        bg="#fff8e1",
+                        border="#f59e0b",
+                        title="🔄 복원",
+                        content=restore_dates_str
+                    ))
 
-        if normal_change_rows:
-            latest_change = normal_change_rows[0]
-            prev_price = float(latest_change["prev_price"])
-            current_price = float(latest_change["normal_price"])
-            change_date = latest_change["date"]
+            raw_slice = raw_daily_by_url.get(p["product_url"], df_raw_daily_all.iloc[0:0])
+            if not raw_slice.empty:
+                raw_df = raw_slice.assign(date=raw_slice["date_dt"])
 
-            # ✅ 할인 시작일이면 정상가 카드 무시
-            is_discount_start = any(
-                r.get("discount_start_date") == change_date
-                for r in discount_rows
-            )
+                # 🔥 copy 후 열 추가 대신 assign 1회 — shift 결과는 인덱스 정렬로 슬라이스에 맞춰짐
+                out_rows = raw_df.loc[raw_df["normal_price"] == 0].assign(
+                    prev_normal=raw_df["normal_price"].shift(1)
+                )
+                out_start_rows = out_rows[out_rows["prev_normal"] != 0]
+                lifecycle_out_dates = []
+                if not df_life.empty:
+                    lifecycle_out_dates = [
+                        str(d.date()) for d in df_life[df_life["lifecycle_event"] == "OUT_OF_STOCK"]["date"].tolist()
+                    ]
+                missing_out = out_start_rows[~out_start_rows["date"].dt.strftime("%Y-%m-%d").isin(lifecycle_out_dates)]
 
-            if not is_discount_start:
-                if current_price == 0:
-                    already_has_out = any("품절" in c for c in cards)
-                    if not already_has_out:
-                        cards.append(render_card(
-                            bg="#e8f0f8",
-                            border="#2c5aa0",
-                            title="❌ 품절",
-                            content=f"날짜: {latest_change['date']}<br>정상가 {prev_price:,.0f}원 → 품절"
-                        ))
-                elif prev_price == 0 and current_price > 0:
-                    already_has_restore = any("복원" in c for c in cards)
-                    if not already_has_restore:
-                        cards.append(render_card(
-                            bg="#fff8e1",
-                            border="#f59e0b",
-                            title="🔄 복원",
-                            content=f"날짜: {latest_change['date']}<br>품절 → 정상가 {current_price:,.0f}원"
-                        ))
-                else:
-                    diff = current_price - prev_price
-                    diff_rate = (diff / prev_price) * 100 if prev_price != 0 else 0
-                    if diff > 0:
-                        bg = "#fdecea"
-                        border = "#b91c1c"
-                        icon = "📈 정상가 상승"
-                    else:
-                        bg = "#eaf2ff"
-                        border = "#1d4ed8"
-                        icon = "📉 정상가 하락"
+                all_out_dates = lifecycle_out_dates + [
+                    str(r["date"].date()) for _, r in missing_out.iterrows()
+                ]
+                all_out_dates = sorted(list(set(all_out_dates)), reverse=True)
+                all_out_dates = [d for d in all_out_dates if d and str(d) != "NaT"]
 
-                    cc = float(p.get("capsule_count") or 0)
-                    if cc > 0:
-                        prev_unit = prev_price / cc
-                        curr_unit = current_price / cc
-                        price_text = (
-                            f"{prev_unit:,.1f}원 → {curr_unit:,.1f}원 "
-                            f"({diff_rate:+.1f}%)"
-                        )
-                    else:
-                        price_text = (
-                            f"{prev_price:,.0f}원 → {current_price:,.0f}원 "
-                            f"({diff_rate:+.1f}%)"
-                        )
+                if all_out_dates and not any("품절" in c for c in cards):
+                    out_dates_str = "<br>".join([f"날짜: {d}" for d in all_out_dates])
+                    cards.append(render_card(
+                        bg="#e8f0f8",
+                        border="#2c5aa0",
+                        title="❌ 품절",
+                        content=out_dates_str
+                    ))
 
+                raw_df["prev_price"] = raw_df["normal_price"].shift(1)
+                restore_rows = raw_df[(raw_df["prev_price"] == 0) & (raw_df["normal_price"] > 0)]
+                if not restore_rows.empty and not any("복원" in c for c in cards):
+                    restore_dates_str = "<br>".join([f"날짜: {r['date'].date()}" for _, r in restore_rows.iterrows()])
                     cards.append(render_card(
-                        bg=bg,
-                        border=border,
-                        title=icon,
-                        content=(
-                            f"날짜: {latest_change['date']}<br>"
-                            f"{price_text}"
-                        )
+                        bg="#fff8e1",
+                        border="#f59e0b",
+                        title="🔄 복원",
+                        content=restore_dates_str
                     ))
-        if not cards:
-            cards.append(render_card(
-                "#f3f4f6",
-                "#9aa0a6",
-                "📊 특이 이벤트 없음",
-                ""
-            ))
-
-        for row_start in range(0, len(cards), 3):
-            row_cards = cards[row_start:row_start + 3]
-            _, col1, col2, col3 = st.columns(4)
-            for i, col in enumerate([col1, col2, col3]):
-                if i < len(row_cards):
-                    with col:
-                        st.markdown(row_cards[i], unsafe_allow_html=True)
-
-        st.markdown("<br><br>", unsafe_allow_html=True)
-
-        with st.expander("📅 이벤트 히스토리"):
-
-            display_rows = []
-
-            # 할인 시작/종료는 raw_daily_prices에서 직접 계산 (아래에서 처리)
-
-            df_life_all = load_lifecycle_events(p["product_url"])
-            if not df_life_all.empty:
-                df_life_all["date"] = pd.to_datetime(df_life_all["date"], errors="coerce")
-                df_life_all = df_life_all.dropna(subset=["date"])
-                df_life = df_life_all.copy()
-                df_life = df_life[
-                    (df_life["date"] >= pd.Timestamp(filter_date_from)) &
-                    (df_life["date"] <= pd.Timestamp(filter_date_to))
-                ]
-            else:
-                df_life = pd.DataFrame(columns=["date", "lifecycle_event"])
 
-            lifecycle_map = {
-                "NEW_PRODUCT": "🆕 신제품",
-                "OUT_OF_STOCK": "❌ 품절",
-                "RESTOCK": "🔄 복원",
-            }
+            if normal_change_rows:
+                latest_change = normal_change_rows[0]
+                prev_price = float(latest_change["prev_price"])
+                current_price = float(latest_change["normal_price"])
+                change_date = latest_change["date"]
 
-            for _, row in df_life.iterrows():
-                event_date = row["date"]
-                event_type = row["lifecycle_event"]
-                price_info = ""
-                def get_raw_price_str(product_url, date_str):
-                    """raw_daily_prices_unit에서 해당 날짜 가격 문자열 반환"""
-                    res = (
-                        supabase.table("raw_daily_prices_unit")
-                        .select("unit_normal_price, unit_sale_price")
-                        .eq("product_url", product_url)
-                        .eq("date", date_str)
-                        .limit(1)
-                        .execute()
-                    )
-                    if not res.data:
-                        return ""
-                    r = res.data[0]
-                    norm = float(r["unit_normal_price"]) if r.get("unit_normal_price") else None
-                    disc = float(r["unit_sale_price"]) if r.get("unit_sale_price") else None
-                    if norm and disc and norm > 0 and disc > 0 and norm >= disc:
-                        disc_rate = (norm - disc) / norm * 100
-                        return f"정상가: {norm:,.1f}원 | 할인가: {disc:,.1f}원 | 할인율: {disc_rate:.1f}%"
-                    elif norm and norm > 0:
-                        return f"정상가: {norm:,.1f}원"
-                    return ""
-
-                if event_type == "OUT_OF_STOCK":
-                    # 품절 직전 날짜 raw 가격 조회
-                    prev_date = (event_date - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
-                    price_str = get_raw_price_str(p["product_url"], prev_date)
-                    price_info = f"{price_str} → 품절" if price_str else "품절"
-
-                elif event_type in ("RESTOCK", "NEW_PRODUCT"):
-                    price_str = get_raw_price_str(p["product_url"], event_date.strftime("%Y-%m-%d"))
-                    if event_type == "RESTOCK":
-                        price_info = f"품절 → {price_str}" if price_str else "품절 → 복원"
-                    else:
-                        price_info = price_str
+                # ✅ 할인 시작일이면 정상가 카드 무시
+                is_discount_start = any(
+                    r.get("discount_start_date") == change_date
+                    for r in discount_rows
+                )
 
-                display_rows.append({
-                    "날짜": event_date.strftime("%Y-%m-%d"),
-                    "이벤트": lifecycle_map.get(event_type, ""),
-                    "가격 정보": price_info
-                })
+                if not is_discount_start:
+                    if current_price == 0:
+                        already_has_out = any("품절" in c for c in cards)
+                        if not already_has_out:
+                            cards.append(render_card(
+                                bg="#e8f0f8",
+                                border="#2c5aa0",
+                                title="❌ 품절",
+                                content=f"날짜: {latest_change['date']}<br>정상가 {prev_price:,.0f}원 → 품절"
+                            ))
+                    elif prev_price == 0 and current_price > 0:
+                        already_has_restore = any("복원" in c for c in cards)
+                        if not already_has_restore:
+                            cards.append(render_card(
+                                bg="#fff8e1",
+                                border="#f59e0b",
+                                title="🔄 복원",
+                                content=f"날짜: {latest_change['date']}<br>품절 → 정상가 {current_price:,.0f}원"
+                            ))
+                    else:
+                        diff = current_price - prev_price
+                        diff_rate = (diff / prev_price) * 100 if prev_price != 0 else 0
+                        if diff > 0:
+                            bg = "#fdecea"
+                            border = "#b91c1c"
+                            icon = "📈 정상가 상승"
+                        else:
+                            bg = "#eaf2ff"
+                            border = "#1d4ed8"
+                            icon = "📉 정상가 하락"
+
+                        cc = float(p.get("capsule_count") or 0)
+                        if cc > 0:
+                            prev_unit = prev_price / cc
+                            curr_unit = current_price / cc
+                            price_text = (
+                                f"{prev_unit:,.1f}원 → {curr_unit:,.1f}원 "
+                                f"({diff_rate:+.1f}%)"
+                            )
+                        else:
+                            price_text = (
+                                f"{prev_price:,.0f}원 → {current_price:,.0f}원 "
+                                f"({diff_rate:+.1f}%)"
+                            )
 
-            df_life = load_lifecycle_events(p["product_url"])
-            if not df_life.empty:
-                df_life["date"] = pd.to_datetime(df_life["date"], errors="coerce")
-                df_life = df_life.dropna(subset=["date"])
-                df_life = df_life[
-                    (df_life["date"] >= pd.Timestamp(filter_date_from)) &
-                    (df_life["date"] <= pd.Timestamp(filter_date_to))
-                ]
+                        cards.append(render_card(
+                            bg=bg,
+                            border=border,
+                            title=icon,
+                            content=(
+                                f"날짜: {latest_change['date']}<br>"
+                                f"{price_text}"
+                            )
+                        ))
+            if not cards:
+                cards.append(render_card(
+                    "#f3f4f6",
+                    "#9aa0a6",
+                    "📊 특이 이벤트 없음",
+                    ""
+                ))
 
-            df_changes_res = (
-                supabase.table("product_price_change_events")
-                .select("*")
-                .eq("product_url", p["product_url"])
-                .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                .order("date", desc=True)
-                .execute()
+            # 🔥 카드마다 st.markdown을 호출하면 제품당 N개의 컴포넌트 왕복이 발생 —
+            #    flex 그리드 HTML 하나로 합쳐 Streamlit 요소 수를 1개로 축소
+            cards_html = "".join(
+                f'<div style="flex:0 0 23%;">{c}</div>' for c in cards
             )
-
-
-            # raw_daily_prices에서 직접 할인 시작/종료 계산
-            raw_hist_res = (
-                supabase.table("raw_daily_prices")
-                .select("date, normal_price, sale_price")
-                .eq("product_url", p["product_url"])
-                .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                .order("date", desc=False)
-                .execute()
+            st.markdown(
+                f'<div style="display:flex;flex-wrap:wrap;gap:1.5%;row-gap:12px;'
+                f'margin:0 0 32px 25%;">{cards_html}</div>',
+                unsafe_allow_html=True,
             )
 
-            if raw_hist_res.data:
-                raw_hist = pd.DataFrame(raw_hist_res.data)
-                raw_hist["normal_price"] = pd.to_numeric(raw_hist["normal_price"], errors="coerce").fillna(0)
-                raw_hist["sale_price"] = pd.to_numeric(raw_hist["sale_price"], errors="coerce").fillna(0)
-                cc = float(p.get("capsule_count") or 1)
+            # 🔥 요약이 '이벤트 없음 안정'으로 확정한 제품은 히스토리 조립 파이프라인 전체를 생략
+            if str(p.get("product_event_status") or "") == "NO_EVENT_STABLE" and latest_new_date is None:
+                with st.expander("📅 이벤트 히스토리"):
+                    st.caption("이벤트 없음")
+                continue
 
-                raw_hist["is_disc"] = (
-                    (raw_hist["normal_price"] > 0) &
-                    (raw_hist["sale_price"] > 0) &
-                    (raw_hist["sale_price"] < raw_hist["normal_price"])
-                )
-                raw_hist["prev_is_disc"] = raw_hist["is_disc"].shift(1, fill_value=False)
-                raw_hist["prev_sale"] = raw_hist["sale_price"].shift(1, fill_value=0)
+            with st.expander("📅 이벤트 히스토리"):
 
-                existing_dates_events = set(
-                    (r["날짜"], r["이벤트"]) for r in display_rows
-                )
+                display_rows = []
 
-                for _, rr in raw_hist.iterrows():
-                    date_str = str(rr["date"])
-                    norm_u = round(rr["normal_price"] / cc, 1)
-                    sale_u = round(rr["sale_price"] / cc, 1)
-
-                    # 할인 시작: 이전 날 할인 아님 → 오늘 할인
-                    if rr["is_disc"] and not rr["prev_is_disc"]:
-                        key = (date_str, "💸 할인 시작")
-                        if key not in existing_dates_events:
-                            rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
-                            display_rows.append({
-                                "날짜": date_str,
-                                "이벤트": "💸 할인 시작",
-                                "가격 정보": f"정상가: {norm_u:,.1f}원 | 할인가: {sale_u:,.1f}원 | 할인율: {rate:.1f}%"
-                            })
-                            existing_dates_events.add(key)
-
-                    # 할인 종료: 이전 날 할인 → 오늘 할인 아님 (품절 아닌 경우)
-                    elif not rr["is_disc"] and rr["prev_is_disc"] and rr["normal_price"] > 0:
-                        key = (date_str, "💸 할인 종료")
-                        if key not in existing_dates_events:
-                            display_rows.append({
-                                "날짜": date_str,
-                                "이벤트": "💸 할인 종료",
-                                "가격 정보": f"정상가: {norm_u:,.1f}원"
-                            })
-                            existing_dates_events.add(key)
-
-                    # 할인 중 할인가 변동
-                    elif rr["is_disc"] and rr["prev_is_disc"] and abs(rr["sale_price"] - rr["prev_sale"]) > 0.5:
-                        direction = "💸 할인가 하락" if rr["sale_price"] < rr["prev_sale"] else "💸 할인가 상승"
-                        key = (date_str, direction)
-                        if key not in existing_dates_events:
-                            prev_sale_u = round(rr["prev_sale"] / cc, 1)
-                            rate = round((rr["normal_price"] - rr["sale_price"]) / rr["normal_price"] * 100, 1)
-                            display_rows.append({
-                                "날짜": date_str,
-                                "이벤트": direction,
-                                "가격 정보": f"정상가: {norm_u:,.1f}원 | {prev_sale_u:,.1f}원 → {sale_u:,.1f}원 | 할인율: {rate:.1f}%"
-                            })
-                            existing_dates_events.add(key)
-            normal_res = (
-                supabase.table("product_normal_price_events")
-                .select("*")
-                .eq("product_url", p["product_url"])
-                .gte("date", filter_date_from.strftime("%Y-%m-%d"))
-                .lte("date", filter_date_to.strftime("%Y-%m-%d"))
-                .execute()
-            )
+                # 할인 시작/종료는 raw_daily_prices에서 직접 계산 (아래에서 처리)
 
-            normal_rows = normal_res.data if normal_res.data else []
+                # 🔥 벌크 프레임 슬라이스 재사용 (제품별 재로딩/재파싱 제거)
+                df_life = life_by_url.get(p["product_url"], df_lifecycle_all.iloc[0:0]).dropna(subset=["date"])
 
-            for row in normal_rows:
-                prev_price = float(row["prev_price"])
-                current_price = float(row["normal_price"])
+                lifecycle_map = {
+                    "NEW_PRODUCT": "🆕 신제품",
+                    "OUT_OF_STOCK": "❌ 품절",
+                    "RESTOCK": "🔄 복원",
+                }
 
-                if current_price == 0:
-                    display_rows.append({
-                        "날짜": row["date"],
-                        "이벤트": "❌ 품절",
-                        "가격 정보": f"정상가 {prev_price:,.1f}원 → 품절"
-                    })
-                    continue
+                # 🔥 iterrows 대신 zip — 행별 dict 생성/이름 기반 접근 오버헤드 제거
+                for event_date, event_type in zip(df_life["date"], df_life["lifecycle_event"]):
+                    price_info = ""
+                    if event_type == "OUT_OF_STOCK":
+                        # 품절 직전 날짜 raw 가격 조회
+                        prev_date = (event_date - pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+                        price_str = get_raw_price_str(p["product_url"], prev_date)
+                        price_info = f"{price_str} → 품절" if price_str else "품절"
+
+                    elif event_type in ("RESTOCK", "NEW_PRODUCT"):
+                        price_str = get_raw_price_str(p["product_url"], event_date.strftime("%Y-%m-%d"))
+                        if event_type == "RESTOCK":
+                            price_info = f"품절 → {price_str}" if price_str else "품절 → 복원"
+                        else:
+                            price_info = price_str
 
-                if prev_price == 0 and current_price > 0:
                     display_rows.append({
-                        "날짜": row["date"],
-                        "이벤트": "🔄 복원",
-                        "가격 정보": f"품절 → 정상가 {current_price:,.1f}원"
+                        "날짜": event_date.strftime("%Y-%m-%d"),
+                        "이벤트": lifecycle_map.get(event_type, ""),
+                        "가격 정보": price_info
                     })
-                    continue
-
-                diff = current_price - prev_price
-                diff_rate = (diff / prev_price) * 100 if prev_price != 0 else 0
-                event_label = "📈 정상가 상승" if diff > 0 else "📉 정상가 하락"
-
-                # ✅ capsule_count로 나눠서 개당 가격 표시
-                cc = float(p.get("capsule_count") or 0)
-                if cc > 0:
-                    prev_unit = prev_price / cc
-                    curr_unit = current_price / cc
-                    price_text = f"{prev_unit:,.1f}원 → {curr_unit:,.1f}원 ({diff_rate:+.1f}%)"
-                else:
-                    price_text = f"{prev_price:,.1f}원 → {current_price:,.1f}원 ({diff_rate:+.1f}%)"
-
-                if any(r["날짜"] == row["date"] and r["이벤트"] == event_label for r in display_rows):
-                    continue
-                display_rows.append({
-                    "날짜": row["date"],
-                    "이벤트": event_label,
-                    "가격 정보": price_text
-                })
-            if display_rows:
-                df_display = pd.DataFrame(display_rows)
-                df_display["날짜_정렬용"] = pd.to_datetime(df_display["날짜"], errors="coerce")
-                # 조회 기간 필터 적용
-                df_display = df_display[
-                    (df_display["날짜_정렬용"] >= pd.Timestamp(filter_date_from)) &
-                    (df_display["날짜_정렬용"] <= pd.Timestamp(filter_date_to))
-                ]
-                df_display = df_display.sort_values("날짜_정렬용", ascending=False)
-                df_display = df_display.drop(columns=["날짜_정렬용"])
-                st.dataframe(df_display, use_container_width=True, hide_index=True)
-            else:
-                st.caption("이벤트 없음")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 
+                # raw_daily_prices에서 직접 할인 시작/종료 계산 (벌크 조회분 재사용)
+                raw_hist = raw_daily_by_url.get(p["product_url"], df_raw_daily_all.iloc[0:0])
 
+                if not raw_hist.empty:
+                    # is_disc/prev_is_disc/prev_sale는 벌크 프레임에 선계산됨
+                    raw_hist = raw_hist.assign(
+                        normal_price=raw_hist["normal_price"].fillna(0),
+                        sale_price=raw_hist["sale_price"].fillna(0),
+                    )
+                    cc = float(p.get("capsule_count") or 1)
 
+                    existing_dates_events = set(
+                        (r["날짜"], r["이벤트"]) for r in display_rows
+                    )
 
+                    # 🔥 iterrows 대신 zip — 행별 dict 생성/이름 기반 접근 오버헤드 제거
+                    for r_date, r_norm, r_sale, r_disc, r_prev_disc, r_prev_sale in zip(
+                        raw_hist["date"], raw_hist["normal_price"], raw_hist["sale_price"],
+                        raw_hist["is_disc"], raw_hist["prev_is_disc"], raw_hist["prev_sale"],
+                    ):
+                        date_str = str(r_date)
+                        norm_u = round(r_norm / cc, 1)
+                        sale_u = round(r_sale / cc, 1)
+
+                        # 할인 시작: 이전 날 할인 아님 → 오늘 할인
+                        if r_disc and not r_prev_disc:
+                            key = (date_str, "💸 할인 시작")
+                            if key not in existing_dates_events:
+                                rate = round((r_norm - r_sale) / r_norm * 100, 1)
+                                display_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": "💸 할인 시작",
+                                    "가격 정보": f"정상가: {norm_u:,.1f}원 | 할인가: {sale_u:,.1f}원 | 할인율: {rate:.1f}%"
+                                })
+                                existing_dates_events.add(key)
+
+                        # 할인 종료: 이전 날 할인 → 오늘 할인 아님 (품절 아닌 경우)
+                        elif not r_disc and r_prev_disc and r_norm > 0:
+                            key = (date_str, "💸 할인 종료")
+                            if key not in existing_dates_events:
+                                display_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": "💸 할인 종료",
+                                    "가격 정보": f"정상가: {norm_u:,.1f}원"
+                                })
+                                existing_dates_events.add(key)
+
+                        # 할인 중 할인가 변동
+                        elif r_disc and r_prev_disc and abs(r_sale - r_prev_sale) > 0.5:
+                            direction = "💸 할인가 하락" if r_sale < r_prev_sale else "💸 할인가 상승"
+                            key = (date_str, direction)
+                            if key not in existing_dates_events:
+                                prev_sale_u = round(r_prev_sale / cc, 1)
+                                rate = round((r_norm - r_sale) / r_norm * 100, 1)
+                                display_rows.append({
+                                    "날짜": date_str,
+                                    "이벤트": direction,
+                                    "가격 정보": f"정상가: {norm_u:,.1f}원 | {prev_sale_u:,.1f}원 → {sale_u:,.1f}원 | 할인율: {rate:.1f}%"
+                                })
+                                existing_dates_events.add(key)
+                normal_rows = normal_events_by_url.get(p["product_url"], [])
+
+                for row in normal_rows:
+                    prev_price = float(row["prev_price"])
+                    current_price = float(row["normal_price"])
+
+                    if current_price == 0:
+                        display_rows.append({
+                            "날짜": row["date"],
+                            "이벤트": "❌ 품절",
+                            "가격 정보": f"정상가 {prev_price:,.1f}원 → 품절"
+                        })
+                        continue
 
+                    if prev_price == 0 and current_price > 0:
+                        display_rows.append({
+                            "날짜": row["date"],
+                            "이벤트": "🔄 복원",
+                            "가격 정보": f"품절 → 정상가 {current_price:,.1f}원"
+                        })
+                        continue
 
+                    diff = current_price - prev_price
+                    diff_rate = (diff / prev_price) * 100 if prev_price != 0 else 0
+                    event_label = "📈 정상가 상승" if diff > 0 else "📉 정상가 하락"
 
+                    # ✅ capsule_count로 나눠서 개당 가격 표시
+                    cc = float(p.get("capsule_count") or 0)
+                    if cc > 0:
+                        prev_unit = prev_price / cc
+                        curr_unit = current_price / cc
+                        price_text = f"{prev_unit:,.1f}원 → {curr_unit:,.1f}원 ({diff_rate:+.1f}%)"
+                    else:
+                        price_text = f"{prev_price:,.1f}원 → {current_price:,.1f}원 ({diff_rate:+.1f}%)"
 
+                    if any(r["날짜"] == row["date"] and r["이벤트"] == event_label for r in display_rows):
+                        continue
+                    display_rows.append({
+                        "날짜": row["date"],
+                        "이벤트": event_label,
+                        "가격 정보": price_text
+                    })
+                if display_rows:
+                    # 🔥 소스(라이프사이클/raw/정상가)가 모두 조회 기간으로 서버측 필터됨 —
+                    #    재필터 없이 날짜 문자열(YYYY-MM-DD) 역순 정렬 1회로 최종 프레임 구성
+                    df_display = pd.DataFrame(display_rows).sort_values("날짜", ascending=False)
+                    st.dataframe(df_display, use_container_width=True, hide_index=True)
+                else:
+                    st.caption("이벤트 없음")
 
 
+render_results()